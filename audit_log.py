@@ -0,0 +1,242 @@
+"""Журнал запросов к YandexGPT в формате JSONL.
+
+Хук llm_client кладет описание каждого запроса в очередь в памяти (одно
+добавление в deque), а отдельный поток раз в LLM_AUDIT_FLUSH_INTERVAL секунд
+сериализует накопленное и дописывает в файл одной операцией. Файл
+ротируется по размеру и возрасту, старые файлы сжимаются gzip.
+
+Сводка по журналу:
+    python audit_log.py report
+    python audit_log.py report --since 24 logs/llm_audit*.jsonl*
+"""
+import argparse
+import glob
+import gzip
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+from collections import defaultdict, deque
+from pathlib import Path
+
+from config import (
+    LLM_AUDIT_PATH, LLM_AUDIT_TEXT, LLM_AUDIT_MAX_BYTES, LLM_AUDIT_MAX_AGE, LLM_AUDIT_KEEP,
+    LLM_AUDIT_COMPRESS, LLM_AUDIT_FLUSH_INTERVAL, LLM_AUDIT_QUEUE
+)
+
+logger = logging.getLogger(__name__)
+
+
+class AuditLog:
+    """Буферизованная запись журнала с ротацией.
+
+    write() не делает ввода-вывода и может вызываться из любого потока;
+    запись на диск идет в фоновом потоке пачками.
+    """
+
+    def __init__(self, path: str, max_bytes: int = LLM_AUDIT_MAX_BYTES, max_age: float = LLM_AUDIT_MAX_AGE,
+                 keep: int = LLM_AUDIT_KEEP, compress: bool = LLM_AUDIT_COMPRESS,
+                 flush_interval: float = LLM_AUDIT_FLUSH_INTERVAL, queue_size: int = LLM_AUDIT_QUEUE,
+                 with_text: bool = LLM_AUDIT_TEXT):
+        self.path = Path(path)
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.keep = keep
+        self.compress = compress
+        self.flush_interval = flush_interval
+        self.queue_size = queue_size
+        self.with_text = with_text
+        self._queue = deque()
+        self._wakeup = threading.Event()
+        self._stopped = False
+        self._thread = None
+        self._file = None
+        self._opened = 0.0
+        self.written = 0
+        self.dropped = 0
+
+    def write(self, event: dict):
+        """Хук llm_client: ставит запрос в очередь на запись"""
+        if len(self._queue) >= self.queue_size:
+            self.dropped += 1
+            return
+        usage = event["usage"] or {}
+        record = {
+            "ts": time.time(),
+            "mode": event["mode"],
+            "user_id": event["user_id"],
+            "status": event["status"],
+            "model": event["model"],
+            "max_tokens": event["max_tokens"],
+            "seconds": event["seconds"],
+            # YandexGPT присылает число токенов строкой
+            "input_tokens": int(usage.get("inputTextTokens", 0)) or None,
+            "output_tokens": int(usage.get("completionTokens", 0)) or None,
+            "error": event["error"],
+        }
+        if self.with_text:
+            record["messages"] = event["messages"]
+            record["text"] = event["text"]
+        self._queue.append(record)
+
+    def start(self):
+        """Запускает фоновый поток записи"""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._thread = threading.Thread(target=self._run, name="audit-log", daemon=True)
+        self._thread.start()
+
+    def close(self):
+        """Останавливает поток и дописывает все, что осталось в очереди"""
+        self._stopped = True
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _run(self):
+        while not self._stopped:
+            self._wakeup.wait(self.flush_interval)
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Не удалось записать журнал запросов {self.path}: {e}")
+
+    def flush(self):
+        """Записывает накопленные записи одной операцией"""
+        records = []
+        while self._queue:
+            records.append(self._queue.popleft())
+        if not records:
+            return
+        data = "".join(json.dumps(record, ensure_ascii=False) + "\n" for record in records)
+        self._rotate_if_needed(len(data.encode("utf-8")))
+        self._file.write(data)
+        self._file.flush()
+        self.written += len(records)
+
+    def _rotate_if_needed(self, incoming: int):
+        if self._file is None:
+            self._open()
+        size = self._file.tell()
+        if size and (size + incoming > self.max_bytes or time.time() - self._opened > self.max_age):
+            self._file.close()
+            stamp = time.strftime('%Y%m%d-%H%M%S')
+            rotated = self.path.with_name(f"{self.path.stem}-{stamp}{self.path.suffix}")
+            counter = 1
+            while rotated.exists() or Path(f"{rotated}.gz").exists():
+                rotated = self.path.with_name(f"{self.path.stem}-{stamp}.{counter}{self.path.suffix}")
+                counter += 1
+            os.replace(self.path, rotated)
+            if self.compress:
+                with open(rotated, "rb") as src, gzip.open(f"{rotated}.gz", "wb") as dst:
+                    shutil.copyfileobj(src, dst)
+                rotated.unlink()
+            self._remove_old()
+            self._open()
+
+    def _open(self):
+        # Возраст файла считается от первой записи в нем, в том числе сделанной до перезапуска бота
+        self._opened = time.time()
+        if self.path.exists():
+            with open(self.path, encoding="utf-8") as f:
+                try:
+                    self._opened = json.loads(f.readline())["ts"]
+                except (ValueError, KeyError, TypeError):
+                    pass
+        self._file = open(self.path, "a", encoding="utf-8")
+
+    def _remove_old(self):
+        old = sorted(glob.glob(str(self.path.with_name(f"{self.path.stem}-*"))))
+        for name in old[:max(0, len(old) - self.keep)]:
+            os.remove(name)
+
+
+def open_audit_log():
+    """Журнал по настройкам из config, подключенный к llm_client, или None, если он выключен"""
+    if not LLM_AUDIT_PATH:
+        return None
+    import llm_client  # Здесь, чтобы отчету по журналу не нужны были зависимости клиента
+    audit_log = AuditLog(LLM_AUDIT_PATH)
+    audit_log.start()
+    llm_client.add_hook(audit_log.write)
+    return audit_log
+
+
+def read_records(paths: list, since: float = 0):
+    """Записи из файлов журнала (в том числе сжатых), не старше since"""
+    for path in paths:
+        opener = gzip.open if path.endswith(".gz") else open
+        with opener(path, "rt", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue  # Недописанная строка при аварийной остановке
+                if record.get("ts", 0) >= since:
+                    yield record
+
+
+def percentile(values: list, p: float) -> float:
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def report(records) -> str:
+    """Сводка: число запросов, ошибки, перцентили времени и токенов по режимам"""
+    groups = defaultdict(lambda: {"count": 0, "errors": 0, "seconds": [], "input_tokens": [], "output_tokens": []})
+    for record in records:
+        for name in (record["mode"], "все"):
+            group = groups[name]
+            group["count"] += 1
+            if record["status"] != "ok":
+                group["errors"] += 1
+                continue
+            group["seconds"].append(record["seconds"])
+            for field in ("input_tokens", "output_tokens"):
+                if record.get(field) is not None:
+                    group[field].append(record[field])
+
+    lines = [f"{'режим':<12}{'запросов':>10}{'ошибок':>8}"
+             f"{'p50, с':>9}{'p95, с':>9}{'p99, с':>9}"
+             f"{'вход p50/p95':>16}{'выход p50/p95':>16}{'токенов':>10}"]
+    for name, group in sorted(groups.items(), key=lambda item: item[0] == "все"):
+        seconds = sorted(group["seconds"])
+        tokens_in = sorted(group["input_tokens"])
+        tokens_out = sorted(group["output_tokens"])
+        lines.append(
+            f"{name:<12}{group['count']:>10}{group['errors']:>8}"
+            + "".join(f"{percentile(seconds, p):>9.2f}" for p in (50, 95, 99))
+            + f"{f'{percentile(tokens_in, 50):.0f}/{percentile(tokens_in, 95):.0f}':>16}"
+            + f"{f'{percentile(tokens_out, 50):.0f}/{percentile(tokens_out, 95):.0f}':>16}"
+            + f"{sum(tokens_in) + sum(tokens_out):>10}"
+        )
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=("report",))
+    parser.add_argument("paths", nargs="*", help="Файлы журнала; по умолчанию LLM_AUDIT_PATH и его старые файлы")
+    parser.add_argument("--since", type=float, default=0, help="Только за последние столько часов")
+    args = parser.parse_args()
+
+    paths = args.paths
+    if not paths:
+        path = Path(LLM_AUDIT_PATH)
+        paths = sorted(glob.glob(str(path.with_name(f"{path.stem}-*")))) + [str(path)]
+    paths = [path for path in paths if os.path.exists(path)]
+    if not paths:
+        parser.error("Нет файлов журнала")
+    since = time.time() - args.since * 3600 if args.since else 0
+    print(report(read_records(paths, since)))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,40 @@
 import asyncio
 import logging
-from pathlib import Path
+from collections import OrderedDict
+from contextlib import aclosing
 from aiogram import Bot, Dispatcher, types
-from aiogram.filters import Command
-from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery, FSInputFile
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.filters import Command, CommandObject
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery, FSInputFile, InputMediaPhoto
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-from aiogram.fsm.storage.memory import MemoryStorage
-
-from quiz_data import QUIZ_QUESTIONS, INTERMEDIATE_SCREEN, FINAL_SCREEN
-from yandex_gpt import ask_yandex_gpt
-from config import BOT_TOKEN
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+
+from quiz_engine import Step, get_quiz, image_manifest
+from callbacks import Callback, encode, decode
+from yandex_gpt import ask_yandex_gpt_async, ask_yandex_gpt_stream, cached_answer
+from llm_client import ERROR_TEXT, breaker
+from audit_log import open_audit_log
+from token_budget import token_budget, prepare_question
+import llm_client
+import tarot_library
+from http_pool import open_pool, close_pool
+from gpt_cache import answer_cache
+from quiz_index import quiz_index
+from image_registry import ImageRegistry
+from storage import create_storages, new_session
+from webhook import run_webhook
+from send_scheduler import SendScheduler, background_sending
+from user_serializer import UserSerializer
+from singleflight import inflight
+from llm_limiter import llm_limiter
+import metrics
+from config import (
+    BOT_TOKEN, BOT_MODE, TELEGRAM_API_URL, STREAM_EDIT_INTERVAL, IMAGE_CACHE_PATH, RETRIEVAL_CONTEXT, model_data,
+    TG_GLOBAL_RATE, TG_CHAT_RATE, TG_CHAT_BURST, TG_MAX_RETRIES, QUIZ_RENDER_MODE, QUIZ_ADVANCE_DELAY,
+    METRICS_HOST, METRICS_PORT, METRICS_PATH, TAROT_REFRESH_INTERVAL
+)
 
 # Настройка логирования
 logging.basicConfig(level=logging.INFO)
@@ -21,9 +45,18 @@ if not BOT_TOKEN or BOT_TOKEN == "YOUR_BOT_TOKEN_HERE":
     raise ValueError("Необходимо указать BOT_TOKEN в файле env")
 
 # Инициализация бота и диспетчера
-bot = Bot(token=BOT_TOKEN)
-storage = MemoryStorage()
+# TELEGRAM_API_URL - свой сервер Bot API или локальный имитатор для нагрузочных тестов
+session = AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_URL)) if TELEGRAM_API_URL else None
+bot = Bot(token=BOT_TOKEN, session=session)
+# Все исходящие запросы проходят через общую очередь с лимитами Telegram
+send_scheduler = SendScheduler(TG_GLOBAL_RATE, TG_CHAT_RATE, TG_CHAT_BURST, TG_MAX_RETRIES)
+bot.session.middleware(send_scheduler)
+# FSM и прогресс викторины хранятся вместе (memory, sqlite или redis, см. STORAGE_BACKEND)
+storage, user_results = create_storages()
 dp = Dispatcher(storage=storage)
+# Апдейты одного пользователя обрабатываются по очереди, повторы нажатий отбрасываются
+user_serializer = UserSerializer()
+dp.update.outer_middleware(user_serializer)
 
 
 # Состояния FSM
@@ -33,86 +66,129 @@ class QuizState(StatesGroup):
     waiting_intermediate = State()  # Ожидание на промежуточном экране
 
 
-# Хранилище результатов викторины для каждого пользователя
-user_results = {}
+# Кэш file_id картинок: каждая картинка загружается в Telegram один раз
+image_registry = ImageRegistry(IMAGE_CACHE_PATH, image_manifest)
 
+# id нажатий, на которые уже ответили: на каждое нажатие Telegram ждет ровно один ответ
+answered_callbacks = OrderedDict()
+ANSWERED_CALLBACKS_LIMIT = 10000
 
-def get_quiz_keyboard(question_num: int, options: list) -> InlineKeyboardMarkup:
-    """Создает клавиатуру с вариантами ответов"""
-    buttons = []
-    for i, option in enumerate(options):
-        buttons.append([
-            InlineKeyboardButton(
-                text=option,
-                callback_data=f"answer_{question_num}_{i}"
-            )
-        ])
-    return InlineKeyboardMarkup(inline_keyboard=buttons)
+STALE_BUTTON_TEXT = "Эта кнопка устарела. Отправьте /start, чтобы начать заново"
+BUDGET_EXCEEDED_TEXT = "Лимит вопросов к YandexGPT на сегодня исчерпан. Попробуйте завтра или продолжите викторину."
 
 
-def get_start_keyboard() -> InlineKeyboardMarkup:
-    """Создает клавиатуру для начала викторины"""
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="Поехали", callback_data="start_quiz")]
-    ])
-    return keyboard
+# Постоянные клавиатуры собираются один раз
+RETURN_KEYBOARD = InlineKeyboardMarkup(inline_keyboard=[
+    [InlineKeyboardButton(text="Вернуться", callback_data=encode("back"))]
+])
+RESTART_KEYBOARD = InlineKeyboardMarkup(inline_keyboard=[
+    [InlineKeyboardButton(text="В начало", callback_data=encode("start"))]
+])
+CANCEL_INTERMEDIATE_KEYBOARD = InlineKeyboardMarkup(inline_keyboard=[
+    [InlineKeyboardButton(text="Отмена", callback_data=encode("back"))]
+])
+CANCEL_GPT_KEYBOARD = InlineKeyboardMarkup(inline_keyboard=[
+    [InlineKeyboardButton(text="Отмена", callback_data=encode("cancel"))]
+])
 
 
-def get_intermediate_keyboard() -> InlineKeyboardMarkup:
-    """Создает клавиатуру для промежуточного экрана"""
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="Вопрос", callback_data="ask_gpt_intermediate")],
-        [InlineKeyboardButton(text="Нет вопросов", callback_data="skip_intermediate")]
-    ])
-    return keyboard
+async def answer_photo(message: types.Message, photo_path: str, caption: str = "", reply_markup=None):
+    """Отправляет фото в чат сообщения, по возможности по сохраненному file_id"""
+    photo = image_registry.get(photo_path)
+    try:
+        sent = await message.answer_photo(
+            photo=photo,
+            caption=caption,
+            reply_markup=reply_markup
+        )
+    except TelegramBadRequest:
+        if isinstance(photo, FSInputFile):
+            raise
+        # Telegram не принял сохраненный file_id — загружаем файл заново
+        image_registry.forget(photo_path)
+        sent = await message.answer_photo(
+            photo=FSInputFile(photo_path),
+            caption=caption,
+            reply_markup=reply_markup
+        )
+    image_registry.remember(photo_path, sent)
+    return sent
 
 
-def get_final_keyboard() -> InlineKeyboardMarkup:
-    """Создает клавиатуру для финального экрана"""
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="Повторить викторину", callback_data="start_quiz")]
-    ])
-    return keyboard
+async def answer_callback(callback: CallbackQuery, text: str = None):
+    """Отвечает на нажатие кнопки один раз, повторные вызовы ничего не отправляют"""
+    if callback.id in answered_callbacks:
+        return
+    answered_callbacks[callback.id] = True
+    if len(answered_callbacks) > ANSWERED_CALLBACKS_LIMIT:
+        answered_callbacks.popitem(last=False)
+    try:
+        await callback.answer(text=text)
+    except TelegramBadRequest as e:
+        logger.warning(f"Не удалось ответить на нажатие кнопки: {e}")
+
+
+async def edit_photo(message: types.Message, photo_path: str, caption: str, reply_markup=None) -> bool:
+    """Заменяет фото и подпись сообщения викторины на месте. False, если это невозможно"""
+    if QUIZ_RENDER_MODE != "edit" or not message.photo:
+        return False
+    
+    photo = image_registry.get(photo_path)
+    try:
+        edited = await message.edit_media(
+            InputMediaPhoto(media=photo, caption=caption),
+            reply_markup=reply_markup
+        )
+    except TelegramRetryAfter:
+        raise
+    except TelegramBadRequest as e:
+        logger.warning(f"Не удалось заменить фото на месте: {e}")
+        if not isinstance(photo, FSInputFile):
+            image_registry.forget(photo_path)
+        return False
+    if isinstance(edited, types.Message):
+        image_registry.remember(photo_path, edited)
+    return True
 
 
 async def send_photo(message_or_callback, photo_path: str, caption: str = "", reply_markup=None):
     """Отправляет фото с подписью"""
-    photo_file = FSInputFile(photo_path)
-    
     if isinstance(message_or_callback, CallbackQuery):
         try:
-            await message_or_callback.message.answer_photo(
-                photo=photo_file,
+            await answer_photo(
+                message_or_callback.message,
+                photo_path,
                 caption=caption,
                 reply_markup=reply_markup
             )
-            await message_or_callback.answer()
+            await answer_callback(message_or_callback)
+        except TelegramRetryAfter:
+            # Повторы уже сделал send_scheduler, повторная отправка только удвоит нагрузку
+            raise
         except Exception as e:
             logger.error(f"Ошибка при отправке фото: {e}")
             await message_or_callback.message.answer(
                 caption,
                 reply_markup=reply_markup
             )
-            await message_or_callback.answer()
+            await answer_callback(message_or_callback)
     else:
-        await message_or_callback.answer_photo(
-            photo=photo_file,
+        await answer_photo(
+            message_or_callback,
+            photo_path,
             caption=caption,
             reply_markup=reply_markup
         )
 
 
 @dp.message(Command("start"))
-async def cmd_start(message: types.Message):
-    """Обработчик команды /start"""
+async def cmd_start(message: types.Message, command: CommandObject):
+    """Обработчик команды /start, /start <викторина> запускает выбранную викторину"""
     user_id = message.from_user.id
     user_name = message.from_user.first_name or "Друг"
+    quiz = get_quiz(command.args)
     
-    user_results[user_id] = {
-        "current_question": 0,
-        "correct_answers": 0,
-        "answers": []
-    }
+    await user_results.set(user_id, new_session(quiz.quiz_id))
     
     greeting_text = (
         f"Приветствие:\n\n"
@@ -123,252 +199,305 @@ async def cmd_start(message: types.Message):
     
     await message.answer(
         greeting_text,
-        reply_markup=get_start_keyboard()
+        reply_markup=quiz.start_keyboard
     )
 
 
-@dp.callback_query(lambda c: c.data == "start_quiz")
-async def start_quiz(callback: CallbackQuery, state: FSMContext):
-    """Начало викторины"""
+async def start_quiz(callback: CallbackQuery, state: FSMContext, payload: Callback):
+    """Начало викторины: указанной в кнопке или той, что пользователь проходил"""
     user_id = callback.from_user.id
-    user_results[user_id] = {
-        "current_question": 0,
-        "correct_answers": 0,
-        "answers": []
-    }
+    quiz_id = payload.quiz
+    if not quiz_id:
+        quiz_id = (await user_results.get(user_id) or new_session()).quiz
+    quiz = get_quiz(quiz_id)
+    await user_results.set(user_id, new_session(quiz.quiz_id))
     
-    await state.set_state(QuizState.waiting_for_answer)
-    await show_question(callback, state)
+    await render_step(callback, state, quiz.step(0))
 
 
 async def show_question(callback: CallbackQuery, state: FSMContext):
-    """Показывает текущий вопрос викторины"""
-    user_id = callback.from_user.id
-    current_q = user_results[user_id]["current_question"]
-    
-    # Проверяем, нужно ли показать промежуточный экран (после вопроса 2, индекс 1)
-    # Промежуточный экран показываем после ответа на вопрос с индексом 1 (второй вопрос)
-    if current_q == 2:  # После ответа на второй вопрос (индекс 1) показываем промежуточный экран
-        await show_intermediate_screen(callback, state)
-        return
-    
-    if current_q >= len(QUIZ_QUESTIONS):
-        # Викторина завершена
-        await show_final_screen(callback, state)
-        return
-    
-    question_data = QUIZ_QUESTIONS[current_q]
-    question_text = question_data['question']
-    
-    keyboard = get_quiz_keyboard(current_q, question_data['options'])
-    
-    try:
-        # Если есть изображение, отправляем его с текстом вопроса
-        if question_data.get('image'):
-            photo_path = question_data['image']
-            if Path(photo_path).exists():
-                await send_photo(callback, photo_path, question_text, keyboard)
-            else:
-                await callback.message.edit_text(question_text, reply_markup=keyboard)
-                await callback.answer()
-        else:
-            await callback.message.edit_text(question_text, reply_markup=keyboard)
-            await callback.answer()
-    except Exception as e:
-        logger.error(f"Ошибка при показе вопроса: {e}")
-        # Если не удалось отредактировать, отправляем новое сообщение
-        if question_data.get('image'):
-            photo_path = question_data['image']
-            if Path(photo_path).exists():
-                await send_photo(callback, photo_path, question_text, keyboard)
-            else:
-                await callback.message.answer(question_text, reply_markup=keyboard)
-                await callback.answer()
-        else:
-            await callback.message.answer(question_text, reply_markup=keyboard)
-            await callback.answer()
+    """Показывает текущий шаг викторины пользователя"""
+    session = await user_results.get(callback.from_user.id) or new_session()
+    step = get_quiz(session.quiz).step(session.step)
+    await render_step(callback, state, step)
 
 
-async def show_intermediate_screen(callback: CallbackQuery, state: FSMContext):
-    """Показывает промежуточный экран после вопроса 2"""
-    await state.set_state(QuizState.waiting_intermediate)
-    
-    photo_path = INTERMEDIATE_SCREEN['image']
-    text = INTERMEDIATE_SCREEN['text']
-    keyboard = get_intermediate_keyboard()
-    
-    try:
-        if Path(photo_path).exists():
-            await send_photo(callback, photo_path, text, keyboard)
-        else:
-            await callback.message.edit_text(text, reply_markup=keyboard)
-            await callback.answer()
-    except Exception as e:
-        logger.error(f"Ошибка при показе промежуточного экрана: {e}")
-        if Path(photo_path).exists():
-            await send_photo(callback, photo_path, text, keyboard)
-        else:
-            await callback.message.answer(text, reply_markup=keyboard)
-            await callback.answer()
-
+async def render_step(callback: CallbackQuery, state: FSMContext, step: Step, note: str = None):
+    """Показывает шаг викторины: вопрос, промежуточный или финальный экран.
 
-async def show_final_screen(callback: CallbackQuery, state: FSMContext):
-    """Показывает финальный экран"""
-    await state.clear()
+    note - реакция на предыдущий ответ, выводится над текстом шага.
+    """
+    text = f"{note}\n\n{step.text}" if note else step.text
+    if step.kind == "question":
+        await state.set_state(QuizState.waiting_for_answer)
+    elif step.kind == "screen":
+        await state.set_state(QuizState.waiting_intermediate)
+    else:
+        await state.clear()
     
-    photo_path = FINAL_SCREEN['image']
-    text = FINAL_SCREEN['text']
-    keyboard = get_final_keyboard()
+    if step.image and await edit_photo(callback.message, step.image, text, step.keyboard):
+        await answer_callback(callback)
+        return
     
     try:
-        if Path(photo_path).exists():
-            await send_photo(callback, photo_path, text, keyboard)
+        if step.image:
+            await send_photo(callback, step.image, text, step.keyboard)
         else:
-            await callback.message.edit_text(text, reply_markup=keyboard)
-            await callback.answer()
+            await callback.message.edit_text(text, reply_markup=step.keyboard)
+            await answer_callback(callback)
+    except TelegramRetryAfter:
+        raise
     except Exception as e:
-        logger.error(f"Ошибка при показе финального экрана: {e}")
-        if Path(photo_path).exists():
-            await send_photo(callback, photo_path, text, keyboard)
+        logger.error(f"Ошибка при показе шага викторины: {e}")
+        # Если не удалось отредактировать, отправляем новое сообщение
+        if step.image:
+            await send_photo(callback, step.image, text, step.keyboard)
         else:
-            await callback.message.answer(text, reply_markup=keyboard)
-            await callback.answer()
+            await callback.message.answer(text, reply_markup=step.keyboard)
+            await answer_callback(callback)
 
 
-@dp.callback_query(lambda c: c.data.startswith("answer_"))
-async def process_answer(callback: CallbackQuery, state: FSMContext):
+async def process_answer(callback: CallbackQuery, state: FSMContext, payload: Callback):
     """Обработка ответа пользователя"""
     user_id = callback.from_user.id
-    _, question_num, answer_num = callback.data.split("_")
-    question_num = int(question_num)
-    answer_num = int(answer_num)
+    step_index = payload.step
+    answer_num = payload.option
     
-    question_data = QUIZ_QUESTIONS[question_num]
-    is_correct = answer_num == question_data['correct']
+    session = await user_results.get(user_id) or new_session()
+    quiz = get_quiz(session.quiz)
+    step = quiz.step(step_index)
+    # Ответ на уже пройденный вопрос или на вопрос другой викторины не засчитываем
+    if (payload.quiz != quiz.quiz_id or step_index != session.step
+            or step.kind != "question" or answer_num >= len(step.responses)):
+        await answer_callback(callback, STALE_BUTTON_TEXT)
+        return
+    
+    is_correct = answer_num == step.correct
     
     # Сохраняем ответ
-    user_results[user_id]["answers"].append({
-        "question": question_num,
-        "answer": answer_num,
-        "correct": is_correct
-    })
+    session.record(step_index, is_correct)
     
-    if is_correct:
-        user_results[user_id]["correct_answers"] += 1
+    response_text = step.responses[answer_num]
     
-    # Получаем текст ответа из responses
-    response_text = question_data['responses'].get(answer_num, "Ответ обработан")
+    # Переходим к следующему шагу
+    session.step = step.next
+    await user_results.set(user_id, session)
+    
+    if QUIZ_RENDER_MODE == "edit" and callback.message.photo:
+        # Результат и следующий шаг - одна замена фото: реакция на ответ идет первой строкой подписи
+        await render_step(callback, state, quiz.step(step.next), note=response_text)
+        return
     
     # Отправляем ответ как сообщение вместо уведомления
     await callback.message.answer(response_text)
-    await callback.answer()
-    
-    # Переходим к следующему вопросу
-    user_results[user_id]["current_question"] += 1
+    await answer_callback(callback)
     
-    await asyncio.sleep(1)  # Небольшая задержка для показа результата
+    await asyncio.sleep(QUIZ_ADVANCE_DELAY)  # Небольшая задержка для показа результата
     await show_question(callback, state)
 
 
-@dp.callback_query(lambda c: c.data == "skip_intermediate")
-async def skip_intermediate(callback: CallbackQuery, state: FSMContext):
-    """Пропуск промежуточного экрана и переход к следующему вопросу"""
+async def skip_intermediate(callback: CallbackQuery, state: FSMContext, payload: Callback):
+    """Переход с промежуточного экрана к следующему шагу"""
     user_id = callback.from_user.id
-    # Пропускаем промежуточный экран и переходим к вопросу с индексом 2 (третий вопрос)
-    # current_q уже равен 2, поэтому просто показываем вопрос напрямую
-    await state.set_state(QuizState.waiting_for_answer)
-    
-    # Показываем вопрос с индексом 2 напрямую, минуя проверку на промежуточный экран
-    current_q = user_results[user_id]["current_question"]
-    if current_q >= len(QUIZ_QUESTIONS):
-        await show_final_screen(callback, state)
-        return
-    
-    question_data = QUIZ_QUESTIONS[current_q]
-    question_text = question_data['question']
-    keyboard = get_quiz_keyboard(current_q, question_data['options'])
-    
-    try:
-        if question_data.get('image'):
-            photo_path = question_data['image']
-            if Path(photo_path).exists():
-                await send_photo(callback, photo_path, question_text, keyboard)
-            else:
-                await callback.message.answer(question_text, reply_markup=keyboard)
-                await callback.answer()
-        else:
-            await callback.message.answer(question_text, reply_markup=keyboard)
-            await callback.answer()
-    except Exception as e:
-        logger.error(f"Ошибка при показе вопроса: {e}")
-        if question_data.get('image'):
-            photo_path = question_data['image']
-            if Path(photo_path).exists():
-                await send_photo(callback, photo_path, question_text, keyboard)
-            else:
-                await callback.message.answer(question_text, reply_markup=keyboard)
-                await callback.answer()
-        else:
-            await callback.message.answer(question_text, reply_markup=keyboard)
-            await callback.answer()
+    session = await user_results.get(user_id) or new_session()
+    step = get_quiz(session.quiz).step(session.step)
+    if step.kind == "screen":
+        session.step = step.next
+        await user_results.set(user_id, session)
+    await show_question(callback, state)
 
 
-@dp.callback_query(lambda c: c.data == "continue_quiz")
-async def continue_quiz(callback: CallbackQuery, state: FSMContext):
-    """Продолжение викторины после промежуточного экрана (возврат к промежуточному экрану)"""
-    user_id = callback.from_user.id
-    current_q = user_results.get(user_id, {}).get("current_question", 0)
-    
-    # Если мы на промежуточном экране (current_q == 2), показываем его снова
-    if current_q == 2:
-        await state.set_state(QuizState.waiting_intermediate)
-        await show_intermediate_screen(callback, state)
-    else:
-        # Иначе продолжаем викторину
-        await state.set_state(QuizState.waiting_for_answer)
-        await show_question(callback, state)
+async def continue_quiz(callback: CallbackQuery, state: FSMContext, payload: Callback):
+    """Возврат к текущему шагу викторины (например, к промежуточному экрану после вопроса)"""
+    await show_question(callback, state)
 
 
-@dp.callback_query(lambda c: c.data == "ask_gpt_intermediate")
-async def ask_gpt_intermediate(callback: CallbackQuery, state: FSMContext):
+async def ask_gpt_intermediate(callback: CallbackQuery, state: FSMContext, payload: Callback):
     """Обработчик кнопки 'Вопрос' на промежуточном экране"""
     await state.set_state(QuizState.asking_gpt)
     # Отправляем новое сообщение вместо редактирования (т.к. предыдущее сообщение может быть с фото)
     await callback.message.answer(
         "💬 Задайте ваш вопрос о том, что нас везло:\n\n"
         "Напишите ваш вопрос в следующем сообщении.",
-        reply_markup=InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text="Отмена", callback_data="continue_quiz")]
-        ])
+        reply_markup=CANCEL_INTERMEDIATE_KEYBOARD
     )
-    await callback.answer()
+    await answer_callback(callback)
 
 
-@dp.callback_query(lambda c: c.data == "ask_gpt")
-async def ask_gpt_handler(callback: CallbackQuery, state: FSMContext):
+async def ask_gpt_handler(callback: CallbackQuery, state: FSMContext, payload: Callback):
     """Обработчик кнопки 'Задать вопрос YandexGPT'"""
     await state.set_state(QuizState.asking_gpt)
     # Отправляем новое сообщение вместо редактирования
     await callback.message.answer(
         "💬 Задайте ваш вопрос о заводах и локомотивах YandexGPT:\n\n"
         "Напишите ваш вопрос в следующем сообщении.",
-        reply_markup=InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text="Отмена", callback_data="cancel_gpt")]
-        ])
+        reply_markup=CANCEL_GPT_KEYBOARD
     )
-    await callback.answer()
+    await answer_callback(callback)
 
 
-@dp.callback_query(lambda c: c.data == "cancel_gpt")
-async def cancel_gpt(callback: CallbackQuery, state: FSMContext):
+async def cancel_gpt(callback: CallbackQuery, state: FSMContext, payload: Callback):
     """Отмена вопроса к GPT"""
     await state.clear()
     # Отправляем новое сообщение вместо редактирования
     await callback.message.answer(
         "Действие отменено.",
-        reply_markup=get_start_keyboard()
+        reply_markup=get_quiz().start_keyboard
     )
-    await callback.answer()
+    await answer_callback(callback)
+
+
+# Обработчики нажатий по действию из callback_data
+CALLBACK_HANDLERS = {
+    "start": start_quiz,
+    "answer": process_answer,
+    "next": skip_intermediate,
+    "back": continue_quiz,
+    "ask": ask_gpt_intermediate,
+    "gpt": ask_gpt_handler,
+    "cancel": cancel_gpt,
+}
+
+
+@dp.callback_query()
+async def route_callback(callback: CallbackQuery, state: FSMContext):
+    """Единый вход для всех нажатий: разбор callback_data и поиск обработчика в CALLBACK_HANDLERS"""
+    payload = decode(callback.data)
+    if payload is None:
+        logger.warning(f"Отклонено нажатие с устаревшими или поврежденными данными: {callback.data!r}")
+        await answer_callback(callback, STALE_BUTTON_TEXT)
+        return
+    await CALLBACK_HANDLERS[payload.action](callback, state, payload)
+
+
+def handler_name(event, data: dict):
+    """Имя обработчика для метрик: нажатия кнопок подписываются обработчиком из CALLBACK_HANDLERS"""
+    if not isinstance(event, CallbackQuery):
+        return None
+    payload = decode(event.data)
+    handler = CALLBACK_HANDLERS.get(payload.action) if payload else None
+    return handler.__name__ if handler else "rejected_callback"
+
+
+# Время обработчиков и состояние очередей, кэша и сессий для /metrics
+handler_timer = metrics.HandlerTimer(handler_name)
+dp.message.middleware(handler_timer)
+dp.callback_query.middleware(handler_timer)
+metrics.registry.counter_func(
+    "answer_cache_requests_total", "Обращения к кэшу ответов YandexGPT",
+    lambda: {"hit": answer_cache.hits, "disk_hit": answer_cache.disk_hits, "miss": answer_cache.misses},
+    label="result"
+)
+metrics.registry.counter_func("llm_shared_total", "Запросы, получившие ответ чужого одинакового запроса", lambda: inflight.shared)
+metrics.registry.gauge("llm_inflight", "Выполняющиеся запросы к YandexGPT", lambda: llm_limiter.active)
+metrics.registry.gauge("llm_queue_size", "Запросы, ждущие места у ограничителя YandexGPT", lambda: llm_limiter.waiting)
+metrics.registry.gauge(
+    "llm_breaker_open", "Предохранитель YandexGPT разомкнут (1) или замкнут (0)",
+    lambda: 0 if breaker.state == "closed" else 1
+)
+metrics.registry.gauge("telegram_send_queue_size", "Исходящие запросы, ждущие лимитов Telegram", lambda: send_scheduler.queue_size)
+metrics.registry.gauge(
+    "quiz_sessions", "Сессии викторины в памяти", lambda: user_results.stats().get("sessions", 0)
+)
+metrics.registry.gauge(
+    "quiz_sessions_bytes", "Примерный объем памяти под сессии викторины", lambda: user_results.stats().get("bytes", 0)
+)
+metrics.registry.gauge("llm_tokens_spent", "Токены YandexGPT, потраченные в текущем окне бюджета", lambda: token_budget.total)
+metrics.registry.counter_func(
+    "llm_budget_rejected_total", "Вопросы, отклоненные из-за исчерпанного бюджета токенов", lambda: token_budget.rejected
+)
+
+# Расход токенов считается по всем запросам к YandexGPT
+llm_client.add_hook(token_budget.record)
+
+
+class QueuePositionNotifier:
+    """Колбэк, показывающий пользователю его место в очереди к YandexGPT.
+
+    Место в очереди меняется часто, а править сообщение можно не чаще STREAM_EDIT_INTERVAL:
+    изменения внутри интервала показываются одной отложенной правкой с последним местом.
+    После close() сообщение больше не правится - в нем уже ответ.
+    """
+
+    def __init__(self, processing_msg: types.Message):
+        self.processing_msg = processing_msg
+        self._loop = asyncio.get_running_loop()
+        self._last_edit = -STREAM_EDIT_INTERVAL
+        self._position = None  # Последнее известное место
+        self._shown = None  # Место, которое видит пользователь
+        self._trailing = None  # Задача отложенной правки
+        self._closed = False
+    
+    async def __call__(self, position: int):
+        self._position = position
+        if self._closed or self._trailing is not None:
+            return
+        if self._loop.time() - self._last_edit < STREAM_EDIT_INTERVAL:
+            self._trailing = asyncio.create_task(self._edit_later())
+            return
+        await self._edit()
+    
+    async def _edit_later(self):
+        try:
+            while not self._closed and self._position != self._shown:
+                await asyncio.sleep(max(0.0, self._last_edit + STREAM_EDIT_INTERVAL - self._loop.time()))
+                await self._edit()
+        except Exception as e:
+            logger.warning(f"Не удалось показать место в очереди: {e}")
+        finally:
+            self._trailing = None
+    
+    async def _edit(self):
+        if self._closed or self._position == self._shown:
+            return
+        self._last_edit = self._loop.time()
+        self._shown = self._position
+        # Место в очереди - промежуточная правка, она уступает ответам другим пользователям
+        with background_sending():
+            await self.processing_msg.edit_text(f"⏳ Сейчас много вопросов. Ваше место в очереди: {self._position}")
+    
+    def close(self):
+        self._closed = True
+        if self._trailing is not None:
+            self._trailing.cancel()
+
+
+async def stream_gpt_answer(processing_msg: types.Message, question: str, context, user_id: int, max_tokens: int) -> str:
+    """Получает ответ YandexGPT потоком и показывает его по мере генерации"""
+    loop = asyncio.get_running_loop()
+    answer = ""
+    shown = ""
+    last_edit = 0.0
+    on_queue = QueuePositionNotifier(processing_msg)
+    
+    # aclosing закрывает поток сразу, даже если правка сообщения упала посреди ответа
+    try:
+        async with aclosing(ask_yandex_gpt_stream(question, context, user_id=user_id, on_queue=on_queue,
+                                                  max_tokens=max_tokens)) as stream:
+            async for answer in stream:
+                # Ответ пошел - место в очереди больше не показываем
+                on_queue.close()
+                # Правим сообщение не чаще STREAM_EDIT_INTERVAL, чтобы не упереться в лимиты Telegram
+                now = loop.time()
+                if answer and answer != shown and now - last_edit >= STREAM_EDIT_INTERVAL:
+                    # Недописанный ответ уступает в очереди Telegram экранам и готовым ответам
+                    with background_sending():
+                        await processing_msg.edit_text(
+                            f"❓ Ваш вопрос: {question}\n\n"
+                            f"🤖 Ответ YandexGPT:\n{answer} ▌"
+                        )
+                    shown = answer
+                    last_edit = now
+    finally:
+        on_queue.close()
+    
+    return answer or ERROR_TEXT
+
+
+async def current_step_kind(user_id: int) -> str:
+    """Тип шага викторины, на котором сейчас пользователь"""
+    session = await user_results.get(user_id) or new_session()
+    return get_quiz(session.quiz).step(session.step).kind
 
 
 @dp.message(QuizState.asking_gpt)
@@ -380,28 +509,50 @@ async def process_gpt_question(message: types.Message, state: FSMContext):
         await message.answer("Пожалуйста, задайте вопрос текстом.")
         return
     
+    # Слишком длинный вопрос обрезается, а длина ответа подбирается по типу вопроса
+    question, max_tokens = prepare_question(question)
+    
     # Показываем, что обрабатываем запрос
     processing_msg = await message.answer("⏳ Обрабатываю ваш вопрос...")
     
+    user_id = message.from_user.id
+    
     try:
-        # Запрашиваем ответ у YandexGPT
-        answer = ask_yandex_gpt(question)
+        # Сначала ищем ответ в фактах викторины и FAQ, к YandexGPT идем только если не нашли
+        match = quiz_index.search(question)
+        context = match.document.text if match and RETRIEVAL_CONTEXT else None
         
-        user_id = message.from_user.id
-        current_q = user_results.get(user_id, {}).get("current_question", 0)
+        if match and match.confident:
+            answer = match.document.answer
+        elif token_budget.exhausted(user_id):
+            # Ответ из кэша не тратит токены, поэтому отдается и сверх лимита
+            answer = await cached_answer(question, context, max_tokens)
+            if answer is None:
+                token_budget.reject()
+                answer = BUDGET_EXCEEDED_TEXT
+        elif model_data['stream']:
+            answer = await stream_gpt_answer(processing_msg, question, context, user_id, max_tokens)
+        else:
+            on_queue = QueuePositionNotifier(processing_msg)
+            try:
+                answer = await ask_yandex_gpt_async(
+                    question,
+                    context,
+                    user_id=user_id,
+                    on_queue=on_queue,
+                    max_tokens=max_tokens
+                )
+            finally:
+                on_queue.close()
         
         # Определяем, на каком этапе мы находимся
-        if current_q == 2:
+        if await current_step_kind(user_id) == "screen":
             # Мы на промежуточном экране, возвращаемся к нему
-            keyboard = InlineKeyboardMarkup(inline_keyboard=[
-                [InlineKeyboardButton(text="Вернуться", callback_data="continue_quiz")]
-            ])
+            keyboard = RETURN_KEYBOARD
             await state.set_state(QuizState.waiting_intermediate)
         else:
             # Обычный вопрос GPT
-            keyboard = InlineKeyboardMarkup(inline_keyboard=[
-                [InlineKeyboardButton(text="В начало", callback_data="start_quiz")]
-            ])
+            keyboard = RESTART_KEYBOARD
             await state.clear()
         
         await processing_msg.edit_text(
@@ -411,16 +562,11 @@ async def process_gpt_question(message: types.Message, state: FSMContext):
         )
     except Exception as e:
         logger.error(f"Ошибка при обращении к YandexGPT: {e}")
-        user_id = message.from_user.id
-        current_q = user_results.get(user_id, {}).get("current_question", 0)
-        
-        if current_q == 2:
-            keyboard = InlineKeyboardMarkup(inline_keyboard=[
-                [InlineKeyboardButton(text="Вернуться", callback_data="continue_quiz")]
-            ])
+        if await current_step_kind(user_id) == "screen":
+            keyboard = RETURN_KEYBOARD
             await state.set_state(QuizState.waiting_intermediate)
         else:
-            keyboard = get_start_keyboard()
+            keyboard = get_quiz().start_keyboard
             await state.clear()
         
         await processing_msg.edit_text(
@@ -434,14 +580,46 @@ async def handle_other_messages(message: types.Message):
     """Обработка прочих сообщений"""
     await message.answer(
         "Используйте команду /start для начала работы с ботом.",
-        reply_markup=get_start_keyboard()
+        reply_markup=get_quiz().start_keyboard
     )
 
 
 async def main():
     """Главная функция запуска бота"""
     logger.info("Бот запущен")
-    await dp.start_polling(bot)
+    # Ограничитель YandexGPT работает в цикле бота, даже если первым к нему обратится фоновый поток
+    llm_limiter.bind(asyncio.get_running_loop())
+    await open_pool()
+    metrics.dump_on_signal()
+    metrics_runner = None
+    if METRICS_PORT:
+        metrics_runner = await metrics.start_metrics_server(METRICS_HOST, METRICS_PORT, METRICS_PATH)
+    audit_log = open_audit_log()
+    # Толкования таро обновляются в фоне, если библиотека собрана (python tarot_library.py build)
+    tarot_refresh = None
+    library = tarot_library.get_library()
+    if TAROT_REFRESH_INTERVAL and library is not None:
+        tarot_refresh = asyncio.create_task(tarot_library.run_refresh(library))
+    try:
+        if BOT_MODE == "webhook":
+            await run_webhook(dp, bot)
+        else:
+            await dp.start_polling(bot)
+    finally:
+        if tarot_refresh is not None:
+            tarot_refresh.cancel()
+            await asyncio.gather(tarot_refresh, return_exceptions=True)
+        tarot_library.close_library()
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
+        await close_pool()
+        if audit_log is not None:
+            audit_log.close()
+            logger.info(f"Журнал запросов YandexGPT: записано {audit_log.written}, отброшено {audit_log.dropped}")
+        logger.info(f"Сессии викторины: {user_results.stats()}")
+        await user_results.close()
+        logger.info(f"Кэш ответов YandexGPT: {answer_cache.stats()}")
+        answer_cache.close()
 
 
 if __name__ == "__main__":
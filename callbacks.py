@@ -0,0 +1,65 @@
+from dataclasses import dataclass
+
+# Версия формата: кнопки со старой версией отклоняются как устаревшие
+VERSION = "1"
+SEPARATOR = ":"
+# Ограничение Telegram на длину callback_data в байтах
+MAX_CALLBACK_DATA = 64
+
+# Поля каждого действия по порядку. Числовые поля обязательны, строковые могут быть пустыми
+SCHEMAS = {
+    "start": (("quiz", str),),
+    "answer": (("quiz", str), ("step", int), ("option", int)),
+    "next": (),
+    "back": (),
+    "ask": (),
+    "gpt": (),
+    "cancel": (),
+}
+
+
+@dataclass(frozen=True, slots=True)
+class Callback:
+    """Разобранные данные нажатой кнопки"""
+    action: str
+    quiz: str = None
+    step: int = None
+    option: int = None
+
+
+def encode(action: str, **fields) -> str:
+    """Собирает callback_data вида 1:answer:zavody:3:0"""
+    schema = SCHEMAS.get(action)
+    if schema is None:
+        raise ValueError(f"Неизвестное действие кнопки: {action}")
+    parts = [VERSION, action]
+    for name, _ in schema:
+        value = fields.get(name)
+        text = "" if value is None else str(value)
+        if SEPARATOR in text:
+            raise ValueError(f"Поле {name} кнопки {action} не может содержать '{SEPARATOR}': {text}")
+        parts.append(text)
+    data = SEPARATOR.join(parts)
+    if len(data.encode()) > MAX_CALLBACK_DATA:
+        raise ValueError(f"callback_data длиннее {MAX_CALLBACK_DATA} байт: {data}")
+    return data
+
+
+def decode(data: str):
+    """Разбирает callback_data. None для чужих, устаревших и поврежденных данных"""
+    parts = data.split(SEPARATOR) if data else []
+    if len(parts) < 2 or parts[0] != VERSION:
+        return None
+    schema = SCHEMAS.get(parts[1])
+    if schema is None or len(parts) - 2 != len(schema):
+        return None
+
+    values = {}
+    for (name, kind), text in zip(schema, parts[2:]):
+        if kind is int:
+            if not (text.isascii() and text.isdigit()):
+                return None
+            values[name] = int(text)
+        else:
+            values[name] = text or None
+    return Callback(parts[1], **values)
@@ -8,6 +8,8 @@ if os.path.exists('env'):
 
 # Токен Telegram бота
 BOT_TOKEN = os.getenv('BOT_TOKEN')
+# Адрес сервера Bot API; пусто - api.telegram.org
+TELEGRAM_API_URL = os.getenv('TELEGRAM_API_URL', '')
 
 # Данные для YandexGPT
 model_data = {
@@ -15,6 +17,109 @@ model_data = {
     'temperature': float(os.getenv('LLM_TEMPERATURE', '0.5')),
     'max_tokens': int(os.getenv('LLM_MAX_TOKENS', '500')),
     'url': os.getenv('LLM_URL'),
-    'authorization': os.getenv('LLM_AUTHORIZATION')  # Должен быть установлен через переменные окружения
+    'authorization': os.getenv('LLM_AUTHORIZATION'),  # Должен быть установлен через переменные окружения
+    'connect_timeout': float(os.getenv('LLM_CONNECT_TIMEOUT', '5')),  # Таймаут на установку соединения, сек
+    'read_timeout': float(os.getenv('LLM_READ_TIMEOUT', '60')),  # Таймаут на чтение ответа, сек
+    'pool_size': int(os.getenv('LLM_POOL_SIZE', '20')),  # Размер пула keep-alive соединений
+    'keepalive_timeout': float(os.getenv('LLM_KEEPALIVE_TIMEOUT', '30')),  # Сколько держать простаивающее соединение, сек
+    'stream': os.getenv('LLM_STREAM', 'true').lower() in ('1', 'true', 'yes'),  # Потоковая выдача ответа
+    'retries': int(os.getenv('LLM_RETRIES', '3')),  # Попыток на запрос (с первой)
+    'retry_base_delay': float(os.getenv('LLM_RETRY_BASE_DELAY', '0.5')),  # Базовая задержка между попытками, сек
+    'retry_max_delay': float(os.getenv('LLM_RETRY_MAX_DELAY', '5')),  # Максимальная задержка между попытками, сек
+    'breaker_threshold': int(os.getenv('LLM_BREAKER_THRESHOLD', '5')),  # Ошибок подряд до размыкания предохранителя
+    'breaker_reset_timeout': float(os.getenv('LLM_BREAKER_RESET_TIMEOUT', '30')),  # Сколько предохранитель разомкнут, сек
+    # Пакетные расклады (gpt_requests.batch_readings)
+    'async_url': os.getenv('LLM_ASYNC_URL', 'https://llm.api.cloud.yandex.net/foundationModels/v1/completionAsync'),
+    'operations_url': os.getenv('LLM_OPERATIONS_URL', 'https://operation.api.cloud.yandex.net/operations'),
+    'batch_mode': os.getenv('LLM_BATCH_MODE', 'operation'),  # operation - асинхронные операции, concurrent - обычные запросы
+    'batch_concurrency': int(os.getenv('LLM_BATCH_CONCURRENCY', '10')),  # Одновременных HTTP-запросов пакета
+    'poll_interval': float(os.getenv('LLM_POLL_INTERVAL', '1')),  # Пауза между проверками готовности операции, сек
+    'poll_timeout': float(os.getenv('LLM_POLL_TIMEOUT', '300')),  # Сколько ждать готовности операции, сек
+    'batch_outstanding': int(os.getenv('LLM_BATCH_OUTSTANDING', '100'))  # Незавершенных операций пакета одновременно
 }
 
+# Минимальный интервал между правками сообщения при потоковом ответе, сек
+# (Telegram ограничивает частоту редактирования сообщений в одном чате)
+STREAM_EDIT_INTERVAL = float(os.getenv('STREAM_EDIT_INTERVAL', '1.5'))
+
+
+# Файл с кэшем Telegram file_id для картинок викторины
+IMAGE_CACHE_PATH = os.getenv('IMAGE_CACHE_PATH', 'data/file_ids.json')
+# Манифест оптимизированных картинок, создается optimize_images.py при сборке образа
+IMAGE_MANIFEST_PATH = os.getenv('IMAGE_MANIFEST_PATH', 'data/images.json')
+
+# Хранилище FSM и прогресса викторины: memory, sqlite или redis
+STORAGE_BACKEND = os.getenv('STORAGE_BACKEND', 'memory')
+STORAGE_PATH = os.getenv('STORAGE_PATH', 'data/storage.sqlite3')
+REDIS_URL = os.getenv('REDIS_URL', 'redis://localhost:6379/0')
+SESSION_TTL = float(os.getenv('SESSION_TTL', '86400'))  # Сколько хранить прогресс без активности, сек
+SESSION_MAX = int(os.getenv('SESSION_MAX', '100000'))  # Сессий в памяти для STORAGE_BACKEND=memory
+
+# Режим получения апдейтов: polling (по умолчанию) или webhook
+BOT_MODE = os.getenv('BOT_MODE', 'polling')
+
+# Настройки вебхука
+WEBHOOK_URL = os.getenv('WEBHOOK_URL', '')  # Публичный адрес бота; если пуст, вебхук в Telegram не регистрируется
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/webhook')
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET', '')  # Проверяется в заголовке X-Telegram-Bot-Api-Secret-Token; обязателен при WEBHOOK_URL
+WEBHOOK_HOST = os.getenv('WEBHOOK_HOST', '0.0.0.0')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8080'))
+WEBHOOK_WORKERS = int(os.getenv('WEBHOOK_WORKERS', '16'))  # Сколько апдейтов обрабатывается одновременно
+WEBHOOK_QUEUE_SIZE = int(os.getenv('WEBHOOK_QUEUE_SIZE', '1000'))  # Размер очереди апдейтов
+WEBHOOK_QUEUE_TIMEOUT = float(os.getenv('WEBHOOK_QUEUE_TIMEOUT', '1'))  # Сколько ждать места в очереди, сек
+WEBHOOK_USER_BACKLOG = int(os.getenv('WEBHOOK_USER_BACKLOG', '10'))  # Сколько апдейтов пользователя ждут, пока он занят
+
+# Кэш ответов YandexGPT на вопросы пользователей
+ANSWER_CACHE_SIZE = int(os.getenv('ANSWER_CACHE_SIZE', '1000'))  # Записей в памяти
+ANSWER_CACHE_TTL = float(os.getenv('ANSWER_CACHE_TTL', '86400'))  # Время жизни ответа, сек
+ANSWER_CACHE_PATH = os.getenv('ANSWER_CACHE_PATH', 'data/answer_cache.sqlite3')  # Пусто - без кэша на диске
+
+# Библиотека заранее сгенерированных толкований таро (tarot_library.py)
+TAROT_LIBRARY_PATH = os.getenv('TAROT_LIBRARY_PATH', 'data/tarot_library.sqlite3')
+TAROT_VARIANTS = int(os.getenv('TAROT_VARIANTS', '5'))  # Вариантов на карту и положение
+TAROT_REFRESH_INTERVAL = float(os.getenv('TAROT_REFRESH_INTERVAL', '3600'))  # Период фонового обновления в боте, сек; 0 - выключено
+TAROT_REFRESH_BATCH = int(os.getenv('TAROT_REFRESH_BATCH', '20'))  # Толкований за одно обновление
+
+# Ограничения запросов к YandexGPT (0 - без ограничения)
+LLM_MAX_CONCURRENT = int(os.getenv('LLM_MAX_CONCURRENT', '10'))  # Одновременных запросов
+LLM_RPS = float(os.getenv('LLM_RPS', '10'))  # Запросов в секунду
+LLM_TPM = float(os.getenv('LLM_TPM', '0'))  # Токенов в минуту (запрос резервирует свой maxTokens)
+
+# Бюджет токенов на вопросы пользователей (token_budget.py)
+LLM_QUESTION_MAX_TOKENS = int(os.getenv('LLM_QUESTION_MAX_TOKENS', '300'))  # Длиннее вопрос обрезается (0 - не обрезать)
+LLM_MAX_TOKENS_FACT = int(os.getenv('LLM_MAX_TOKENS_FACT', '150'))  # maxTokens ответа на короткий фактический вопрос
+LLM_MAX_TOKENS_EXPLAIN = int(os.getenv('LLM_MAX_TOKENS_EXPLAIN', '0'))  # maxTokens развернутого ответа (0 - LLM_MAX_TOKENS)
+LLM_BUDGET_TOTAL = int(os.getenv('LLM_BUDGET_TOTAL', '0'))  # Токенов на всех за окно (0 - без ограничения)
+LLM_BUDGET_USER = int(os.getenv('LLM_BUDGET_USER', '0'))  # Токенов на пользователя за окно (0 - без ограничения)
+LLM_BUDGET_WINDOW = float(os.getenv('LLM_BUDGET_WINDOW', '86400'))  # Окно учета, сек
+
+# Локальный поиск по фактам викторины и FAQ перед обращением к YandexGPT
+FAQ_PATH = os.getenv('FAQ_PATH', 'data/faq.json')
+RETRIEVAL_MIN_SCORE = float(os.getenv('RETRIEVAL_MIN_SCORE', '1.5'))  # Минимальный BM25-балл для локального ответа
+RETRIEVAL_CONTEXT = os.getenv('RETRIEVAL_CONTEXT', 'true').lower() in ('1', 'true', 'yes')  # Передавать найденный факт в YandexGPT
+
+# Ограничения исходящих сообщений Telegram
+TG_GLOBAL_RATE = float(os.getenv('TG_GLOBAL_RATE', '30'))  # Сообщений в секунду на весь бот
+TG_CHAT_RATE = float(os.getenv('TG_CHAT_RATE', '1'))  # Сообщений в секунду в один чат
+TG_CHAT_BURST = float(os.getenv('TG_CHAT_BURST', '3'))  # Сколько сообщений подряд можно отправить в чат без ожидания
+TG_MAX_RETRIES = int(os.getenv('TG_MAX_RETRIES', '3'))  # Повторов после RetryAfter
+
+# Отрисовка викторины: edit - следующий экран вместе с реакцией на ответ подставляется
+# в то же сообщение (editMessageMedia), send - каждый экран отправляется новым сообщением
+QUIZ_RENDER_MODE = os.getenv('QUIZ_RENDER_MODE', 'edit')
+QUIZ_ADVANCE_DELAY = float(os.getenv('QUIZ_ADVANCE_DELAY', '1'))  # Для send: пауза между ответом и следующим вопросом, сек
+
+# Метрики в формате Prometheus на отдельном порту (0 - не запускать). kill -USR1 пишет их в лог
+METRICS_HOST = os.getenv('METRICS_HOST', '0.0.0.0')
+METRICS_PORT = int(os.getenv('METRICS_PORT', '9090'))
+METRICS_PATH = os.getenv('METRICS_PATH', '/metrics')
+
+# Журнал запросов к YandexGPT в JSONL для планирования нагрузки (пусто - не вести)
+LLM_AUDIT_PATH = os.getenv('LLM_AUDIT_PATH', 'logs/llm_audit.jsonl')
+LLM_AUDIT_TEXT = os.getenv('LLM_AUDIT_TEXT', 'false').lower() in ('1', 'true', 'yes')  # Писать тексты промптов и ответов (вопросы пользователей)
+LLM_AUDIT_MAX_BYTES = int(os.getenv('LLM_AUDIT_MAX_BYTES', str(50 * 1024 * 1024)))  # Ротация по размеру файла
+LLM_AUDIT_MAX_AGE = float(os.getenv('LLM_AUDIT_MAX_AGE', '86400'))  # Ротация по возрасту файла, сек
+LLM_AUDIT_KEEP = int(os.getenv('LLM_AUDIT_KEEP', '14'))  # Сколько старых файлов хранить
+LLM_AUDIT_COMPRESS = os.getenv('LLM_AUDIT_COMPRESS', 'true').lower() in ('1', 'true', 'yes')  # Сжимать старые файлы gzip
+LLM_AUDIT_FLUSH_INTERVAL = float(os.getenv('LLM_AUDIT_FLUSH_INTERVAL', '1'))  # Как часто сбрасывать записи на диск, сек
+LLM_AUDIT_QUEUE = int(os.getenv('LLM_AUDIT_QUEUE', '100000'))  # Записей в очереди; сверх этого записи отбрасываются
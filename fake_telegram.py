@@ -0,0 +1,95 @@
+"""Локальный имитатор Telegram: отправляет апдейты на вебхук бота.
+
+Пример:
+    BOT_MODE=webhook WEBHOOK_SECRET=secret python bot.py
+    python fake_telegram.py --users 50 --secret secret
+"""
+import argparse
+import asyncio
+import itertools
+import time
+
+import aiohttp
+
+from callbacks import encode
+
+_update_ids = itertools.count(1)
+_message_ids = itertools.count(1)
+
+
+def make_user(user_id: int) -> dict:
+    return {"id": user_id, "is_bot": False, "first_name": f"Тест {user_id}"}
+
+
+def make_message_update(user_id: int, text: str) -> dict:
+    """Апдейт с текстовым сообщением пользователя"""
+    return {
+        "update_id": next(_update_ids),
+        "message": {
+            "message_id": next(_message_ids),
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": make_user(user_id),
+            "text": text,
+            "entities": [{"type": "bot_command", "offset": 0, "length": len(text)}] if text.startswith("/") else None
+        }
+    }
+
+
+def make_callback_update(user_id: int, data: str, message_id: int = 1, photo: bool = False) -> dict:
+    """Апдейт с нажатием инлайн-кнопки под текстовым сообщением или под фото"""
+    message = {
+        "message_id": message_id,
+        "date": int(time.time()),
+        "chat": {"id": user_id, "type": "private"},
+    }
+    if photo:
+        message["photo"] = [{"file_id": "photo", "file_unique_id": "photo", "width": 1280, "height": 1280}]
+    else:
+        message["text"] = "..."
+    return {
+        "update_id": next(_update_ids),
+        "callback_query": {
+            "id": str(next(_update_ids)),
+            "from": make_user(user_id),
+            "chat_instance": str(user_id),
+            "data": data,
+            "message": message
+        }
+    }
+
+
+async def send_update(session: aiohttp.ClientSession, url: str, secret: str, update: dict) -> int:
+    headers = {"X-Telegram-Bot-Api-Secret-Token": secret} if secret else {}
+    async with session.post(url, json=update, headers=headers) as response:
+        return response.status
+
+
+async def run_user(session: aiohttp.ClientSession, url: str, secret: str, user_id: int, statuses: list):
+    """Один пользователь: /start и начало викторины"""
+    for update in (make_message_update(user_id, "/start"), make_callback_update(user_id, encode("start"))):
+        statuses.append(await send_update(session, url, secret, update))
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Отправка тестовых апдейтов на вебхук бота")
+    parser.add_argument("--url", default="http://127.0.0.1:8080/webhook")
+    parser.add_argument("--secret", default="")
+    parser.add_argument("--users", type=int, default=10)
+    args = parser.parse_args()
+
+    statuses = []
+    started = time.perf_counter()
+    async with aiohttp.ClientSession() as session:
+        await asyncio.gather(*(
+            run_user(session, args.url, args.secret, 100000 + i, statuses)
+            for i in range(args.users)
+        ))
+    elapsed = time.perf_counter() - started
+
+    counts = {status: statuses.count(status) for status in sorted(set(statuses))}
+    print(f"Отправлено {len(statuses)} апдейтов за {elapsed:.2f} с, статусы: {counts}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
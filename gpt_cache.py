@@ -0,0 +1,193 @@
+import asyncio
+import hashlib
+import json
+import logging
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from config import model_data as md, ANSWER_CACHE_SIZE, ANSWER_CACHE_TTL, ANSWER_CACHE_PATH
+
+logger = logging.getLogger(__name__)
+
+_PUNCTUATION = re.compile(r"[^\w\s]+")
+_SPACES = re.compile(r"\s+")
+
+
+def normalize_question(question: str) -> str:
+    """Приводит вопрос к каноническому виду: регистр, ё, пунктуация, пробелы"""
+    text = question.lower().replace("ё", "е")
+    text = _PUNCTUATION.sub(" ", text)
+    return _SPACES.sub(" ", text).strip()
+
+
+def make_key(question: str, system_prompt: str, max_tokens=None) -> str:
+    """Ключ кэша: нормализованный вопрос + системный промпт + настройки модели"""
+    if max_tokens is None:
+        max_tokens = md['max_tokens']
+    raw = json.dumps(
+        [normalize_question(question), system_prompt, md['model_uri'], md['temperature'], max_tokens],
+        ensure_ascii=False
+    )
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class AnswerCache:
+    """Кэш ответов YandexGPT: LRU в памяти с TTL и необязательный уровень на диске (SQLite).
+
+    Дисковый уровень хранит до disk_size записей; лишние и просроченные
+    удаляются раз в PRUNE_EVERY записей.
+
+    Кэшем пользуются и цикл событий бота, и потоки make_zap, поэтому уровень
+    в памяти защищен блокировкой, а запросы к SQLite выполняются по очереди
+    в отдельном потоке. Обработчики бота вызывают get_async/set_async,
+    синхронный код в потоках - get/set.
+    """
+
+    PRUNE_EVERY = 100
+
+    def __init__(self, max_size: int, ttl: float, path: str = "", disk_size: int = None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.disk_size = disk_size if disk_size is not None else max_size * 10
+        self._memory = OrderedDict()  # ключ -> (истекает_в, ответ)
+        self._lock = threading.Lock()  # Для _memory и счетчиков
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="answer-cache")
+        self._db = None
+        self._writes = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        if path:
+            self._open_disk(path)
+
+    def _open_disk(self, path: str):
+        try:
+            Path(path).parent.mkdir(parents=True, exist_ok=True)
+            self._db = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            # При WAL fsync на каждую запись не нужен: кэш не страшно потерять при сбое питания
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS answers (key TEXT PRIMARY KEY, answer TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+            self._db.execute("DELETE FROM answers WHERE expires_at < ?", (time.time(),))
+        except sqlite3.Error as e:
+            logger.error(f"Дисковый кэш ответов недоступен ({path}): {e}")
+            self._db = None
+
+    def get(self, key: str):
+        """Возвращает ответ из кэша или None"""
+        answer = self._memory_get(key)
+        if answer is None and self._db is not None:
+            answer = self._executor.submit(self._disk_get, key).result()
+        return self._count(answer)
+
+    async def get_async(self, key: str):
+        """get для цикла событий: к диску обращается не блокируя цикл"""
+        answer = self._memory_get(key)
+        if answer is None and self._db is not None:
+            answer = await asyncio.get_running_loop().run_in_executor(self._executor, self._disk_get, key)
+        return self._count(answer)
+
+    def set(self, key: str, answer: str):
+        """Сохраняет ответ в оба уровня кэша"""
+        expires_at = self._memory_set(key, answer)
+        if self._db is not None:
+            self._executor.submit(self._disk_set, key, answer, expires_at).result()
+
+    async def set_async(self, key: str, answer: str):
+        """set для цикла событий"""
+        expires_at = self._memory_set(key, answer)
+        if self._db is not None:
+            await asyncio.get_running_loop().run_in_executor(
+                self._executor, self._disk_set, key, answer, expires_at
+            )
+
+    def _memory_get(self, key: str):
+        with self._lock:
+            item = self._memory.get(key)
+            if item is None:
+                return None
+            expires_at, answer = item
+            if expires_at > time.time():
+                self._memory.move_to_end(key)
+                return answer
+            del self._memory[key]
+            return None
+
+    def _memory_set(self, key: str, answer: str) -> float:
+        expires_at = time.time() + self.ttl
+        with self._lock:
+            self._remember(key, answer, expires_at)
+        return expires_at
+
+    def _count(self, answer):
+        with self._lock:
+            if answer is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return answer
+
+    def _disk_get(self, key: str):
+        """Ответ с диска (в потоке кэша); найденный поднимается в память"""
+        row = self._db.execute(
+            "SELECT answer, expires_at FROM answers WHERE key = ? AND expires_at > ?", (key, time.time())
+        ).fetchone()
+        if not row:
+            return None
+        with self._lock:
+            self._remember(key, row[0], row[1])
+            self.disk_hits += 1
+        return row[0]
+
+    def _disk_set(self, key: str, answer: str, expires_at: float):
+        self._db.execute(
+            "INSERT OR REPLACE INTO answers (key, answer, expires_at) VALUES (?, ?, ?)",
+            (key, answer, expires_at)
+        )
+        self._writes += 1
+        if self._writes % self.PRUNE_EVERY == 0:
+            self._prune_disk()
+
+    def _prune_disk(self):
+        """Удаляет просроченные записи и самые старые сверх disk_size"""
+        self._db.execute("DELETE FROM answers WHERE expires_at < ?", (time.time(),))
+        self._db.execute(
+            "DELETE FROM answers WHERE key IN "
+            "(SELECT key FROM answers ORDER BY expires_at DESC LIMIT -1 OFFSET ?)",
+            (self.disk_size,)
+        )
+
+    def _remember(self, key: str, answer: str, expires_at: float):
+        # Вызывается под self._lock
+        self._memory[key] = (expires_at, answer)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_size:
+            self._memory.popitem(last=False)
+
+    def stats(self) -> dict:
+        """Счетчики попаданий и промахов"""
+        total = self.hits + self.misses
+        return {
+            "size": len(self._memory),
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0
+        }
+
+    def close(self):
+        if self._db is not None:
+            self._executor.submit(self._db.close).result()
+            self._db = None
+        self._executor.shutdown()
+
+
+# Общий кэш ответов на вопросы пользователей
+answer_cache = AnswerCache(ANSWER_CACHE_SIZE, ANSWER_CACHE_TTL, ANSWER_CACHE_PATH)
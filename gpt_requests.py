@@ -1,152 +1,93 @@
-import requests
-from config.config_base import model_data as md
-
-def make_zap(messages: list, max_tokens = md['max_tokens']) -> str:
-    # print(messages)
-    prompt = {
-        "modelUri": md['model_uri'],
-        "completionOptions": {
-            "stream": False,
-            "temperature": md['temperature'],
-            "maxTokens": max_tokens
-        },
-        "messages": messages
-    }
-
-
-    url = md['url']
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": md['authorization']
-    }
-    
-    try:
-        response = requests.post(url, headers=headers, json=prompt)
-        # print(response.text)
-        res = response.json()
-        
-        # print(res)
-        r = res['result']['alternatives'][0]['message']['text']
-        r = r.replace('*', '')
-
-    except (IndexError, TypeError) as e:
-        r = '-1'
-    return r
+from llm_client import PromptTemplate, make_zap, batch_zap
+
+_TAROT_SYSTEM = ("system", "Ты гадалка, которая специализируется на раскладах таро")
+
+# Шаблоны раскладов: неизменные сообщения собираются один раз, подставляются только карты
+CARDS3 = PromptTemplate("cards3", [
+    _TAROT_SYSTEM,
+    ("user", 'Я хочу сделать расклад таро на {reason}'),
+    ("assistant", "Вам выпали карты {cards}"),
+    ("user", "И что это значит? Что мне сулят эти карты? Напиши про каждую карту, что она значит в контексте {reason} и общую картину. Используй оригинальные формулировки, сохраняй налет загадочности. Не пиши ничего больше. Не делай предсказаний о будущем."),
+])
+
+DAYCARD = PromptTemplate("daycard", [
+    _TAROT_SYSTEM,
+    ("user", 'Я хочу сделать вытянуть карту дня'),
+    ("assistant", "Вам выпала карта {card}"),
+    ("user", "И что мне сулит эта карта? Опиши общую картину. Используй оригинальные формулировки, сохраняй налет загадочности. Не пиши ничего больше. Не делай предсказаний о будущем."),
+])
+
+CARD_MEANING = PromptTemplate("card_meaning", [
+    _TAROT_SYSTEM,
+    ("user", 'Что значит карта {card} в раскладе?'),
+    ("user", "Расскажи о ней в соответствии с ее толкованием в двух-трех предложениях. Если карта перевернута, это плохо, предсказание тревожное. Остальные предсказания оптимистичные. Используй оригинальные формулировки, сохраняй налет загадочности. Не пиши ничего больше."),
+])
+
+# Длинные расклады: до 1000 токенов ответа
+STAR7 = PromptTemplate("star7", [
+    _TAROT_SYSTEM,
+    ("user", 'Я хочу сделать расклад на семь звезд'),
+    ("assistant", "{cards}"),
+    ("user", "И что мне сулят эти карты? Расскажи о каждой карте в соответствии с ее толкованием. Если карта перевернута, это плохо, предсказание тревожное. Остальные предсказания оптимистичные. Используй оригинальные формулировки, сохраняй налет загадочности. Не пиши ничего больше. Не делай предсказаний о будущем."),
+], max_tokens=1000)
+
+CREST5 = PromptTemplate("crest5", [
+    ("system", "Ты гадалка, которая специализируется на раскладах таро."),
+    ("user", 'Я хочу сделать расклад пять карт.'),
+    ("assistant", "{cards}"),
+    ("user", "И что мне сулят эти карты? Начни с главной, она важнее. затем расскажи об остальных. Опиши общую картину. Используй оригинальные формулировки, сохраняй налет загадочности. Не пиши ничего больше. Не делай предсказаний о будущем."),
+])
+
+HORSE7 = PromptTemplate("horse7", [
+    _TAROT_SYSTEM,
+    ("user", 'Я хочу расклад подкова'),
+    ("assistant", "{cards}"),
+    ("user", "И что мне сулят эти карты? Расскажи о каждой карте в соответствии с ее толкованием. Если карта перевернута, это плохо, предсказание тревожное. Остальные предсказания оптимистичные. Используй оригинальные формулировки, сохраняй налет загадочности. Не пиши ничего больше."),
+], max_tokens=1000)
+
+# Расклады для пакетной генерации
+SPREADS = {
+    'star7': STAR7,
+    'horse7': HORSE7,
+}
+
+
+def _zap(template: PromptTemplate, **params) -> str:
+    return make_zap(template.messages(**params), template.max_tokens)
+
+
+def _pick(kind: str, card: str):
+    """Готовое толкование карты из библиотеки tarot_library или None"""
+    # Здесь, потому что tarot_library сам собирает промпты по шаблонам этого модуля
+    import tarot_library
+    return tarot_library.pick_reading(kind, card)
 
 
 def cards3(cards: str, reason: str) -> str:
-    messages = [
-        {
-            "role": "system",
-            "text": "Ты гадалка, которая специализируется на раскладах таро"
-        },
-        {
-            "role": "user",
-            "text": f'Я хочу сделать расклад таро на {reason}'
-        },
-        {
-            "role": "assistant",
-            "text": f"Вам выпали карты {cards}"
-        },
-        {
-            "role": "user",
-            "text": f"И что это значит? Что мне сулят эти карты? Напиши про каждую карту, что она значит в контексте {reason} и общую картину. Используй оригинальные формулировки, сохраняй налет загадочности. Не пиши ничего больше. Не делай предсказаний о будущем."
-        }
-    ]
-
-    res = make_zap(messages)
-    return res
+    return _zap(CARDS3, cards=cards, reason=reason)
 
 def daycard(card: str) -> str:
-    messages = [
-        {
-            "role": "system",
-            "text": "Ты гадалка, которая специализируется на раскладах таро"
-        },
-        {
-            "role": "user",
-            "text": f'Я хочу сделать вытянуть карту дня'
-        },
-        {
-            "role": "assistant",
-            "text": f"Вам выпала карта {card}"
-        },
-        {
-            "role": "user",
-            "text": f"И что мне сулит эта карта? Опиши общую картину. Используй оригинальные формулировки, сохраняй налет загадочности. Не пиши ничего больше. Не делай предсказаний о будущем."
-        }
-    ]
-
-    res = make_zap(messages)
-    return res
+    text = _pick("daycard", card)
+    return text if text is not None else _zap(DAYCARD, card=card)
+
+def card_meaning(card: str) -> str:
+    text = _pick("meaning", card)
+    return text if text is not None else _zap(CARD_MEANING, card=card)
 
 def star7(cards: str) -> str:
-    messages = [
-        {
-            "role": "system",
-            "text": "Ты гадалка, которая специализируется на раскладах таро"
-        },
-        {
-            "role": "user",
-            "text": f'Я хочу сделать расклад на семь звезд'
-        },
-        {
-            "role": "assistant",
-            "text": cards
-        },
-        {
-            "role": "user",
-            "text": f"И что мне сулят эти карты? Расскажи о каждой карте в соответствии с ее толкованием. Если карта перевернута, это плохо, предсказание тревожное. Остальные предсказания оптимистичные. Используй оригинальные формулировки, сохраняй налет загадочности. Не пиши ничего больше. Не делай предсказаний о будущем."
-        }
-    ]
-
-    res = make_zap(messages, 1000)
-    return res
+    return _zap(STAR7, cards=cards)
 
 def crest5(cards: str) -> str:
-    
-    messages = [
-        {
-            "role": "system",
-            "text": "Ты гадалка, которая специализируется на раскладах таро."
-        },
-        {
-            "role": "user",
-            "text": f'Я хочу сделать расклад пять карт.'
-        },
-        {
-            "role": "assistant",
-            "text": cards
-        },
-        {
-            "role": "user",
-            "text": f"И что мне сулят эти карты? Начни с главной, она важнее. затем расскажи об остальных. Опиши общую картину. Используй оригинальные формулировки, сохраняй налет загадочности. Не пиши ничего больше. Не делай предсказаний о будущем."
-        }
-    ]
-
-    res = make_zap(messages)
-    return res
-
+    return _zap(CREST5, cards=cards)
 
 def horse7(cards: str) -> str:
-    messages = [
-        {
-            "role": "system",
-            "text": "Ты гадалка, которая специализируется на раскладах таро"
-        },
-        {
-            "role": "user",
-            "text": f'Я хочу расклад подкова'
-        },
-        {
-            "role": "assistant",
-            "text": cards
-        },
-        {
-            "role": "user",
-            "text": f"И что мне сулят эти карты? Расскажи о каждой карте в соответствии с ее толкованием. Если карта перевернута, это плохо, предсказание тревожное. Остальные предсказания оптимистичные. Используй оригинальные формулировки, сохраняй налет загадочности. Не пиши ничего больше."
-        }
-    ]
-
-    res = make_zap(messages, 1000)
-    return res
\ No newline at end of file
+    return _zap(HORSE7, cards=cards)
+
+
+async def batch_readings(readings: list, mode: str = None, concurrency: int = None) -> list:
+    """Пакет длинных раскладов [(расклад, карты)] -> ответы в том же порядке.
+
+    Режимы и ограничение одновременных запросов - как у llm_client.batch_zap.
+    """
+    prompts = [SPREADS[spread].prompt(cards=cards) for spread, cards in readings]
+    return await batch_zap(prompts, mode, concurrency)
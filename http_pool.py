@@ -0,0 +1,65 @@
+import aiohttp
+import requests
+from requests.adapters import HTTPAdapter
+from config import model_data as md
+from metrics import create_trace_config
+
+# Общие на процесс пулы соединений к YandexGPT (асинхронный и синхронный)
+_session = None
+_sync_session = None
+
+
+def _create_session() -> aiohttp.ClientSession:
+    """Создает aiohttp-сессию с keep-alive пулом"""
+    connector = aiohttp.TCPConnector(
+        limit=md['pool_size'],
+        keepalive_timeout=md['keepalive_timeout']
+    )
+    timeout = aiohttp.ClientTimeout(
+        sock_connect=md['connect_timeout'],
+        sock_read=md['read_timeout']
+    )
+    return aiohttp.ClientSession(connector=connector, timeout=timeout, trace_configs=[create_trace_config()])
+
+
+def _create_sync_session() -> requests.Session:
+    """Создает requests-сессию с keep-alive пулом"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=md['pool_size'])
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+async def open_pool():
+    """Открывает пул соединений при старте бота"""
+    global _session
+    if _session is None or _session.closed:
+        _session = _create_session()
+
+
+async def close_pool():
+    """Закрывает пулы соединений при остановке бота"""
+    global _session, _sync_session
+    if _session is not None and not _session.closed:
+        await _session.close()
+    _session = None
+    if _sync_session is not None:
+        _sync_session.close()
+    _sync_session = None
+
+
+def get_session() -> aiohttp.ClientSession:
+    """Возвращает общую aiohttp-сессию (открывает ее при первом обращении)"""
+    global _session
+    if _session is None or _session.closed:
+        _session = _create_session()
+    return _session
+
+
+def get_sync_session() -> requests.Session:
+    """Возвращает общую requests-сессию для синхронных вызовов"""
+    global _sync_session
+    if _sync_session is None:
+        _sync_session = _create_sync_session()
+    return _sync_session
@@ -0,0 +1,94 @@
+import hashlib
+import json
+import logging
+import os
+from pathlib import Path
+
+from aiogram.types import FSInputFile
+
+logger = logging.getLogger(__name__)
+
+
+def load_manifest(path: str) -> dict:
+    """Манифест оптимизированных картинок (см. optimize_images.py): исходный путь -> запись"""
+    if not Path(path).exists():
+        return {}
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        logger.error(f"Не удалось прочитать манифест картинок {path}: {e}")
+        return {}
+
+
+class ImageRegistry:
+    """Кэш Telegram file_id для картинок викторины.
+
+    Каждый файл загружается в Telegram один раз, дальше отправляется по file_id.
+    Записи хранятся в JSON-файле вместе с хэшем содержимого картинки: если файл
+    на диске изменился, старый file_id отбрасывается и картинка загружается заново.
+    Хэши картинок из манифеста известны заранее, и их файлы не читаются.
+    """
+
+    def __init__(self, path: str, manifest: dict = None):
+        self.path = Path(path)
+        self._entries = {}  # путь к картинке -> {"hash": ..., "file_id": ...}
+        # хэши содержимого из манифеста или посчитанные в этом процессе
+        self._hashes = {entry['path']: entry['hash'] for entry in (manifest or {}).values()}
+        self._load()
+
+    def _load(self):
+        """Читает сохраненные file_id с диска"""
+        if not self.path.exists():
+            return
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                self._entries = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.error(f"Не удалось прочитать кэш картинок {self.path}: {e}")
+            self._entries = {}
+
+    def _save(self):
+        """Атомарно записывает file_id на диск"""
+        tmp_path = self.path.with_name(self.path.name + '.tmp')
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self._entries, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.error(f"Не удалось сохранить кэш картинок {self.path}: {e}")
+
+    def _file_hash(self, photo_path: str) -> str:
+        """Хэш содержимого файла (считается один раз за процесс)"""
+        if photo_path not in self._hashes:
+            digest = hashlib.sha256()
+            with open(photo_path, 'rb') as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                    digest.update(chunk)
+            self._hashes[photo_path] = digest.hexdigest()
+        return self._hashes[photo_path]
+
+    def get(self, photo_path: str):
+        """Возвращает file_id, если картинка уже загружена, иначе FSInputFile для загрузки"""
+        entry = self._entries.get(photo_path)
+        if entry and entry.get('hash') == self._file_hash(photo_path):
+            return entry['file_id']
+        return FSInputFile(photo_path)
+
+    def remember(self, photo_path: str, message):
+        """Запоминает file_id из ответа Telegram на отправку фото"""
+        if not message or not message.photo:
+            return
+        file_id = message.photo[-1].file_id
+        entry = self._entries.get(photo_path)
+        file_hash = self._file_hash(photo_path)
+        if entry and entry.get('file_id') == file_id and entry.get('hash') == file_hash:
+            return
+        self._entries[photo_path] = {"hash": file_hash, "file_id": file_id}
+        self._save()
+
+    def forget(self, photo_path: str):
+        """Удаляет file_id (например, если Telegram его больше не принимает)"""
+        if self._entries.pop(photo_path, None) is not None:
+            self._save()
@@ -0,0 +1,416 @@
+"""Общий клиент YandexGPT для бота и раскладов таро.
+
+Здесь собраны сборка промптов по шаблонам, пул соединений, ограничитель,
+повторы, предохранитель и метрики, чтобы любой вызов модели проходил
+один и тот же путь. Хуки из add_hook получают сведения о каждом запросе.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import string
+import time
+from contextlib import AsyncExitStack
+
+import aiohttp
+import requests
+
+from config import model_data as md
+from http_pool import get_session, get_sync_session
+from singleflight import inflight
+from llm_limiter import llm_limiter
+from resilience import LLMError, CircuitBreaker, RETRYABLE_STATUSES, OUTAGE_STATUSES, retry_async, retry_sync
+from metrics import llm_ttfb, llm_first_token, llm_total
+
+logger = logging.getLogger(__name__)
+
+ERROR_TEXT = 'Произошла ошибка при обращении к YandexGPT. Попробуйте позже.'
+
+# Предохранитель, общий для всех запросов к YandexGPT
+breaker = CircuitBreaker(md['breaker_threshold'], md['breaker_reset_timeout'])
+
+
+class PromptTemplate:
+    """Шаблон списка сообщений. Сообщения без параметров собираются один раз при создании,
+    в остальные при каждом вызове подставляются только параметры вида {cards}.
+    """
+
+    __slots__ = ("name", "max_tokens", "_parts")
+
+    def __init__(self, name: str, messages: list, max_tokens: int = None):
+        self.name = name
+        self.max_tokens = max_tokens
+        self._parts = []  # готовое сообщение или (роль, строка формата)
+        for role, text in messages:
+            if any(field for _, field, _, _ in string.Formatter().parse(text)):
+                self._parts.append((role, text))
+            else:
+                self._parts.append({"role": role, "text": text})
+
+    def messages(self, **params) -> list:
+        return [
+            part if isinstance(part, dict) else {"role": part[0], "text": part[1].format(**params)}
+            for part in self._parts
+        ]
+
+    def prompt(self, stream: bool = False, **params) -> dict:
+        return build_prompt(self.messages(**params), self.max_tokens, stream)
+
+
+def build_prompt(messages: list, max_tokens=None, stream: bool = False) -> dict:
+    """Собирает тело запроса к YandexGPT"""
+    if max_tokens is None:
+        max_tokens = md['max_tokens']
+
+    return {
+        "modelUri": md['model_uri'],
+        "completionOptions": {
+            "stream": stream,
+            "temperature": md['temperature'],
+            "maxTokens": max_tokens
+        },
+        "messages": messages
+    }
+
+
+def build_headers() -> dict:
+    """Заголовки запроса к YandexGPT"""
+    return {
+        "Content-Type": "application/json",
+        "Authorization": md['authorization']
+    }
+
+
+def parse_answer(res: dict) -> str:
+    """Достает текст ответа из JSON YandexGPT"""
+    r = res['result']['alternatives'][0]['message']['text']
+    return r.replace('*', '')
+
+
+def parse_usage(res: dict):
+    """Расход токенов из ответа YandexGPT: {inputTextTokens, completionTokens, totalTokens} или None"""
+    result = res.get('result') if isinstance(res, dict) else None
+    return result.get('usage') if isinstance(result, dict) else None
+
+
+def prompt_key(prompt: dict) -> str:
+    """Ключ singleflight для одинаковых промптов"""
+    return hashlib.sha256(json.dumps(prompt, ensure_ascii=False, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def check_status(status: int, headers) -> None:
+    """Превращает ответ с ошибочным статусом в LLMError"""
+    if status in RETRYABLE_STATUSES:
+        retry_after = headers.get('Retry-After')
+        raise LLMError(
+            f"YandexGPT вернул {status}",
+            retryable=True,
+            retry_after=float(retry_after) if retry_after and retry_after.isdigit() else None,
+            status=status
+        )
+    if status >= 400:
+        raise LLMError(f"YandexGPT вернул {status}", status=status)
+
+
+# Хуки наблюдения: вызываются после каждого запроса с описанием запроса (dict)
+hooks = []
+
+
+def add_hook(hook):
+    """Подписывает hook(event) на завершение запросов.
+
+    Хук вызывается прямо на пути запроса (в цикле событий или в потоке
+    синхронного make_zap), поэтому должен быть быстрым и потокобезопасным.
+    """
+    hooks.append(hook)
+
+
+def _notify(mode: str, prompt: dict, started: float, text: str = None, error=None, status: str = "ok",
+            usage: dict = None, user_id=None):
+    if not hooks:
+        return
+    event = {
+        "mode": mode,
+        "status": status,
+        "model": prompt['modelUri'],
+        "max_tokens": prompt['completionOptions']['maxTokens'],
+        "messages": prompt['messages'],
+        "text": text,
+        "error": str(error) if error is not None else None,
+        "usage": usage,
+        "user_id": user_id,
+        "seconds": time.perf_counter() - started,
+    }
+    for hook in hooks:
+        try:
+            hook(event)
+        except Exception as e:
+            logger.warning(f"Хук клиента YandexGPT завершился с ошибкой: {e}")
+
+
+def _post_sync(prompt: dict) -> dict:
+    with llm_limiter.slot_sync(cost=prompt['completionOptions']['maxTokens']):
+        try:
+            response = get_sync_session().post(
+                md['url'],
+                headers=build_headers(),
+                json=prompt,
+                timeout=(md['connect_timeout'], md['read_timeout'])
+            )
+        except requests.RequestException as e:
+            raise LLMError(str(e), retryable=True) from e
+    # requests не разделяет соединение и ожидание: elapsed - время до заголовков ответа
+    llm_ttfb.observe(response.elapsed.total_seconds(), "sync")
+    check_status(response.status_code, response.headers)
+    return response.json()
+
+
+async def _post_async(prompt: dict, user_id=None, on_queue=None) -> dict:
+    cost = prompt['completionOptions']['maxTokens']
+    async with llm_limiter.slot(user_id, cost, on_queue):
+        try:
+            async with get_session().post(md['url'], headers=build_headers(), json=prompt) as response:
+                check_status(response.status, response.headers)
+                return await response.json(content_type=None)
+        except (aiohttp.ClientError, TimeoutError) as e:
+            raise LLMError(str(e) or type(e).__name__, retryable=True) from e
+
+
+def _record(e: LLMError):
+    # Предохранитель считает сбои YandexGPT и отказы в доступе; ошибка в самом запросе (400)
+    # ничего не говорит о доступности сервиса и состояние предохранителя не меняет
+    if e.retryable or e.status in OUTAGE_STATUSES:
+        breaker.record_failure()
+
+
+def _complete_sync(prompt: dict, fallback: str) -> str:
+    started = time.perf_counter()
+    if not breaker.allow():
+        _notify("sync", prompt, started, fallback, status="fallback")
+        return fallback
+
+    try:
+        with llm_total.time("sync"):
+            res = retry_sync(lambda: _post_sync(prompt), md['retries'], md['retry_base_delay'], md['retry_max_delay'])
+        r = parse_answer(res)
+        breaker.record_success()
+    except LLMError as e:
+        _record(e)
+        _notify("sync", prompt, started, error=e, status="error")
+        return ERROR_TEXT
+    except (IndexError, TypeError, KeyError, ValueError) as e:
+        _notify("sync", prompt, started, error=e, status="error")
+        return ERROR_TEXT
+    _notify("sync", prompt, started, r, usage=parse_usage(res))
+    return r
+
+
+def make_zap(messages: list, max_tokens=None, fallback: str = ERROR_TEXT) -> str:
+    """Синхронный запрос к YandexGPT.
+
+    Возвращает текст ответа или ERROR_TEXT при ошибке; пока предохранитель
+    разомкнут, сразу возвращается fallback. Одинаковые одновременные запросы
+    выполняются одним HTTP-запросом. Запрос ждет места у общего llm_limiter,
+    поэтому make_zap нельзя вызывать из цикла событий - только из потока.
+    """
+    prompt = build_prompt(messages, max_tokens)
+    return inflight.do_sync(prompt_key(prompt), lambda: _complete_sync(prompt, fallback))
+
+
+async def async_make_zap(messages: list, max_tokens=None, user_id=None, on_queue=None,
+                         fallback: str = ERROR_TEXT) -> str:
+    """Асинхронный аналог make_zap: не блокирует цикл событий бота.
+
+    Запрос проходит через общий ограничитель llm_limiter; пока он ждет очереди,
+    on_queue(место) получает текущее место пользователя user_id. Сбои YandexGPT
+    повторяются с экспоненциальной задержкой, а пока предохранитель разомкнут,
+    сразу возвращается fallback.
+    """
+    prompt = build_prompt(messages, max_tokens)
+    started = time.perf_counter()
+    if not breaker.allow():
+        _notify("async", prompt, started, fallback, status="fallback", user_id=user_id)
+        return fallback
+
+    try:
+        with llm_total.time("async"):
+            res = await retry_async(
+                lambda: _post_async(prompt, user_id, on_queue),
+                md['retries'], md['retry_base_delay'], md['retry_max_delay']
+            )
+        r = parse_answer(res)
+        breaker.record_success()
+    except LLMError as e:
+        _record(e)
+        _notify("async", prompt, started, error=e, status="error", user_id=user_id)
+        return ERROR_TEXT
+    except (IndexError, TypeError, KeyError, ValueError) as e:
+        _notify("async", prompt, started, error=e, status="error", user_id=user_id)
+        return ERROR_TEXT
+    _notify("async", prompt, started, r, usage=parse_usage(res), user_id=user_id)
+    return r
+
+
+async def stream_zap(messages: list, max_tokens=None, user_id=None, on_queue=None, fallback: str = ERROR_TEXT):
+    """Потоковый запрос к YandexGPT: отдает накопленный текст ответа по мере генерации.
+
+    В потоковом режиме API присылает по JSON-объекту на строку, и каждый из них
+    содержит весь сгенерированный к этому моменту текст. Повторяется только
+    установка соединения (до первого фрагмента); ошибки пробрасываются
+    вызывающему коду. Пока предохранитель разомкнут, отдается fallback.
+    """
+    prompt = build_prompt(messages, max_tokens, stream=True)
+    start = time.perf_counter()
+    if not breaker.allow():
+        _notify("stream", prompt, start, fallback, status="fallback", user_id=user_id)
+        yield fallback
+        return
+    cost = prompt['completionOptions']['maxTokens']
+
+    async def open_stream():
+        # Место у ограничителя берется на каждую попытку и остается за запросом, только если
+        # поток открылся: на паузах между попытками оно свободно для других
+        slot = AsyncExitStack()
+        await slot.enter_async_context(llm_limiter.slot(user_id, cost, on_queue))
+        try:
+            try:
+                response = await get_session().post(
+                    md['url'], headers=build_headers(), json=prompt, trace_request_ctx={"mode": "stream"}
+                )
+            except (aiohttp.ClientError, TimeoutError) as e:
+                raise LLMError(str(e) or type(e).__name__, retryable=True) from e
+            try:
+                check_status(response.status, response.headers)
+            except LLMError:
+                response.release()
+                raise
+        except BaseException:
+            await slot.aclose()
+            raise
+        return response, slot
+
+    text = None
+    chunk = None
+    try:
+        response, slot = await retry_async(open_stream, md['retries'], md['retry_base_delay'], md['retry_max_delay'])
+    except LLMError as e:
+        _record(e)
+        _notify("stream", prompt, start, error=e, status="error", user_id=user_id)
+        raise
+    async with slot:
+        first = True
+        try:
+            async for line in response.content:
+                line = line.strip()
+                if not line:
+                    continue
+                if first:
+                    llm_first_token.observe(time.perf_counter() - start)
+                    first = False
+                chunk = json.loads(line)
+                text = parse_answer(chunk)
+                yield text
+        except (aiohttp.ClientError, TimeoutError) as e:
+            breaker.record_failure()
+            _notify("stream", prompt, start, text, error=e, status="error", user_id=user_id)
+            raise LLMError(str(e) or type(e).__name__, retryable=True) from e
+        except BaseException as e:
+            # Поток оборван (потребитель закрыл генератор, ошибка разбора): выданный текст уже оплачен
+            _notify("stream", prompt, start, text, error=str(e) or type(e).__name__, status="error", user_id=user_id)
+            raise
+        finally:
+            response.release()
+    llm_total.observe(time.perf_counter() - start, "stream")
+    breaker.record_success()
+    # Расход токенов приходит в последнем фрагменте
+    _notify("stream", prompt, start, text, usage=parse_usage(chunk), user_id=user_id)
+
+
+async def _call(method: str, url: str, semaphore: asyncio.Semaphore, cost: int = None, **kwargs) -> dict:
+    """Один HTTP-запрос пакета с повторами; semaphore ограничивает одновременные запросы пакета.
+    Запросы к модели (cost - их maxTokens) еще ждут места у общего llm_limiter, опрос операций - нет
+    """
+
+    async def request():
+        try:
+            async with get_session().request(method, url, headers=build_headers(), **kwargs) as response:
+                check_status(response.status, response.headers)
+                return await response.json(content_type=None)
+        except (aiohttp.ClientError, TimeoutError) as e:
+            raise LLMError(str(e) or type(e).__name__, retryable=True) from e
+
+    async def attempt():
+        async with semaphore:
+            if cost is None:
+                return await request()
+            async with llm_limiter.slot(cost=cost):
+                return await request()
+
+    return await retry_async(attempt, md['retries'], md['retry_base_delay'], md['retry_max_delay'])
+
+
+async def _run_operation(prompt: dict, semaphore: asyncio.Semaphore) -> dict:
+    """Отправляет промпт в completionAsync и опрашивает операцию до готовности, но не дольше LLM_POLL_TIMEOUT"""
+    operation = await _call('POST', md['async_url'], semaphore, prompt['completionOptions']['maxTokens'], json=prompt)
+    deadline = time.monotonic() + md['poll_timeout']
+    # Пока операция выполняется, место в semaphore свободно для других запросов
+    while not operation.get('done'):
+        if time.monotonic() >= deadline:
+            raise LLMError(
+                f"Операция {operation.get('id')} не завершилась за {md['poll_timeout']:g} с", retryable=True
+            )
+        await asyncio.sleep(md['poll_interval'])
+        operation = await _call('GET', f"{md['operations_url']}/{operation['id']}", semaphore)
+    if 'error' in operation:
+        raise LLMError(f"Операция {operation.get('id')}: {operation['error'].get('message')}")
+    return {'result': operation['response']}
+
+
+async def _run_completion(prompt: dict, semaphore: asyncio.Semaphore) -> dict:
+    """Обычный запрос к completion"""
+    return await _call('POST', md['url'], semaphore, prompt['completionOptions']['maxTokens'], json=prompt)
+
+
+async def batch_zap(prompts: list, mode: str = None, concurrency: int = None) -> list:
+    """Пакет готовых промптов -> ответы в том же порядке (ERROR_TEXT при ошибке).
+
+    mode=operation отправляет все промпты в асинхронный completionAsync и опрашивает
+    операции, mode=concurrent делает обычные запросы параллельно. В обоих режимах
+    одновременно идет не больше concurrency HTTP-запросов (и не больше LLM_POOL_SIZE
+    соединений), так что время пакета определяется concurrency, а не числом промптов.
+    Незавершенных операций одновременно не больше LLM_BATCH_OUTSTANDING: следующие
+    промпты отправляются по мере готовности предыдущих.
+    Запросы пакета проходят через общие llm_limiter и предохранитель: пока он
+    разомкнут, оставшиеся промпты сразу получают ERROR_TEXT.
+    """
+    mode = mode or md['batch_mode']
+    if mode not in ('operation', 'concurrent'):
+        raise ValueError(f"Неизвестный режим пакета: {mode}")
+    run = _run_operation if mode == 'operation' else _run_completion
+    semaphore = asyncio.Semaphore(concurrency or md['batch_concurrency'])
+    outstanding = asyncio.Semaphore(md['batch_outstanding'])
+
+    async def one(prompt: dict) -> str:
+        started = time.perf_counter()
+        if not breaker.allow():
+            _notify(mode, prompt, started, ERROR_TEXT, status="fallback")
+            return ERROR_TEXT
+        try:
+            async with outstanding:
+                res = await run(prompt, semaphore)
+            r = parse_answer(res)
+            breaker.record_success()
+        except LLMError as e:
+            _record(e)
+            logger.warning(f"Запрос пакета не выполнен: {e}")
+            _notify(mode, prompt, started, error=e, status="error")
+            return ERROR_TEXT
+        except (IndexError, TypeError, KeyError, ValueError) as e:
+            logger.warning(f"Запрос пакета не выполнен: {e}")
+            _notify(mode, prompt, started, error=e, status="error")
+            return ERROR_TEXT
+        llm_total.observe(time.perf_counter() - started, mode)
+        _notify(mode, prompt, started, r, usage=parse_usage(res))
+        return r
+
+    return await asyncio.gather(*(one(prompt) for prompt in prompts))
@@ -0,0 +1,207 @@
+import asyncio
+import logging
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager, contextmanager
+
+from config import LLM_MAX_CONCURRENT, LLM_RPS, LLM_TPM
+from token_bucket import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+
+class _Waiter:
+    __slots__ = ("future", "cost", "on_position", "loop", "position")
+
+    def __init__(self, future, cost, on_position, loop):
+        self.future = future
+        self.cost = cost
+        self.on_position = on_position
+        self.loop = loop  # Цикл событий вызывающего: в нем вызывается on_position
+        self.position = None
+
+
+class LLMLimiter:
+    """Ограничитель запросов к YandexGPT.
+
+    Не больше max_concurrent одновременных запросов, не больше rps запросов
+    в секунду и tpm токенов в минуту (запрос резервирует свой max_tokens); 0 - без ограничения.
+    Ожидающие обслуживаются по кругу между пользователями, внутри пользователя -
+    в порядке поступления. О смене места в очереди сообщает on_position(место).
+
+    Состояние ограничителя живет в одном цикле событий - цикле бота (bot.main
+    привязывает его через bind до запуска фоновых задач), а если его нет (утилиты
+    командной строки), в собственном цикле в фоновом потоке. Синхронный код из
+    потоков и другие циклы получают места через него, а on_position вызывается
+    в цикле того, кто ждет места.
+    """
+
+    def __init__(self, max_concurrent: int, rps: float = 0, tpm: float = 0):
+        self.max_concurrent = max_concurrent
+        self.active = 0
+        self._queues = OrderedDict()  # пользователь -> deque ожидающих
+        self._requests = TokenBucket(rps, max(rps, 1))
+        self._tokens = TokenBucket(tpm / 60, tpm)
+        self._timer = None
+        self._loop = None  # Цикл событий, в котором работает ограничитель
+        self._own_loop = None  # Собственный цикл в фоновом потоке, если ограничитель не привязан
+        self._loop_lock = threading.Lock()
+
+    def bind(self, loop: asyncio.AbstractEventLoop):
+        """Делает loop циклом ограничителя (вызывается до первых запросов к YandexGPT)"""
+        with self._loop_lock:
+            self._loop = loop
+            if self._own_loop is not None:
+                self._own_loop.call_soon_threadsafe(self._own_loop.stop)
+                self._own_loop = None
+
+    def _owner(self, current=None):
+        """Цикл событий ограничителя; без привязки его занимает первый работающий цикл,
+        который к нему обратился, а для потоков без цикла запускается собственный
+        """
+        with self._loop_lock:
+            if self._loop is None or not self._loop.is_running():
+                if current is None:
+                    current = self._own_loop = asyncio.new_event_loop()
+                    threading.Thread(target=current.run_forever, name="llm-limiter", daemon=True).start()
+                self._loop = current
+            return self._loop
+
+    @property
+    def waiting(self) -> int:
+        return sum(len(q) for q in self._queues.values())
+
+    @asynccontextmanager
+    async def slot(self, user_id=None, cost: int = 0, on_position=None):
+        """Занимает место для одного запроса на время блока with"""
+        loop = asyncio.get_running_loop()
+        owner = self._owner(loop)
+        if owner is loop:
+            await self.acquire(user_id, cost, on_position)
+            try:
+                yield
+            finally:
+                self.release()
+            return
+        await asyncio.wrap_future(
+            asyncio.run_coroutine_threadsafe(self.acquire(user_id, cost, on_position, loop), owner)
+        )
+        try:
+            yield
+        finally:
+            owner.call_soon_threadsafe(self.release)
+
+    @contextmanager
+    def slot_sync(self, user_id=None, cost: int = 0):
+        """slot для синхронного кода в потоке (не в цикле событий ограничителя)"""
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        owner = self._owner(running)
+        if owner is running:
+            raise RuntimeError("Синхронный запрос к YandexGPT из цикла событий заблокировал бы его")
+        asyncio.run_coroutine_threadsafe(self.acquire(user_id, cost), owner).result()
+        try:
+            yield
+        finally:
+            owner.call_soon_threadsafe(self.release)
+
+    async def acquire(self, user_id=None, cost: int = 0, on_position=None, loop=None):
+        """Ждет места в цикле ограничителя; loop - цикл вызывающего, если он другой"""
+        current = asyncio.get_running_loop()
+        waiter = _Waiter(current.create_future(), cost, on_position, loop or current)
+        self._queues.setdefault(user_id, deque()).append(waiter)
+        self._dispatch()
+        if not waiter.future.done():
+            self._notify_positions()
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            if waiter.future.done() and not waiter.future.cancelled():
+                # Место уже выдано, но ожидающий отменен - возвращаем его
+                self.release()
+            else:
+                self._remove(user_id, waiter)
+            raise
+
+    def release(self):
+        self.active -= 1
+        self._dispatch()
+
+    def _remove(self, user_id, waiter: _Waiter):
+        queue = self._queues.get(user_id)
+        if queue and waiter in queue:
+            queue.remove(waiter)
+            if not queue:
+                del self._queues[user_id]
+            self._notify_positions()
+
+    def _dispatch(self):
+        """Выдает места ожидающим, пока позволяют лимиты"""
+        granted = False
+        while self._queues and (not self.max_concurrent or self.active < self.max_concurrent):
+            user_id, queue = next(iter(self._queues.items()))
+            waiter = queue[0]
+            now = time.monotonic()
+            wait = max(self._requests.delay(1, now), self._tokens.delay(waiter.cost, now))
+            if wait > 0:
+                self._schedule(wait)
+                break
+            self._requests.take(1)
+            self._tokens.take(waiter.cost)
+            queue.popleft()
+            # Следующим обслуживается другой пользователь
+            if queue:
+                self._queues.move_to_end(user_id)
+            else:
+                del self._queues[user_id]
+            self.active += 1
+            waiter.future.set_result(None)
+            granted = True
+        if granted:
+            self._notify_positions()
+
+    def _schedule(self, delay: float):
+        if self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(delay, self._on_timer)
+
+    def _on_timer(self):
+        self._timer = None
+        self._dispatch()
+
+    def _notify_positions(self):
+        """Сообщает ожидающим их место в очереди, если оно изменилось"""
+        queues = list(self._queues.values())
+        position = 0
+        depth = 0
+        while True:
+            row = [q[depth] for q in queues if len(q) > depth]
+            if not row:
+                break
+            for waiter in row:
+                position += 1
+                if waiter.on_position is not None and waiter.position != position:
+                    waiter.position = position
+                    self._deliver(waiter, position)
+            depth += 1
+
+    def _deliver(self, waiter: _Waiter, position: int):
+        # Колбэк работает с объектами цикла вызывающего (например, сессией aiogram), поэтому вызывается в нем
+        call = self._call(waiter.on_position, position)
+        try:
+            waiter.loop.call_soon_threadsafe(asyncio.ensure_future, call)
+        except RuntimeError:
+            call.close()  # Цикл вызывающего уже закрыт
+
+    @staticmethod
+    async def _call(callback, position: int):
+        try:
+            await callback(position)
+        except Exception as e:
+            logger.warning(f"Не удалось сообщить место в очереди: {e}")
+
+
+# Общий на процесс ограничитель запросов к YandexGPT
+llm_limiter = LLMLimiter(LLM_MAX_CONCURRENT, LLM_RPS, LLM_TPM)
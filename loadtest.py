@@ -0,0 +1,305 @@
+"""Нагрузочный тест бота без сети: локальные имитаторы Bot API и YandexGPT.
+
+Запускает два HTTP-сервера на 127.0.0.1 с настраиваемыми задержкой и долей ошибок,
+направляет на них бота (TELEGRAM_API_URL и LLM_URL) и проводит --users пользователей
+через всю викторину: /start, ответы, вопрос на промежуточном экране, финал.
+Апдейты подаются прямо в диспетчер, как это делают обработчики вебхука.
+В конце печатает пропускную способность, перцентили задержки и расход памяти.
+
+Пример:
+    python loadtest.py --users 2000 --concurrency 200 --tg-latency 0.05 --llm-latency 0.5
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import os
+import random
+import tempfile
+import time
+from collections import Counter, defaultdict
+
+from aiohttp import web
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+class FakeBotAPI:
+    """Имитатор Bot API: отвечает на любые методы правдоподобным результатом"""
+
+    def __init__(self, latency: float, error_rate: float, flood_rate: float):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.flood_rate = flood_rate
+        self.calls = Counter()
+        self._message_ids = itertools.count(1000)
+
+    def _message(self, chat_id, photo: bool) -> dict:
+        message = {"message_id": next(self._message_ids), "date": int(time.time()),
+                   "chat": {"id": chat_id, "type": "private"}}
+        if photo:
+            message["photo"] = [{"file_id": "photo", "file_unique_id": "photo", "width": 1280, "height": 1280}]
+        else:
+            message["text"] = "..."
+        return message
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"].lower()
+        self.calls[method] += 1
+        if request.content_type.startswith("multipart"):
+            data = {}
+            async for part in await request.multipart():
+                data[part.name] = await part.text() if part.filename is None else None
+        else:
+            data = dict(await request.post())
+        await asyncio.sleep(self.latency)
+
+        roll = random.random()
+        if roll < self.flood_rate:
+            return web.json_response({"ok": False, "error_code": 429, "description": "Too Many Requests: retry after 1",
+                                      "parameters": {"retry_after": 1}})
+        if roll < self.flood_rate + self.error_rate:
+            return web.json_response({"ok": False, "error_code": 500, "description": "Internal Server Error"})
+
+        chat_id = int(data.get("chat_id") or 1)
+        if method == "getme":
+            result = {"id": 1, "is_bot": True, "first_name": "Бот", "username": "loadtest_bot"}
+        elif method in ("answercallbackquery", "setwebhook", "deletewebhook"):
+            result = True
+        else:
+            result = self._message(chat_id, photo=method in ("sendphoto", "editmessagemedia", "editmessagecaption"))
+        return web.json_response({"ok": True, "result": result})
+
+
+class FakeYandexGPT:
+    """Имитатор completion-эндпоинта YandexGPT: обычного, потокового и асинхронных операций"""
+
+    ANSWER = "Паровоз — локомотив с паровой машиной. Первые паровозы появились в начале XIX века."
+
+    def __init__(self, latency: float, error_rate: float, chunks: int = 4):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.chunks = chunks
+        self.calls = 0
+        self.operations = {}  # id операции -> (готова в, текст ответа)
+        self._operation_ids = itertools.count(1)
+
+    @staticmethod
+    def _usage(text: str) -> dict:
+        # Примерно как у YandexGPT для русского текста: около 4 символов на токен
+        return {"inputTextTokens": "60", "completionTokens": str(len(text) // 4 + 1),
+                "totalTokens": str(60 + len(text) // 4 + 1)}
+
+    @classmethod
+    def _result(cls, text: str) -> bytes:
+        return json.dumps({"result": {"alternatives": [{"message": {"role": "assistant", "text": text}}],
+                                      "usage": cls._usage(text)}},
+                          ensure_ascii=False).encode()
+
+    async def handle(self, request: web.Request) -> web.StreamResponse:
+        self.calls += 1
+        body = await request.json()
+        await asyncio.sleep(self.latency)
+        if random.random() < self.error_rate:
+            return web.Response(status=503)
+
+        if not body["completionOptions"].get("stream"):
+            return web.Response(body=self._result(self.ANSWER), content_type="application/json")
+
+        response = web.StreamResponse()
+        await response.prepare(request)
+        step = len(self.ANSWER) // self.chunks + 1
+        for end in range(step, len(self.ANSWER) + step, step):
+            await response.write(self._result(self.ANSWER[:end]) + b"\n")
+            await asyncio.sleep(self.latency / self.chunks)
+        await response.write_eof()
+        return response
+
+    async def handle_async(self, request: web.Request) -> web.Response:
+        """completionAsync: сразу возвращает операцию, ответ будет готов через latency"""
+        self.calls += 1
+        await request.json()
+        if random.random() < self.error_rate:
+            return web.Response(status=503)
+        operation_id = f"op{next(self._operation_ids)}"
+        self.operations[operation_id] = (time.monotonic() + self.latency, self.ANSWER)
+        return web.json_response({"id": operation_id, "done": False})
+
+    async def handle_operation(self, request: web.Request) -> web.Response:
+        operation_id = request.match_info["id"]
+        if operation_id not in self.operations:
+            return web.Response(status=404)
+        ready_at, text = self.operations[operation_id]
+        if time.monotonic() < ready_at:
+            return web.json_response({"id": operation_id, "done": False})
+        del self.operations[operation_id]
+        return web.json_response({"id": operation_id, "done": True, "response": {
+            "alternatives": [{"message": {"role": "assistant", "text": text}, "status": "ALTERNATIVE_STATUS_FINAL"}],
+            "usage": self._usage(text)
+        }})
+
+
+async def start_server(app: web.Application, port: int) -> web.AppRunner:
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", port).start()
+    return runner
+
+
+def percentile(values: list, p: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+async def run_user(bot_module, user_id: int, think: float, question: str, latencies: dict, errors: Counter):
+    """Один пользователь проходит викторину целиком"""
+    from aiogram.types import Update
+    from callbacks import encode
+    from fake_telegram import make_message_update, make_callback_update
+
+    quiz = bot_module.get_quiz()
+
+    def answer(step):
+        # Вариант выбирается случайно, чтобы были и верные, и неверные ответы
+        return make_callback_update(user_id, encode("answer", quiz=quiz.quiz_id, step=step.index,
+                                                    option=random.randrange(len(step.responses))), photo=True)
+
+    updates = [("start", make_message_update(user_id, "/start")),
+               ("start_quiz", make_callback_update(user_id, encode("start")))]
+    for step in quiz.steps:
+        if step.kind == "question":
+            updates.append(("answer", answer(step)))
+        elif step.kind == "screen":
+            updates += [("ask", make_callback_update(user_id, encode("ask"), photo=True)),
+                        ("gpt_question", make_message_update(user_id, question)),
+                        ("back", make_callback_update(user_id, encode("back"))),
+                        ("next", make_callback_update(user_id, encode("next"), photo=True))]
+
+    for name, update in updates:
+        started = time.perf_counter()
+        try:
+            await bot_module.dp.feed_update(bot_module.bot, Update.model_validate(update, context={"bot": bot_module.bot}))
+        except Exception as e:
+            errors[f"{name}: {type(e).__name__}"] += 1
+        latencies[name].append(time.perf_counter() - started)
+        if think:
+            await asyncio.sleep(random.uniform(0, 2 * think))
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=1000, help="Сколько пользователей пройдет викторину")
+    parser.add_argument("--concurrency", type=int, default=100, help="Сколько пользователей одновременно")
+    parser.add_argument("--think", type=float, default=0.0, help="Средняя пауза пользователя между действиями, сек")
+    parser.add_argument("--questions", type=int, default=50, help="Сколько разных вопросов к YandexGPT задают пользователи")
+    parser.add_argument("--tg-latency", type=float, default=0.03, help="Задержка ответа Bot API, сек")
+    parser.add_argument("--tg-error-rate", type=float, default=0.0, help="Доля ответов Bot API с ошибкой 500")
+    parser.add_argument("--tg-flood-rate", type=float, default=0.0, help="Доля ответов Bot API с 429 retry_after")
+    parser.add_argument("--llm-latency", type=float, default=0.5, help="Задержка ответа YandexGPT, сек")
+    parser.add_argument("--llm-error-rate", type=float, default=0.0, help="Доля ответов YandexGPT с 503")
+    parser.add_argument("--readings", type=int, default=0,
+                        help="Сколько длинных раскладов таро сгенерировать пакетом после викторины")
+    parser.add_argument("--batch-mode", choices=("operation", "concurrent"), default="operation",
+                        help="Режим пакета: асинхронные операции или параллельные запросы")
+    parser.add_argument("--telegram-limits", action="store_true",
+                        help="Оставить лимиты Telegram (TG_*_RATE); по умолчанию сняты, чтобы мерить сам бот")
+    parser.add_argument("--tg-port", type=int, default=8881)
+    parser.add_argument("--llm-port", type=int, default=8882)
+    args = parser.parse_args()
+
+    tg = FakeBotAPI(args.tg_latency, args.tg_error_rate, args.tg_flood_rate)
+    llm = FakeYandexGPT(args.llm_latency, args.llm_error_rate)
+    tg_app = web.Application()
+    tg_app.router.add_post("/bot{token}/{method}", tg.handle)
+    llm_app = web.Application()
+    llm_app.router.add_post("/completion", llm.handle)
+    llm_app.router.add_post("/completionAsync", llm.handle_async)
+    llm_app.router.add_get("/operations/{id}", llm.handle_operation)
+    runners = [await start_server(tg_app, args.tg_port), await start_server(llm_app, args.llm_port)]
+
+    # Конфигурация читается при импорте bot, поэтому окружение готовим заранее
+    workdir = tempfile.mkdtemp(prefix="loadtest_")
+    os.environ.update({
+        "BOT_TOKEN": "123456:LOADTEST",
+        "TELEGRAM_API_URL": f"http://127.0.0.1:{args.tg_port}",
+        "LLM_URL": f"http://127.0.0.1:{args.llm_port}/completion",
+        "LLM_ASYNC_URL": f"http://127.0.0.1:{args.llm_port}/completionAsync",
+        "LLM_OPERATIONS_URL": f"http://127.0.0.1:{args.llm_port}/operations",
+        "LLM_AUTHORIZATION": "Api-Key loadtest",
+        "STORAGE_BACKEND": "memory",
+        "ANSWER_CACHE_PATH": "",
+        "IMAGE_CACHE_PATH": os.path.join(workdir, "file_ids.json"),
+        "METRICS_PORT": "0",
+        "LLM_AUDIT_PATH": os.path.join(workdir, "llm_audit.jsonl"),
+        "TAROT_LIBRARY_PATH": os.path.join(workdir, "tarot_library.sqlite3"),
+        "QUIZ_ADVANCE_DELAY": "0",
+    })
+    os.environ.setdefault("LLM_POLL_INTERVAL", "0.1")
+    if not args.telegram_limits:
+        os.environ.update({"TG_GLOBAL_RATE": "0", "TG_CHAT_RATE": "0"})
+    import bot as bot_module
+    logging.getLogger().setLevel(logging.WARNING)
+
+    latencies = defaultdict(list)
+    errors = Counter()
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def limited(user_id: int):
+        async with semaphore:
+            question = f"Сколько угля сжигал паровоз серии {user_id % args.questions} за смену?"
+            await run_user(bot_module, user_id, args.think, question, latencies, errors)
+
+    await bot_module.open_pool()
+    audit_log = bot_module.open_audit_log()
+    started = time.perf_counter()
+    await asyncio.gather(*(limited(100000 + i) for i in range(args.users)))
+    elapsed = time.perf_counter() - started
+
+    all_latencies = [value for values in latencies.values() for value in values]
+    print(f"Пользователей: {args.users}, одновременно: {args.concurrency}, время: {elapsed:.2f} с")
+    print(f"Апдейтов: {len(all_latencies)}, {len(all_latencies) / elapsed:.1f} в секунду, "
+          f"{args.users / elapsed:.1f} пользователей в секунду")
+    print(f"{'апдейт':<14}{'кол-во':>8}{'p50, мс':>10}{'p95, мс':>10}{'p99, мс':>10}")
+    for name, values in list(latencies.items()) + [("все", all_latencies)]:
+        print(f"{name:<14}{len(values):>8}" + "".join(
+            f"{percentile(values, p) * 1000:>10.1f}" for p in (50, 95, 99)
+        ))
+    print(f"Запросов к Bot API: {sum(tg.calls.values())} {dict(tg.calls.most_common())}")
+    print(f"Запросов к YandexGPT: {llm.calls}, кэш ответов: {bot_module.answer_cache.stats()}")
+    print(f"Сессии: {bot_module.user_results.stats()}")
+    if resource is not None:
+        print(f"Пиковый RSS процесса: {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.1f} МБ")
+    if errors:
+        print(f"Ошибки: {dict(errors.most_common())}")
+
+    if args.readings:
+        import gpt_requests
+        readings = [(random.choice(list(gpt_requests.SPREADS)), f"Вам выпали карты: расклад {i}")
+                    for i in range(args.readings)]
+        started = time.perf_counter()
+        answers = await gpt_requests.batch_readings(readings, args.batch_mode)
+        elapsed = time.perf_counter() - started
+        print(f"Раскладов пакетом ({args.batch_mode}): {len(answers)}, ошибок: {answers.count(bot_module.ERROR_TEXT)}, "
+              f"время: {elapsed:.2f} с, {len(answers) / elapsed:.1f} в секунду")
+
+    audit_log.close()
+    import audit_log as audit_module
+    print(f"Журнал запросов YandexGPT ({audit_log.path}):")
+    print(audit_module.report(audit_module.read_records([str(audit_log.path)])))
+
+    await bot_module.close_pool()
+    await bot_module.bot.session.close()
+    await bot_module.user_results.close()
+    bot_module.answer_cache.close()
+    for runner in runners:
+        await runner.cleanup()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
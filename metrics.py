@@ -0,0 +1,255 @@
+import asyncio
+import bisect
+import logging
+import signal
+import time
+from contextlib import contextmanager
+from types import SimpleNamespace
+
+import aiohttp
+from aiohttp import web
+from aiogram import BaseMiddleware
+
+logger = logging.getLogger(__name__)
+
+# Границы корзин гистограмм в секундах: от быстрых обработчиков до долгих ответов YandexGPT
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _format_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{str(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Counter:
+    """Счетчик, который только растет"""
+
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, labels: tuple = ()):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self._values = {}  # значения меток -> число
+
+    def inc(self, amount: float = 1, *label_values):
+        self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self) -> list:
+        return [f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}"
+                for key, value in self._values.items()]
+
+
+class Histogram:
+    """Гистограмма с фиксированными корзинами, как в Prometheus"""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labels: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        self._series = {}  # значения меток -> [счетчики корзин..., сумма, количество]
+
+    def observe(self, value: float, *label_values):
+        series = self._series.get(label_values)
+        if series is None:
+            # Корзины, корзина +Inf, сумма и количество
+            series = self._series[label_values] = [0] * (len(self.buckets) + 3)
+        series[bisect.bisect_left(self.buckets, value)] += 1
+        series[-2] += value
+        series[-1] += 1
+
+    @contextmanager
+    def time(self, *label_values):
+        """Замеряет время выполнения блока with"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *label_values)
+
+    def render(self) -> list:
+        lines = []
+        for key, series in self._series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {_format_value(series[-2])}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {series[-1]}")
+        return lines
+
+
+class CallbackMetric:
+    """Значение, которое читается из состояния бота в момент выгрузки.
+
+    func возвращает число или словарь {значение метки: число}.
+    """
+
+    def __init__(self, name: str, help_text: str, func, kind: str = "gauge", label: str = None):
+        self.name = name
+        self.help = help_text
+        self.func = func
+        self.kind = kind
+        self.label = label
+
+    def render(self) -> list:
+        try:
+            value = self.func()
+        except Exception as e:
+            logger.warning(f"Не удалось прочитать метрику {self.name}: {e}")
+            return []
+        if isinstance(value, dict):
+            return [f'{self.name}{{{self.label}="{key}"}} {_format_value(v)}' for key, v in value.items()]
+        return [f"{self.name} {_format_value(value)}"]
+
+
+class MetricsRegistry:
+    """Набор метрик процесса и их выгрузка в текстовом формате Prometheus"""
+
+    def __init__(self):
+        self._metrics = {}
+
+    def _add(self, metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"Метрика {metric.name} уже зарегистрирована")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help_text: str, labels: tuple = ()) -> Counter:
+        return self._add(Counter(name, help_text, labels))
+
+    def histogram(self, name: str, help_text: str, labels: tuple = (), buckets: tuple = DEFAULT_BUCKETS) -> Histogram:
+        return self._add(Histogram(name, help_text, labels, buckets))
+
+    def gauge(self, name: str, help_text: str, func, label: str = None):
+        """Текущее значение из func()"""
+        return self._add(CallbackMetric(name, help_text, func, "gauge", label))
+
+    def counter_func(self, name: str, help_text: str, func, label: str = None):
+        """Счетчик, который уже ведет другой модуль (например, попадания в кэш)"""
+        return self._add(CallbackMetric(name, help_text, func, "counter", label))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+# Общий на процесс набор метрик
+registry = MetricsRegistry()
+
+handler_latency = registry.histogram(
+    "bot_handler_seconds", "Время работы обработчиков апдейтов", ("handler",)
+)
+handler_errors = registry.counter(
+    "bot_handler_errors_total", "Исключения в обработчиках апдейтов", ("handler",)
+)
+llm_dns = registry.histogram("llm_dns_seconds", "Разрешение имени YandexGPT")
+llm_connect = registry.histogram("llm_connect_seconds", "Установка нового соединения с YandexGPT (TCP и TLS)")
+llm_ttfb = registry.histogram(
+    "llm_ttfb_seconds", "От отправки запроса до заголовков ответа YandexGPT", ("mode",)
+)
+llm_first_token = registry.histogram(
+    "llm_first_token_seconds", "От отправки потокового запроса до первого фрагмента ответа"
+)
+llm_total = registry.histogram(
+    "llm_request_seconds", "Полное время make_zap вместе с очередью и повторами", ("mode",)
+)
+
+
+class HandlerTimer(BaseMiddleware):
+    """Замеряет время обработчиков. name_of(event, data) может уточнить имя обработчика"""
+
+    def __init__(self, name_of=None):
+        self.name_of = name_of
+
+    async def __call__(self, handler, event, data: dict):
+        name = self.name_of(event, data) if self.name_of is not None else None
+        if name is None:
+            name = data["handler"].callback.__name__
+        start = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            handler_errors.inc(1, name)
+            raise
+        finally:
+            handler_latency.observe(time.perf_counter() - start, name)
+
+
+def create_trace_config() -> aiohttp.TraceConfig:
+    """Трассировка запросов aiohttp к YandexGPT: DNS, соединение и время до заголовков ответа"""
+
+    def context_factory(trace_request_ctx=None):
+        return SimpleNamespace(mode=(trace_request_ctx or {}).get("mode", "async"))
+
+    trace = aiohttp.TraceConfig(trace_config_ctx_factory=context_factory)
+
+    async def on_request_start(session, ctx, params):
+        ctx.start = time.perf_counter()
+
+    async def on_dns_start(session, ctx, params):
+        ctx.dns_start = time.perf_counter()
+
+    async def on_dns_end(session, ctx, params):
+        llm_dns.observe(time.perf_counter() - ctx.dns_start)
+
+    async def on_connection_start(session, ctx, params):
+        ctx.connect_start = time.perf_counter()
+
+    async def on_connection_end(session, ctx, params):
+        llm_connect.observe(time.perf_counter() - ctx.connect_start)
+
+    async def on_request_end(session, ctx, params):
+        llm_ttfb.observe(time.perf_counter() - ctx.start, ctx.mode)
+
+    trace.on_request_start.append(on_request_start)
+    trace.on_dns_resolvehost_start.append(on_dns_start)
+    trace.on_dns_resolvehost_end.append(on_dns_end)
+    trace.on_connection_create_start.append(on_connection_start)
+    trace.on_connection_create_end.append(on_connection_end)
+    trace.on_request_end.append(on_request_end)
+    return trace
+
+
+async def handle_metrics(request: web.Request) -> web.Response:
+    return web.Response(text=registry.render(), content_type="text/plain", charset="utf-8")
+
+
+async def start_metrics_server(host: str, port: int, path: str) -> web.AppRunner:
+    """Отдает метрики по HTTP на отдельном порту"""
+    app = web.Application()
+    app.router.add_get(path, handle_metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info(f"Метрики доступны на http://{host}:{port}{path}")
+    return runner
+
+
+def dump_on_signal(signum: int = getattr(signal, "SIGUSR1", None)):
+    """Пишет все метрики в лог по сигналу (kill -USR1 <pid>)"""
+    if signum is None:
+        return
+    try:
+        asyncio.get_running_loop().add_signal_handler(
+            signum, lambda: logger.info(f"Метрики:\n{registry.render()}")
+        )
+    except (NotImplementedError, RuntimeError):
+        # Windows и запуск не в главном потоке: сигналы недоступны
+        pass
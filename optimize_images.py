@@ -0,0 +1,84 @@
+"""Сборка оптимизированных картинок викторины (выполняется при сборке Docker-образа).
+
+Каждая картинка из маршрутов викторин уменьшается до --max-side по большей стороне
+и сохраняется в JPEG. Telegram все равно пережимает фото в JPEG, поэтому отправлять
+PNG по несколько мегабайт незачем. Результат описывается в манифесте, который бот
+читает при запуске вместо проверки файлов на диске.
+
+Пример:
+    pip install Pillow
+    python optimize_images.py
+"""
+import argparse
+import hashlib
+import json
+import os
+from pathlib import Path
+
+from PIL import Image
+
+from quiz_data import QUIZZES
+
+
+def quiz_images() -> list:
+    """Пути всех картинок из маршрутов викторин без повторов"""
+    images = []
+    for flow in QUIZZES.values():
+        for item in flow:
+            image = (item.get('question') or item.get('screen')).get('image')
+            if image and image not in images:
+                images.append(image)
+    return images
+
+
+def optimize(source: str, out_dir: Path, max_side: int, quality: int) -> dict:
+    """Сохраняет уменьшенную JPEG-копию source и возвращает запись манифеста"""
+    target = out_dir / (Path(source).stem + ".jpg")
+    with Image.open(source) as image:
+        if image.mode != "RGB":
+            # Прозрачность в JPEG не поддерживается - кладем картинку на белый фон
+            background = Image.new("RGB", image.size, "white")
+            background.paste(image, mask=image.convert("RGBA").getchannel("A"))
+            image = background
+        image.thumbnail((max_side, max_side), Image.LANCZOS)
+        image.save(target, "JPEG", quality=quality, optimize=True, progressive=True)
+        width, height = image.size
+
+    data = target.read_bytes()
+    return {
+        "path": target.as_posix(),
+        "hash": hashlib.sha256(data).hexdigest(),
+        "width": width,
+        "height": height,
+        "bytes": len(data),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--out-dir", default="data/optimized", help="Каталог для оптимизированных картинок")
+    parser.add_argument("--manifest", default=os.getenv('IMAGE_MANIFEST_PATH', 'data/images.json'))
+    parser.add_argument("--max-side", type=int, default=1280, help="Наибольшая сторона, пикселей")
+    parser.add_argument("--quality", type=int, default=85, help="Качество JPEG")
+    args = parser.parse_args()
+
+    out_dir = Path(args.out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    manifest = {}
+    for source in quiz_images():
+        if not Path(source).exists():
+            print(f"{source}: нет файла, пропускаю")
+            continue
+        manifest[source] = entry = optimize(source, out_dir, args.max_side, args.quality)
+        print(f"{source}: {Path(source).stat().st_size // 1024} КБ -> {entry['path']} "
+              f"{entry['width']}x{entry['height']}, {entry['bytes'] // 1024} КБ")
+
+    manifest_path = Path(args.manifest)
+    manifest_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(manifest_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    print(f"Манифест: {manifest_path} ({len(manifest)} картинок)")
+
+
+if __name__ == "__main__":
+    main()
@@ -50,11 +50,34 @@ QUIZ_QUESTIONS = [
 # Промежуточный экран после вопроса 2 (индекс 1)
 INTERMEDIATE_SCREEN = {
     "image": "data/pic_3.png",
-    "text": "Вот и приехали!\n\nВаш поезд встал как вкопанный. Пока начальство ищет слова для объявления, проверьте, нет ли у вас своего вопроса о том, что нас, собственно, везло?"
+    "text": "Вот и приехали!\n\nВаш поезд встал как вкопанный. Пока начальство ищет слова для объявления, проверьте, нет ли у вас своего вопроса о том, что нас, собственно, везло?",
+    # Кнопки экрана: ask - вопрос YandexGPT, next - следующий шаг, restart - пройти заново
+    "buttons": [
+        {"text": "Вопрос", "action": "ask"},
+        {"text": "Нет вопросов", "action": "next"}
+    ]
 }
 
 # Финальный экран
 FINAL_SCREEN = {
     "image": "data/pic_7.png",
-    "text": "🎉 Ваш поезд успешно прибыл на конечную станцию! Надеемся, это путешествие в мир локомотивов было познавательным!"
+    "text": "🎉 Ваш поезд успешно прибыл на конечную станцию! Надеемся, это путешествие в мир локомотивов было познавательным!",
+    "buttons": [
+        {"text": "Повторить викторину", "action": "restart"}
+    ]
 }
+
+# Маршруты викторин: шаги по порядку, вопрос или экран. Последний шаг - финальный экран
+QUIZZES = {
+    "zavody": [
+        {"question": QUIZ_QUESTIONS[0]},
+        {"question": QUIZ_QUESTIONS[1]},
+        {"screen": INTERMEDIATE_SCREEN},
+        {"question": QUIZ_QUESTIONS[2]},
+        {"question": QUIZ_QUESTIONS[3]},
+        {"screen": FINAL_SCREEN}
+    ]
+}
+
+# Викторина по кнопке "Поехали" и команде /start без параметра
+DEFAULT_QUIZ = "zavody"
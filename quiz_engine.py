@@ -0,0 +1,126 @@
+import logging
+from dataclasses import dataclass
+from pathlib import Path
+
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+
+from callbacks import encode
+from image_registry import load_manifest
+from quiz_data import QUIZZES, DEFAULT_QUIZ
+from config import IMAGE_MANIFEST_PATH
+
+logger = logging.getLogger(__name__)
+
+# callback_data кнопок экранов по их действию (restart зависит от викторины)
+ACTION_CALLBACKS = {
+    "ask": encode("ask"),
+    "next": encode("next"),
+}
+
+
+@dataclass(frozen=True, slots=True)
+class Step:
+    """Готовый к показу шаг викторины"""
+    index: int
+    kind: str  # question, screen или final
+    text: str
+    image: str  # Путь к картинке или None, если ее нет
+    keyboard: InlineKeyboardMarkup
+    next: int  # Индекс следующего шага, у финального - None
+    correct: int = None
+    responses: tuple = ()  # Реакция на каждый вариант ответа
+
+
+@dataclass(frozen=True, slots=True)
+class Quiz:
+    quiz_id: str
+    steps: tuple
+    start_keyboard: InlineKeyboardMarkup
+
+    def step(self, index: int) -> Step:
+        """Шаг по индексу; все, что дальше конца маршрута, - финальный экран"""
+        return self.steps[min(max(index, 0), len(self.steps) - 1)]
+
+
+# Оптимизированные при сборке картинки: исходный путь -> запись с путем к JPEG
+image_manifest = load_manifest(IMAGE_MANIFEST_PATH)
+
+
+def _resolve_image(path: str):
+    """Путь к картинке для отправки: оптимизированная копия из манифеста или исходный файл"""
+    if not path:
+        return None
+    entry = image_manifest.get(path)
+    if entry and Path(entry['path']).exists():
+        return entry['path']
+    if not Path(path).exists():
+        logger.warning(f"Картинка {path} не найдена, шаг будет показан текстом")
+        return None
+    return path
+
+
+def _compile_question(quiz_id: str, index: int, question: dict) -> Step:
+    options = question['options']
+    correct = question['correct']
+    if not 0 <= correct < len(options):
+        raise ValueError(f"Викторина {quiz_id}, шаг {index}: нет варианта с номером {correct}")
+    keyboard = InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text=option, callback_data=encode("answer", quiz=quiz_id, step=index, option=i))]
+        for i, option in enumerate(options)
+    ])
+    return Step(
+        index=index,
+        kind="question",
+        text=question['question'],
+        image=_resolve_image(question.get('image')),
+        keyboard=keyboard,
+        next=index + 1,
+        correct=correct,
+        responses=tuple(question['responses'].get(i, "Ответ обработан") for i in range(len(options)))
+    )
+
+
+def _compile_screen(quiz_id: str, index: int, screen: dict, final: bool) -> Step:
+    rows = []
+    for button in screen.get('buttons', []):
+        action = button['action']
+        if action == "restart":
+            callback_data = encode("start", quiz=quiz_id)
+        elif action in ACTION_CALLBACKS:
+            callback_data = ACTION_CALLBACKS[action]
+        else:
+            raise ValueError(f"Викторина {quiz_id}, шаг {index}: неизвестное действие {action}")
+        rows.append([InlineKeyboardButton(text=button['text'], callback_data=callback_data)])
+    return Step(
+        index=index,
+        kind="final" if final else "screen",
+        text=screen['text'],
+        image=_resolve_image(screen.get('image')),
+        keyboard=InlineKeyboardMarkup(inline_keyboard=rows),
+        next=None if final else index + 1
+    )
+
+
+def compile_quiz(quiz_id: str, flow: list) -> Quiz:
+    """Собирает маршрут викторины в неизменяемые шаги с готовыми клавиатурами"""
+    if not flow or 'screen' not in flow[-1]:
+        raise ValueError(f"Викторина {quiz_id} должна заканчиваться экраном")
+    steps = []
+    for index, item in enumerate(flow):
+        if 'question' in item:
+            steps.append(_compile_question(quiz_id, index, item['question']))
+        else:
+            steps.append(_compile_screen(quiz_id, index, item['screen'], final=index == len(flow) - 1))
+    start_keyboard = InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="Поехали", callback_data=encode("start", quiz=quiz_id))]
+    ])
+    return Quiz(quiz_id, tuple(steps), start_keyboard)
+
+
+# Викторины собираются один раз при запуске бота
+quizzes = {quiz_id: compile_quiz(quiz_id, flow) for quiz_id, flow in QUIZZES.items()}
+
+
+def get_quiz(quiz_id: str = None) -> Quiz:
+    """Викторина по идентификатору, для неизвестного - викторина по умолчанию"""
+    return quizzes.get(quiz_id) or quizzes[DEFAULT_QUIZ]
@@ -0,0 +1,144 @@
+import json
+import logging
+import math
+import re
+from collections import Counter
+from pathlib import Path
+
+from gpt_cache import normalize_question
+from quiz_data import QUIZ_QUESTIONS
+from config import FAQ_PATH, RETRIEVAL_MIN_SCORE
+
+logger = logging.getLogger(__name__)
+
+# Частые слова, не несущие смысла для поиска
+STOP_WORDS = {
+    "а", "в", "во", "и", "к", "как", "ли", "на", "не", "о", "об", "от", "по", "с", "со", "у",
+    "что", "это", "этот", "эта", "эти", "то", "же", "за", "из", "для", "при", "или", "но",
+    "такое", "какой", "какая", "какие", "почему", "зачем", "где", "кто", "чем", "мне", "вы",
+    "вас", "нас", "мы", "он", "она", "они", "его", "ее", "их", "бы", "был", "была", "были",
+    "про", "расскажи", "расскажите", "скажи", "скажите", "значит", "пожалуйста", "подскажи",
+    "подскажите", "вообще", "знаешь", "знаете", "интересно", "такой"
+}
+
+# Длина основы слова: грубая замена стемминга для русских окончаний
+STEM_LENGTH = 5
+
+
+_SENTENCES = re.compile(r"[.!?]+")
+_WORDS = re.compile(r"\w+")
+
+
+def tokenize(text: str) -> list:
+    """Разбивает текст на основы слов без стоп-слов"""
+    return [word[:STEM_LENGTH] for word in normalize_question(text).split() if word not in STOP_WORDS]
+
+
+def entity_terms(text: str) -> set:
+    """Основы названий из текста: аббревиатуры (НЭВЗ), обозначения с цифрами (ТЭП70БС)
+    и слова с заглавной буквы не в начале предложения (Коломенский, Струве)
+    """
+    terms = set()
+    for sentence in _SENTENCES.split(text):
+        for position, word in enumerate(_WORDS.findall(sentence)):
+            if (len(word) > 1 and word.isupper()) or any(c.isdigit() for c in word) \
+                    or (position > 0 and word[0].isupper()):
+                terms.update(tokenize(word))
+    return terms
+
+
+class Document:
+    __slots__ = ("text", "answer", "terms", "length", "question_terms", "entities")
+
+    def __init__(self, text: str, answer: str = None, question: str = ""):
+        self.text = text  # Текст для поиска и контекста YandexGPT
+        self.answer = answer  # Готовый ответ пользователю (только у курируемых FAQ)
+        self.terms = Counter(tokenize(text))
+        self.length = sum(self.terms.values())
+        # Готовый ответ выдается только по совпадению с формулировками вопроса FAQ, а не с текстом ответа
+        self.question_terms = set(tokenize(question))
+        self.entities = entity_terms(question)
+
+    def answers(self, query: set) -> bool:
+        """Отвечает ли готовый ответ на вопрос: все его слова есть в вопросе FAQ и среди них есть название"""
+        return self.answer is not None and query <= self.question_terms and bool(query & self.entities)
+
+
+class Match:
+    __slots__ = ("document", "score", "coverage", "confident")
+
+    def __init__(self, document: Document, score: float, coverage: float, confident: bool = False):
+        self.document = document
+        self.score = score
+        self.coverage = coverage
+        self.confident = confident  # Можно ли ответить пользователю без YandexGPT
+
+
+class QuizIndex:
+    """BM25-индекс по фактам викторины и курируемому FAQ"""
+
+    K1 = 1.5
+    B = 0.75
+
+    def __init__(self, documents: list):
+        self.documents = documents
+        self.avg_length = sum(d.length for d in documents) / len(documents) if documents else 0
+        frequency = Counter(term for d in documents for term in d.terms)
+        total = len(documents)
+        self.idf = {
+            term: math.log(1 + (total - count + 0.5) / (count + 0.5))
+            for term, count in frequency.items()
+        }
+
+    def search(self, question: str):
+        """Лучшее совпадение для вопроса или None"""
+        query = set(tokenize(question))
+        if not query:
+            return None
+
+        best = None
+        confident = None
+        for document in self.documents:
+            score = 0.0
+            matched = 0
+            for term in query:
+                tf = document.terms.get(term)
+                if not tf:
+                    continue
+                matched += 1
+                norm = self.K1 * (1 - self.B + self.B * document.length / self.avg_length)
+                score += self.idf[term] * tf * (self.K1 + 1) / (tf + norm)
+            if score > 0 and (best is None or score > best.score):
+                best = Match(document, score, matched / len(query))
+            if score >= RETRIEVAL_MIN_SCORE and document.answers(query) \
+                    and (confident is None or score > confident.score):
+                confident = Match(document, score, matched / len(query), confident=True)
+        # Без уверенного совпадения лучший документ идет в YandexGPT как справка
+        return confident or best
+
+
+def load_documents(faq_path: str = FAQ_PATH) -> list:
+    """Документы индекса: вопросы викторины с правильными ответами и записи FAQ"""
+    documents = []
+    for question in QUIZ_QUESTIONS:
+        correct = question['correct']
+        documents.append(Document(
+            f"{question['question']}\nПравильный ответ: {question['options'][correct]}. "
+            f"{question['responses'][correct]}"
+        ))
+
+    path = Path(faq_path)
+    if path.exists():
+        try:
+            with open(path, encoding='utf-8') as f:
+                for item in json.load(f):
+                    documents.append(Document(
+                        f"{item['question']}\n{item['answer']}", item['answer'], item['question']
+                    ))
+        except (OSError, ValueError, KeyError) as e:
+            logger.error(f"Не удалось загрузить FAQ {faq_path}: {e}")
+    return documents
+
+
+# Индекс строится один раз при запуске бота
+quiz_index = QuizIndex(load_documents())
@@ -0,0 +1,109 @@
+import asyncio
+import logging
+import random
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# HTTP-статусы, при которых запрос имеет смысл повторить
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+# Статусы, которые не лечатся повтором, но для пользователя означают недоступность YandexGPT
+# (неверный или просроченный ключ)
+OUTAGE_STATUSES = {401, 403}
+
+
+class LLMError(Exception):
+    """Ошибка запроса к YandexGPT"""
+
+    def __init__(self, message: str, retryable: bool = False, retry_after: float = None, status: int = None):
+        super().__init__(message)
+        self.retryable = retryable
+        self.retry_after = retry_after
+        self.status = status  # HTTP-статус ответа, если ошибку вернул сервер
+
+
+def backoff_delay(attempt: int, base_delay: float, max_delay: float) -> float:
+    """Экспоненциальная задержка с полным джиттером для попытки attempt (с нуля)"""
+    return random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+
+
+async def retry_async(func, attempts: int, base_delay: float, max_delay: float):
+    """Вызывает корутину func(), повторяя ее при LLMError с retryable=True"""
+    for attempt in range(attempts):
+        try:
+            return await func()
+        except LLMError as e:
+            if not e.retryable or attempt == attempts - 1:
+                raise
+            delay = max(backoff_delay(attempt, base_delay, max_delay), e.retry_after or 0)
+            logger.warning(f"Повтор запроса к YandexGPT через {delay:.1f} с: {e}")
+            await asyncio.sleep(delay)
+
+
+def retry_sync(func, attempts: int, base_delay: float, max_delay: float):
+    """Синхронный вариант retry_async"""
+    for attempt in range(attempts):
+        try:
+            return func()
+        except LLMError as e:
+            if not e.retryable or attempt == attempts - 1:
+                raise
+            delay = max(backoff_delay(attempt, base_delay, max_delay), e.retry_after or 0)
+            logger.warning(f"Повтор запроса к YandexGPT через {delay:.1f} с: {e}")
+            time.sleep(delay)
+
+
+class CircuitBreaker:
+    """Предохранитель: после failure_threshold ошибок подряд размыкается на reset_timeout секунд.
+
+    Пока он разомкнут, allow() возвращает False и запросы не отправляются.
+    По истечении reset_timeout пропускается один пробный запрос: успех замыкает
+    предохранитель, ошибка снова размыкает его. Если пробный запрос не завершился
+    за reset_timeout (например, был отменен), пропускается следующий.
+    Методы потокобезопасны: синхронный make_zap вызывает их из потоков.
+    """
+
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._probe_at = None
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half-open"
+        return "open"
+
+    def allow(self) -> bool:
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return True
+            now = time.monotonic()
+            if state == "half-open" and (self._probe_at is None or now - self._probe_at >= self.reset_timeout):
+                self._probe_at = now
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            if self.opened_at is not None:
+                logger.info("YandexGPT снова отвечает, предохранитель замкнут")
+            self.failures = 0
+            self.opened_at = None
+            self._probe_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.failure_threshold:
+                if self.opened_at is None:
+                    logger.error(f"YandexGPT недоступен ({self.failures} ошибок подряд), предохранитель разомкнут")
+                self.opened_at = time.monotonic()
+                self._probe_at = None
@@ -0,0 +1,147 @@
+import asyncio
+import itertools
+import logging
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import AnswerCallbackQuery
+
+from token_bucket import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+# Приоритеты исходящих сообщений (меньше - важнее)
+PRIORITY_INTERACTIVE = 0  # Ответы на действия пользователя: экраны викторины, готовые ответы YandexGPT
+PRIORITY_BACKGROUND = 1  # Промежуточные правки: фрагменты потокового ответа, место в очереди
+
+send_priority = ContextVar("send_priority", default=PRIORITY_INTERACTIVE)
+
+
+@contextmanager
+def background_sending():
+    """Помечает отправки внутри блока как фоновые: они уступают интерактивным"""
+    token = send_priority.set(PRIORITY_BACKGROUND)
+    try:
+        yield
+    finally:
+        send_priority.reset(token)
+
+
+class _Waiter:
+    __slots__ = ("priority", "seq", "chat_id", "future")
+
+    def __init__(self, priority, seq, chat_id, future):
+        self.priority = priority
+        self.seq = seq
+        self.chat_id = chat_id
+        self.future = future
+
+
+class SendScheduler(BaseRequestMiddleware):
+    """Очередь всех исходящих запросов бота к Telegram.
+
+    Запросы в чаты проходят через общее ведро на global_rate сообщений в секунду
+    и ведро каждого чата на chat_rate в секунду (с запасом chat_burst). Первыми
+    обслуживаются интерактивные ответы, затем фоновые правки. Ответы на нажатия кнопок
+    (answerCallbackQuery) и служебные запросы без chat_id идут без очереди.
+    При RetryAfter чат ставится на паузу на указанное Telegram время, а запрос повторяется.
+    """
+
+    def __init__(self, global_rate: float, chat_rate: float, chat_burst: float, max_retries: int):
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self._global = TokenBucket(global_rate, global_rate)
+        self._chats = {}  # chat_id -> TokenBucket
+        self._paused = {}  # chat_id -> до какого момента пауза после RetryAfter
+        self._waiting = []
+        self._seq = itertools.count()
+        self._timer = None
+
+    @property
+    def queue_size(self) -> int:
+        return len(self._waiting)
+
+    async def __call__(self, make_request, bot, method):
+        chat_id = getattr(method, "chat_id", None)
+        if chat_id is None or isinstance(method, AnswerCallbackQuery):
+            return await make_request(bot, method)
+
+        for attempt in range(self.max_retries + 1):
+            await self._acquire(chat_id)
+            try:
+                return await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                if attempt == self.max_retries:
+                    raise
+                logger.warning(f"Telegram просит подождать {e.retry_after} с (чат {chat_id})")
+                self._pause(chat_id, e.retry_after)
+
+    def _pause(self, chat_id, seconds: float):
+        self._paused[chat_id] = max(self._paused.get(chat_id, 0), time.monotonic() + seconds)
+
+    async def _acquire(self, chat_id):
+        waiter = _Waiter(send_priority.get(), next(self._seq), chat_id, asyncio.get_running_loop().create_future())
+        self._waiting.append(waiter)
+        self._dispatch()
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            if waiter in self._waiting:
+                self._waiting.remove(waiter)
+            raise
+
+    def _chat_bucket(self, chat_id) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            bucket = self._chats[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    def _dispatch(self):
+        """Пропускает ожидающих по приоритету, пока позволяют лимиты"""
+        now = time.monotonic()
+        next_check = None
+        self._waiting.sort(key=lambda w: (w.priority, w.seq))
+        for waiter in list(self._waiting):
+            wait = self._paused.get(waiter.chat_id, 0) - now
+            wait = max(wait, self._chat_bucket(waiter.chat_id).delay(1, now))
+            if wait > 0:
+                # Этот чат пока занят, но другие чаты могут отправлять
+                next_check = wait if next_check is None else min(next_check, wait)
+                continue
+            global_wait = self._global.delay(1, now)
+            if global_wait > 0:
+                next_check = global_wait if next_check is None else min(next_check, global_wait)
+                break
+            self._global.take(1)
+            self._chat_bucket(waiter.chat_id).take(1)
+            self._waiting.remove(waiter)
+            waiter.future.set_result(None)
+
+        if next_check is not None:
+            self._schedule(next_check)
+        self._cleanup(now)
+
+    def _schedule(self, delay: float):
+        loop = asyncio.get_running_loop()
+        if self._timer is not None:
+            if self._timer.when() <= loop.time() + delay:
+                return
+            self._timer.cancel()
+        self._timer = loop.call_later(delay, self._on_timer)
+
+    def _on_timer(self):
+        self._timer = None
+        self._dispatch()
+
+    def _cleanup(self, now: float):
+        """Забывает простаивающие чаты, чтобы словари не росли бесконечно"""
+        if len(self._chats) > 10000:
+            busy = {w.chat_id for w in self._waiting}
+            for chat_id in [c for c, b in self._chats.items() if c not in busy and b.delay(self.chat_burst, now) == 0]:
+                del self._chats[chat_id]
+        for chat_id in [c for c, until in self._paused.items() if until <= now]:
+            del self._paused[chat_id]
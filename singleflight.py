@@ -0,0 +1,94 @@
+import asyncio
+import threading
+
+
+class _SyncCall:
+    """Выполняющийся синхронный запрос и его результат"""
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+def _consume_exception(future: asyncio.Future):
+    # Помечаем исключение как полученное, даже если ведомых запросов не было
+    if not future.cancelled():
+        future.exception()
+
+
+class SingleFlight:
+    """Объединение одинаковых одновременных запросов.
+
+    Пока запрос с ключом key выполняется, остальные вызовы с тем же ключом
+    не делают свой HTTP-запрос, а ждут результат уже идущего.
+    """
+
+    def __init__(self):
+        self._tasks = {}  # ключ -> asyncio.Future
+        self._sync_calls = {}  # ключ -> _SyncCall
+        self._lock = threading.Lock()
+        self.shared = 0  # Сколько вызовов получили чужой результат
+
+    async def do(self, key: str, func):
+        """Выполняет корутину func() один раз на все одновременные вызовы с ключом key"""
+        task = self._tasks.get(key)
+        if task is None:
+            # Отдельная задача: отмена одного из ждущих не отменяет запрос для остальных
+            task = asyncio.ensure_future(func())
+            self._register(key, task)
+        else:
+            self.shared += 1
+        return await asyncio.shield(task)
+
+    def pending(self, key: str):
+        """Future выполняющегося запроса с ключом key или None"""
+        return self._tasks.get(key)
+
+    def lead(self, key: str) -> asyncio.Future:
+        """Регистрирует запрос, результат которого ведущий выставит сам (например, после потоковой выдачи)"""
+        future = asyncio.get_running_loop().create_future()
+        self._register(key, future)
+        return future
+
+    async def wait(self, future: asyncio.Future):
+        """Ожидает результат чужого запроса"""
+        self.shared += 1
+        return await asyncio.shield(future)
+
+    def _register(self, key: str, future: asyncio.Future):
+        self._tasks[key] = future
+        future.add_done_callback(_consume_exception)
+        future.add_done_callback(lambda f: self._tasks.pop(key, None) if self._tasks.get(key) is f else None)
+
+    def do_sync(self, key: str, func):
+        """Синхронный вариант do для вызовов из потоков"""
+        with self._lock:
+            call = self._sync_calls.get(key)
+            leader = call is None
+            if leader:
+                call = _SyncCall()
+                self._sync_calls[key] = call
+            else:
+                self.shared += 1
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = func()
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._sync_calls[key]
+            call.event.set()
+
+
+# Общий на процесс реестр выполняющихся запросов к YandexGPT
+inflight = SingleFlight()
@@ -0,0 +1,276 @@
+import asyncio
+import json
+import sqlite3
+import sys
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder
+from aiogram.fsm.storage.memory import MemoryStorage
+
+from config import STORAGE_BACKEND, STORAGE_PATH, REDIS_URL, SESSION_MAX, SESSION_TTL
+
+
+class QuizSession:
+    """Прогресс пользователя: викторина, текущий шаг и битовые маски ответов по номерам шагов"""
+
+    __slots__ = ("quiz", "step", "answered", "correct", "touched")
+
+    def __init__(self, quiz: str = None, step: int = 0, answered: int = 0, correct: int = 0):
+        self.quiz = quiz
+        self.step = step
+        self.answered = answered  # Бит i - на шаг i ответили
+        self.correct = correct  # Бит i - на шаг i ответили верно
+        self.touched = 0.0  # Когда сессию последний раз читали или сохраняли
+
+    @property
+    def correct_answers(self) -> int:
+        return self.correct.bit_count()
+
+    def record(self, step: int, is_correct: bool):
+        """Запоминает ответ на шаг step"""
+        self.answered |= 1 << step
+        if is_correct:
+            self.correct |= 1 << step
+
+    def dumps(self) -> str:
+        return json.dumps([self.quiz, self.step, self.answered, self.correct])
+
+    @classmethod
+    def loads(cls, value):
+        return cls(*json.loads(value))
+
+
+def new_session(quiz: str = None) -> QuizSession:
+    """Пустой прогресс викторины quiz для пользователя"""
+    return QuizSession(quiz)
+
+
+class ResultsStorage(ABC):
+    """Хранилище прогресса викторины: одна QuizSession на пользователя.
+
+    Сессии, к которым не обращались дольше ttl секунд, забываются.
+    """
+
+    @abstractmethod
+    async def get(self, user_id: int):
+        """Возвращает сессию пользователя или None"""
+
+    @abstractmethod
+    async def set(self, user_id: int, session: QuizSession):
+        """Сохраняет сессию пользователя"""
+
+    def stats(self) -> dict:
+        """Счетчики хранилища для логов"""
+        return {}
+
+    async def close(self):
+        """Освобождает ресурсы хранилища"""
+
+
+class MemoryResultsStorage(ResultsStorage):
+    """Прогресс в памяти процесса (теряется при перезапуске).
+
+    Не больше max_size сессий: при переполнении вытесняется та, к которой дольше
+    всего не обращались. Порядок OrderedDict совпадает с порядком обращений,
+    поэтому просроченные сессии всегда в начале и удаляются за O(1) на каждую.
+    """
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._sessions = OrderedDict()  # user_id -> QuizSession
+        self.evicted = 0
+
+    async def get(self, user_id: int):
+        now = time.monotonic()
+        self._expire(now)
+        session = self._sessions.get(user_id)
+        if session is not None:
+            session.touched = now
+            self._sessions.move_to_end(user_id)
+        return session
+
+    async def set(self, user_id: int, session: QuizSession):
+        now = time.monotonic()
+        session.touched = now
+        self._sessions[user_id] = session
+        self._sessions.move_to_end(user_id)
+        self._expire(now)
+        while len(self._sessions) > self.max_size:
+            self._sessions.popitem(last=False)
+            self.evicted += 1
+
+    def _expire(self, now: float):
+        while self._sessions:
+            session = next(iter(self._sessions.values()))
+            if now - session.touched < self.ttl:
+                break
+            self._sessions.popitem(last=False)
+            self.evicted += 1
+
+    def memory_usage(self) -> int:
+        """Примерный объем памяти под сессии в байтах: словарь, ключи и сами сессии"""
+        per_session = sys.getsizeof(QuizSession()) + sys.getsizeof(0.0) + sys.getsizeof(2 ** 40)
+        return sys.getsizeof(self._sessions) + len(self._sessions) * per_session
+
+    def stats(self) -> dict:
+        return {"sessions": len(self._sessions), "evicted": self.evicted, "bytes": self.memory_usage()}
+
+
+class SQLiteDatabase:
+    """Общее подключение к SQLite для FSM и прогресса викторины.
+
+    WAL позволяет нескольким процессам бота работать с одним файлом, но запись
+    ждет чужую блокировку до busy_timeout. Поэтому запросы выполняются не в цикле
+    событий, а по очереди в одном отдельном потоке (он же единственный писатель).
+    """
+
+    def __init__(self, path: str):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite")
+        self.conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("PRAGMA busy_timeout=5000")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS fsm (key TEXT PRIMARY KEY, state TEXT, data TEXT)"
+        )
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS quiz_sessions "
+            "(user_id INTEGER PRIMARY KEY, data TEXT NOT NULL, updated REAL NOT NULL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS quiz_sessions_updated ON quiz_sessions (updated)")
+        self._refs = 0
+
+    def acquire(self):
+        self._refs += 1
+        return self
+
+    def release(self):
+        """Закрывает подключение, когда его отпустили все владельцы"""
+        self._refs -= 1
+        if self._refs <= 0:
+            self._executor.submit(self.conn.close).result()
+            self._executor.shutdown()
+
+    async def execute(self, sql: str, params: tuple = ()):
+        """Выполняет запрос в потоке базы"""
+        await asyncio.get_running_loop().run_in_executor(self._executor, self.conn.execute, sql, params)
+
+    async def fetchone(self, sql: str, params: tuple = ()):
+        """Первая строка результата запроса, выполненного в потоке базы"""
+        return await asyncio.get_running_loop().run_in_executor(
+            self._executor, lambda: self.conn.execute(sql, params).fetchone()
+        )
+
+
+class SQLiteStorage(BaseStorage):
+    """FSM-хранилище aiogram на SQLite"""
+
+    def __init__(self, db: SQLiteDatabase):
+        self.db = db.acquire()
+        self.key_builder = DefaultKeyBuilder(with_bot_id=True, with_destiny=True)
+
+    async def set_state(self, key, state=None):
+        value = state.state if isinstance(state, State) else state
+        await self.db.execute(
+            "INSERT INTO fsm (key, state) VALUES (?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET state = excluded.state",
+            (self.key_builder.build(key), value)
+        )
+
+    async def get_state(self, key):
+        row = await self.db.fetchone("SELECT state FROM fsm WHERE key = ?", (self.key_builder.build(key),))
+        return row[0] if row else None
+
+    async def set_data(self, key, data):
+        await self.db.execute(
+            "INSERT INTO fsm (key, data) VALUES (?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET data = excluded.data",
+            (self.key_builder.build(key), json.dumps(data, ensure_ascii=False))
+        )
+
+    async def get_data(self, key):
+        row = await self.db.fetchone("SELECT data FROM fsm WHERE key = ?", (self.key_builder.build(key),))
+        if not row or not row[0]:
+            return {}
+        return json.loads(row[0])
+
+    async def close(self):
+        self.db.release()
+
+
+class SQLiteResultsStorage(ResultsStorage):
+    """Прогресс викторины в SQLite. Просроченные сессии удаляются раз в PRUNE_EVERY записей"""
+
+    PRUNE_EVERY = 100
+
+    def __init__(self, db: SQLiteDatabase, ttl: float):
+        self.db = db.acquire()
+        self.ttl = ttl
+        self._writes = 0
+
+    async def get(self, user_id: int):
+        row = await self.db.fetchone(
+            "SELECT data FROM quiz_sessions WHERE user_id = ? AND updated > ?",
+            (user_id, time.time() - self.ttl)
+        )
+        return QuizSession.loads(row[0]) if row else None
+
+    async def set(self, user_id: int, session: QuizSession):
+        now = time.time()
+        await self.db.execute(
+            "INSERT INTO quiz_sessions (user_id, data, updated) VALUES (?, ?, ?) "
+            "ON CONFLICT(user_id) DO UPDATE SET data = excluded.data, updated = excluded.updated",
+            (user_id, session.dumps(), now)
+        )
+        self._writes += 1
+        if self._writes % self.PRUNE_EVERY == 0:
+            await self.db.execute("DELETE FROM quiz_sessions WHERE updated <= ?", (now - self.ttl,))
+
+    async def close(self):
+        self.db.release()
+
+
+class RedisResultsStorage(ResultsStorage):
+    """Прогресс викторины в Redis (или совместимом хранилище), ключи живут ttl секунд"""
+
+    def __init__(self, redis, ttl: float, prefix: str = "quiz_session"):
+        self.redis = redis
+        self.ttl = ttl
+        self.prefix = prefix
+
+    async def get(self, user_id: int):
+        value = await self.redis.get(f"{self.prefix}:{user_id}")
+        return QuizSession.loads(value) if value is not None else None
+
+    async def set(self, user_id: int, session: QuizSession):
+        await self.redis.set(f"{self.prefix}:{user_id}", session.dumps(), ex=max(int(self.ttl), 1))
+
+    async def close(self):
+        # Подключение общее с FSM-хранилищем и закрывается вместе с ним
+        pass
+
+
+def create_storages(backend: str = STORAGE_BACKEND):
+    """Создает FSM-хранилище и хранилище прогресса для выбранного бэкенда"""
+    if backend == "memory":
+        return MemoryStorage(), MemoryResultsStorage(SESSION_MAX, SESSION_TTL)
+
+    if backend == "sqlite":
+        db = SQLiteDatabase(STORAGE_PATH)
+        return SQLiteStorage(db), SQLiteResultsStorage(db, SESSION_TTL)
+
+    if backend == "redis":
+        # redis нужен только для этого бэкенда
+        from aiogram.fsm.storage.redis import RedisStorage
+
+        fsm_storage = RedisStorage.from_url(REDIS_URL)
+        return fsm_storage, RedisResultsStorage(fsm_storage.redis, SESSION_TTL)
+
+    raise ValueError(f"Неизвестный STORAGE_BACKEND: {backend}")
@@ -0,0 +1,258 @@
+"""Библиотека заранее сгенерированных толкований карт таро.
+
+Промпты gpt_requests.daycard и толкования отдельных карт для раскладов
+(crest5, star7, horse7) зависят только от карты и ее положения, поэтому
+их можно сгенерировать заранее: по --variants вариантов на каждую из 78 карт
+в прямом и перевернутом положении. Выдача толкования - случайный выбор
+из готовых вариантов (доли миллисекунды) вместо запроса к YandexGPT:
+gpt_requests.daycard и card_meaning сначала ищут готовые толкования здесь.
+Сами расклады (crest5, star7, horse7) по-прежнему пишет YandexGPT: общая
+картина и смысл позиций не складываются из толкований отдельных карт.
+Фоновое обновление (run_refresh, его запускает бот) постепенно
+перегенерирует самые старые варианты.
+
+Пример:
+    python tarot_library.py build --variants 5
+    python tarot_library.py refresh --interval 3600
+    python tarot_library.py stats
+"""
+import argparse
+import asyncio
+import logging
+import os
+import random
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+
+import gpt_requests
+from llm_client import ERROR_TEXT, make_zap
+from audit_log import open_audit_log
+from config import TAROT_LIBRARY_PATH, TAROT_VARIANTS, TAROT_REFRESH_INTERVAL, TAROT_REFRESH_BATCH
+
+logger = logging.getLogger(__name__)
+
+MAJOR_ARCANA = [
+    "Шут", "Маг", "Верховная Жрица", "Императрица", "Император", "Иерофант", "Влюбленные",
+    "Колесница", "Сила", "Отшельник", "Колесо Фортуны", "Справедливость", "Повешенный", "Смерть",
+    "Умеренность", "Дьявол", "Башня", "Звезда", "Луна", "Солнце", "Суд", "Мир",
+]
+SUITS = ["Жезлов", "Кубков", "Мечей", "Пентаклей"]
+RANKS = [
+    "Туз", "Двойка", "Тройка", "Четверка", "Пятерка", "Шестерка", "Семерка", "Восьмерка",
+    "Девятка", "Десятка", "Паж", "Рыцарь", "Королева", "Король",
+]
+DECK = MAJOR_ARCANA + [f"{rank} {suit}" for suit in SUITS for rank in RANKS]
+
+# Вид толкования -> шаблон промпта из gpt_requests
+KINDS = {
+    "daycard": gpt_requests.DAYCARD,  # карта дня
+    "meaning": gpt_requests.CARD_MEANING,  # карта в одной из позиций расклада
+}
+
+_REVERSED_MARK = "перевернут"
+_CARDS = {card.lower().replace("ё", "е"): card for card in DECK}
+
+
+def card_label(card: str, reversed_: bool) -> str:
+    """Название карты, как оно подставляется в промпт"""
+    return f"{card} (перевернутая)" if reversed_ else card
+
+
+def parse_card(text: str):
+    """Разбирает "Башня" или "Башня (перевернутая)" в (карта, перевернута) или None"""
+    name = text.lower().replace("ё", "е")
+    reversed_ = _REVERSED_MARK in name
+    if reversed_:
+        name = name[:name.index(_REVERSED_MARK)]
+    name = name.strip(" ()-,.")
+    card = _CARDS.get(name)
+    return (card, reversed_) if card else None
+
+
+class TarotLibrary:
+    """Толкования карт в SQLite с индексом id в памяти для мгновенного случайного выбора"""
+
+    def __init__(self, path: str):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS readings (id INTEGER PRIMARY KEY, kind TEXT NOT NULL, "
+            "card TEXT NOT NULL, reversed INTEGER NOT NULL, text TEXT NOT NULL, created REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS readings_card ON readings (kind, card, reversed)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS readings_created ON readings (created)")
+        self._ids = {}  # (вид, карта, перевернута) -> [id вариантов]
+        for row_id, kind, card, reversed_ in self._db.execute("SELECT id, kind, card, reversed FROM readings"):
+            self._ids.setdefault((kind, card, bool(reversed_)), []).append(row_id)
+
+    def pick(self, kind: str, card: str, reversed_: bool = False):
+        """Случайный готовый вариант толкования или None, если вариантов нет"""
+        ids = self._ids.get((kind, card, reversed_))
+        if not ids:
+            return None
+        row = self._db.execute("SELECT text FROM readings WHERE id = ?", (random.choice(ids),)).fetchone()
+        return row[0] if row else None
+
+    def count(self, kind: str, card: str, reversed_: bool) -> int:
+        return len(self._ids.get((kind, card, reversed_), ()))
+
+    def add(self, kind: str, card: str, reversed_: bool, text: str):
+        cursor = self._db.execute(
+            "INSERT INTO readings (kind, card, reversed, text, created) VALUES (?, ?, ?, ?, ?)",
+            (kind, card, int(reversed_), text, time.time())
+        )
+        self._ids.setdefault((kind, card, reversed_), []).append(cursor.lastrowid)
+
+    def replace(self, row_id: int, text: str):
+        """Заменяет текст варианта; id остается прежним, поэтому индекс в памяти не меняется"""
+        self._db.execute("UPDATE readings SET text = ?, created = ? WHERE id = ?", (text, time.time(), row_id))
+
+    def missing(self, variants: int) -> list:
+        """Каких вариантов не хватает: [(вид, карта, перевернута, сколько)]"""
+        return [
+            (kind, card, reversed_, variants - self.count(kind, card, reversed_))
+            for kind in KINDS for card in DECK for reversed_ in (False, True)
+            if self.count(kind, card, reversed_) < variants
+        ]
+
+    def oldest(self, limit: int, older_than: float = 0) -> list:
+        """Самые старые варианты: [(id, вид, карта, перевернута)]"""
+        rows = self._db.execute(
+            "SELECT id, kind, card, reversed FROM readings WHERE created < ? ORDER BY created LIMIT ?",
+            (time.time() - older_than, limit)
+        ).fetchall()
+        return [(row_id, kind, card, bool(reversed_)) for row_id, kind, card, reversed_ in rows]
+
+    def stats(self) -> dict:
+        return {
+            "readings": sum(len(ids) for ids in self._ids.values()),
+            "cards": len(self._ids),
+        }
+
+    def close(self):
+        self._db.close()
+
+
+def generate(kind: str, card: str, reversed_: bool):
+    """Один вариант толкования от YandexGPT или None при ошибке"""
+    template = KINDS[kind]
+    text = make_zap(template.messages(card=card_label(card, reversed_)), template.max_tokens)
+    return text if text and text != ERROR_TEXT else None
+
+
+def build(library: TarotLibrary, variants: int, workers: int) -> int:
+    """Догенерирует недостающие варианты. Возвращает число новых толкований.
+
+    Разные карты генерируются параллельно, варианты одной карты - по очереди:
+    одинаковые одновременные промпты singleflight склеил бы в один ответ.
+    """
+
+    def generate_all(kind, card, reversed_, count):
+        return kind, card, reversed_, [generate(kind, card, reversed_) for _ in range(count)]
+
+    added = 0
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(generate_all, *item) for item in library.missing(variants)]
+        # Запись в базу только из этого потока
+        for future in as_completed(futures):
+            kind, card, reversed_, texts = future.result()
+            for text in filter(None, texts):
+                library.add(kind, card, reversed_, text)
+                added += 1
+    return added
+
+
+async def refresh(library: TarotLibrary, batch: int, older_than: float = 0) -> int:
+    """Перегенерирует batch самых старых вариантов. Возвращает число обновленных"""
+    updated = 0
+    for row_id, kind, card, reversed_ in library.oldest(batch, older_than):
+        text = await asyncio.to_thread(generate, kind, card, reversed_)
+        if text is not None:
+            library.replace(row_id, text)
+            updated += 1
+    return updated
+
+
+async def run_refresh(library: TarotLibrary, interval: float = TAROT_REFRESH_INTERVAL,
+                      batch: int = TAROT_REFRESH_BATCH):
+    """Фоновая задача: раз в interval секунд обновляет batch вариантов старше interval"""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            updated = await refresh(library, batch, older_than=interval)
+            logger.info(f"Библиотека таро: обновлено {updated} толкований")
+        except Exception as e:
+            logger.error(f"Не удалось обновить библиотеку таро: {e}")
+
+
+_library = None
+
+
+def get_library():
+    """Общая на процесс библиотека или None, если она не собрана (открывается при первом обращении)"""
+    global _library
+    if _library is None and os.path.exists(TAROT_LIBRARY_PATH):
+        _library = TarotLibrary(TAROT_LIBRARY_PATH)
+    return _library
+
+
+def close_library():
+    global _library
+    if _library is not None:
+        _library.close()
+        _library = None
+
+
+def pick_reading(kind: str, card: str):
+    """Готовое толкование карты ("Башня" или "Башня (перевернутая)") или None"""
+    parsed = parse_card(card)
+    library = get_library()
+    if parsed is None or library is None:
+        return None
+    return library.pick(kind, *parsed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=("build", "refresh", "stats", "pick"))
+    parser.add_argument("--path", default=TAROT_LIBRARY_PATH, help="Файл библиотеки SQLite")
+    parser.add_argument("--variants", type=int, default=TAROT_VARIANTS, help="Вариантов на карту и положение")
+    parser.add_argument("--workers", type=int, default=4, help="Одновременных запросов к YandexGPT при сборке")
+    parser.add_argument("--batch", type=int, default=TAROT_REFRESH_BATCH, help="Сколько вариантов обновить за проход")
+    parser.add_argument("--interval", type=float, default=0,
+                        help="Для refresh: повторять раз в столько секунд (0 - один проход)")
+    parser.add_argument("--card", default="Шут", help="Для pick: карта, например \"Башня (перевернутая)\"")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    library = TarotLibrary(args.path)
+    audit_log = open_audit_log() if args.command in ("build", "refresh") else None
+    try:
+        if args.command == "build":
+            added = build(library, args.variants, args.workers)
+            print(f"Добавлено толкований: {added}, не хватает: {len(library.missing(args.variants))} карт")
+        elif args.command == "refresh":
+            if args.interval:
+                asyncio.run(run_refresh(library, args.interval, args.batch))
+            else:
+                print(f"Обновлено толкований: {asyncio.run(refresh(library, args.batch))}")
+        elif args.command == "pick":
+            parsed = parse_card(args.card)
+            if parsed is None:
+                parser.error(f"Неизвестная карта: {args.card}")
+            started = time.perf_counter()
+            text = library.pick("daycard", *parsed)
+            print(f"{text}\n({(time.perf_counter() - started) * 1000:.3f} мс)")
+        else:
+            print(library.stats())
+    finally:
+        library.close()
+        if audit_log is not None:
+            audit_log.close()
+
+
+if __name__ == "__main__":
+    main()
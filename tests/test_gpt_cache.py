@@ -0,0 +1,50 @@
+import asyncio
+import threading
+
+from gpt_cache import AnswerCache
+
+
+def test_disk_tier_is_read_outside_the_event_loop(tmp_path):
+    path = str(tmp_path / "answers.sqlite3")
+    writer = AnswerCache(10, 60, path)
+    writer.set("key", "Ответ")
+    writer.close()
+
+    cache = AnswerCache(10, 60, path)
+    threads = set()
+    db = cache._db
+
+    class Connection:
+        def execute(self, *args):
+            threads.add(threading.current_thread().name)
+            return db.execute(*args)
+
+        def close(self):
+            db.close()
+
+    cache._db = Connection()
+    answer = asyncio.run(asyncio.wait_for(cache.get_async("key"), 5))
+    assert answer == "Ответ" and cache.disk_hits == 1
+    assert threads and threading.main_thread().name not in threads
+    # Поднятый с диска ответ теперь отдается из памяти
+    assert cache.get("key") == "Ответ" and cache.disk_hits == 1
+    cache.close()
+
+
+def test_memory_tier_is_shared_by_threads():
+    cache = AnswerCache(50, 60)
+
+    def worker(offset):
+        for i in range(2000):
+            key = str((i + offset) % 80)
+            if cache.get(key) is None:
+                cache.set(key, key)
+
+    threads = [threading.Thread(target=worker, args=(n * 7,)) for n in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    stats = cache.stats()
+    assert stats["size"] == 50
+    assert stats["hits"] + stats["misses"] == 8 * 2000
@@ -0,0 +1,132 @@
+import asyncio
+import itertools
+import json
+
+import pytest
+
+import llm_client
+import resilience
+from llm_limiter import LLMLimiter
+from resilience import CircuitBreaker
+
+
+@pytest.fixture(autouse=True)
+def fresh_breaker(monkeypatch):
+    monkeypatch.setattr(llm_client, "breaker", CircuitBreaker(100, 30))
+
+
+def answer(text: str) -> dict:
+    return {"alternatives": [{"message": {"role": "assistant", "text": text}}]}
+
+
+def test_operation_poll_gives_up_after_timeout(monkeypatch):
+    monkeypatch.setitem(llm_client.md, "poll_interval", 0.01)
+    monkeypatch.setitem(llm_client.md, "poll_timeout", 0.05)
+
+    async def call(method, url, semaphore, cost=None, **kwargs):
+        return {"id": "op", "done": False}
+
+    monkeypatch.setattr(llm_client, "_call", call)
+    prompts = [llm_client.build_prompt([{"role": "user", "text": "расклад"}])]
+    answers = asyncio.run(asyncio.wait_for(llm_client.batch_zap(prompts, "operation"), 1))
+    assert answers == [llm_client.ERROR_TEXT]
+
+
+def test_outstanding_operations_are_capped(monkeypatch):
+    monkeypatch.setitem(llm_client.md, "poll_interval", 0.01)
+    monkeypatch.setitem(llm_client.md, "batch_outstanding", 3)
+    operations = {}
+    ids = itertools.count()
+    peak = []
+
+    async def call(method, url, semaphore, cost=None, **kwargs):
+        if method == "POST":
+            operation_id = str(next(ids))
+            operations[operation_id] = 0
+            peak.append(len(operations))
+            return {"id": operation_id, "done": False}
+        operation_id = url.rsplit("/", 1)[1]
+        operations[operation_id] += 1
+        if operations[operation_id] < 3:
+            return {"id": operation_id, "done": False}
+        del operations[operation_id]
+        return {"id": operation_id, "done": True, "response": answer("ответ")}
+
+    monkeypatch.setattr(llm_client, "_call", call)
+    prompts = [llm_client.build_prompt([{"role": "user", "text": f"расклад {i}"}]) for i in range(10)]
+    answers = asyncio.run(asyncio.wait_for(llm_client.batch_zap(prompts, "operation"), 2))
+    assert answers == ["ответ"] * 10
+    assert max(peak) == 3
+
+
+class FakeResponse:
+    def __init__(self, status: int, lines: list = ()):
+        self.status = status
+        self.headers = {}
+        self.content = self._lines(lines)
+
+    @staticmethod
+    async def _lines(lines):
+        for line in lines:
+            yield line
+
+    def release(self):
+        pass
+
+
+def test_stream_releases_limiter_slot_during_backoff(monkeypatch):
+    limiter = LLMLimiter(1)
+    monkeypatch.setattr(llm_client, "llm_limiter", limiter)
+    monkeypatch.setitem(llm_client.md, "retry_base_delay", 0.05)
+    monkeypatch.setattr(resilience.random, "uniform", lambda low, high: high)
+    active_on_post = []
+
+    class Session:
+        def __init__(self):
+            self.responses = [
+                FakeResponse(503),
+                FakeResponse(200, [json.dumps({"result": answer("ответ")}).encode()]),
+            ]
+
+        async def post(self, url, **kwargs):
+            active_on_post.append(limiter.active)
+            return self.responses.pop(0)
+
+    session = Session()
+    monkeypatch.setattr(llm_client, "get_session", lambda: session)
+
+    async def scenario():
+        stream = llm_client.stream_zap([{"role": "user", "text": "вопрос"}])
+        opened = asyncio.create_task(anext(stream))
+        await asyncio.sleep(0.02)
+        # Первая попытка не удалась, идет пауза перед повтором: место свободно
+        assert limiter.active == 0
+        text = await opened
+        assert limiter.active == 1
+        await stream.aclose()
+        return text
+
+    assert asyncio.run(asyncio.wait_for(scenario(), 1)) == "ответ"
+    assert active_on_post == [1, 1]
+    assert limiter.active == 0
+
+
+def test_aborted_stream_reports_streamed_text(monkeypatch):
+    monkeypatch.setattr(llm_client, "llm_limiter", LLMLimiter(1))
+    events = []
+    monkeypatch.setattr(llm_client, "hooks", [events.append])
+    lines = [json.dumps({"result": answer(text)}).encode() for text in ("Нача", "Начало ответа")]
+
+    class Session:
+        async def post(self, url, **kwargs):
+            return FakeResponse(200, lines)
+
+    monkeypatch.setattr(llm_client, "get_session", lambda: Session())
+
+    async def scenario():
+        stream = llm_client.stream_zap([{"role": "user", "text": "вопрос"}], user_id=1)
+        await anext(stream)
+        await stream.aclose()
+
+    asyncio.run(asyncio.wait_for(scenario(), 1))
+    assert [(event["status"], event["text"], event["user_id"]) for event in events] == [("error", "Нача", 1)]
@@ -0,0 +1,155 @@
+import asyncio
+import threading
+import time
+
+from llm_limiter import LLMLimiter
+
+
+def run(coro):
+    return asyncio.run(asyncio.wait_for(coro, 1))
+
+
+def test_zero_concurrency_means_unlimited():
+    async def scenario():
+        limiter = LLMLimiter(0, 0, 0)
+        for _ in range(50):
+            await limiter.acquire("user")
+        assert limiter.active == 50
+
+    run(scenario())
+
+
+def test_zero_concurrency_with_rps_limit_still_grants():
+    async def scenario():
+        limiter = LLMLimiter(0, 10, 0)
+        await limiter.acquire("user")
+        limiter.release()
+
+    run(scenario())
+
+
+def test_concurrency_limit_queues_extra_requests():
+    async def scenario():
+        limiter = LLMLimiter(2)
+        await limiter.acquire(1)
+        await limiter.acquire(2)
+        waiter = asyncio.ensure_future(limiter.acquire(3))
+        await asyncio.sleep(0)
+        assert not waiter.done() and limiter.waiting == 1
+        limiter.release()
+        await waiter
+        assert limiter.active == 2
+
+    run(scenario())
+
+
+def test_waiters_are_served_round_robin_between_users():
+    async def scenario():
+        limiter = LLMLimiter(1)
+        await limiter.acquire("busy")
+        order = []
+
+        async def request(user_id, n):
+            await limiter.acquire(user_id)
+            order.append((user_id, n))
+            limiter.release()
+
+        tasks = [asyncio.ensure_future(request("a", n)) for n in range(2)]
+        tasks.append(asyncio.ensure_future(request("b", 0)))
+        await asyncio.sleep(0)
+        limiter.release()
+        await asyncio.gather(*tasks)
+        assert order == [("a", 0), ("b", 0), ("a", 1)]
+
+    run(scenario())
+
+
+def test_sync_slots_share_limit_without_event_loop():
+    limiter = LLMLimiter(2, 0, 0)
+    peak = []
+
+    def call():
+        with limiter.slot_sync():
+            peak.append(limiter.active)
+            time.sleep(0.02)
+
+    threads = [threading.Thread(target=call) for _ in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(1)
+    assert len(peak) == 6 and max(peak) <= 2
+
+
+def test_sync_slots_wait_for_async_ones():
+    async def scenario():
+        limiter = LLMLimiter(1, 0, 0)
+        order = []
+
+        def call():
+            with limiter.slot_sync():
+                order.append("sync")
+
+        async with limiter.slot("user"):
+            worker = asyncio.create_task(asyncio.to_thread(call))
+            await asyncio.sleep(0.05)
+            order.append("async")
+        await worker
+        assert order == ["async", "sync"] and limiter.active == 0
+
+    run(scenario())
+
+
+def test_bound_loop_stays_owner_when_thread_comes_first():
+    async def scenario():
+        loop = asyncio.get_running_loop()
+        limiter = LLMLimiter(1, 0, 0)
+        limiter.bind(loop)
+
+        def call():
+            with limiter.slot_sync():
+                pass
+
+        await asyncio.to_thread(call)
+        assert limiter._owner(loop) is loop
+
+    run(scenario())
+
+
+def test_positions_are_reported_on_waiter_loop():
+    limiter = LLMLimiter(1, 0, 0)
+    release = threading.Event()
+    entered = threading.Event()
+
+    def hold():
+        # Поток обращается к ограничителю первым, и тот запускает собственный цикл
+        with limiter.slot_sync():
+            entered.set()
+            release.wait(1)
+
+    holder = threading.Thread(target=hold)
+    holder.start()
+    entered.wait(1)
+
+    async def scenario():
+        loop = asyncio.get_running_loop()
+        reported = []
+
+        async def on_position(position: int):
+            reported.append((position, asyncio.get_running_loop() is loop))
+
+        async def ask():
+            async with limiter.slot("user", on_position=on_position):
+                pass
+
+        waiting = asyncio.create_task(ask())
+        await asyncio.sleep(0.05)
+        release.set()
+        await waiting
+        return reported
+
+    try:
+        assert run(scenario()) == [(1, True)]
+    finally:
+        release.set()
+        holder.join(1)
@@ -0,0 +1,41 @@
+import pytest
+
+from quiz_index import entity_terms, quiz_index
+
+
+def answer_for(question: str):
+    match = quiz_index.search(question)
+    return match.document.answer if match and match.confident else None
+
+
+@pytest.mark.parametrize("question, expected", [
+    ("Что такое НЭВЗ?", "НЭВЗ — Новочеркасский"),
+    ("Что значит БМЗ", "БМЗ — Брянский"),
+    ("Кто основал Коломенский завод?", "Коломенский завод вырос"),
+    ("Почему ТЭП70БС называют тапок?", "Пассажирский тепловоз ТЭП70БС"),
+    ("Кто строит электровозы в России?", "Флагман отечественного"),
+])
+def test_faq_answers_matching_questions(question, expected):
+    assert answer_for(question).startswith(expected)
+
+
+@pytest.mark.parametrize("question", [
+    "Что выпускает Коломенский завод?",  # ответ БМЗ про выпуск не о Коломне
+    "Кто строит тепловозы в России?",  # FAQ про электровозы
+    "Где находится Брянский завод?",  # в ответе нет местоположения
+    "что выпускает завод",  # не назван ни один завод
+    "Сколько электровозов выпустил НЭВЗ в 1990 году?",
+    "Когда построили первый паровоз?",
+])
+def test_faq_does_not_answer_other_questions(question):
+    assert answer_for(question) is None
+
+
+def test_unanswered_question_still_gets_context():
+    match = quiz_index.search("Что выпускает Коломенский завод?")
+    assert match is not None and not match.confident
+
+
+def test_entity_terms():
+    assert entity_terms("Что такое КЗ? Коломенский завод, чем известен Коломенский завод?") == {"кз", "колом"}
+    assert entity_terms("Почему ТЭП70БС называют Тапок?") == {"тэп70", "тапок"}
@@ -0,0 +1,44 @@
+import threading
+
+import pytest
+
+import llm_client
+from resilience import CircuitBreaker, LLMError
+
+
+@pytest.fixture
+def breaker(monkeypatch):
+    breaker = CircuitBreaker(2, 30)
+    monkeypatch.setattr(llm_client, "breaker", breaker)
+    return breaker
+
+
+def test_client_error_does_not_change_breaker(breaker):
+    breaker.record_failure()
+    breaker.record_failure()
+    breaker.opened_at -= 30  # Прошел reset_timeout: пробный запрос
+    assert breaker.allow()
+    llm_client._record(LLMError("YandexGPT вернул 400", status=400))
+    assert breaker.state == "half-open" and not breaker.allow()
+
+
+@pytest.mark.parametrize("status", [401, 403])
+def test_auth_errors_open_breaker(breaker, status):
+    for _ in range(2):
+        llm_client._record(LLMError(f"YandexGPT вернул {status}", status=status))
+    assert breaker.state == "open"
+
+
+def test_failures_from_threads_are_all_counted():
+    breaker = CircuitBreaker(10 ** 6, 30)
+
+    def fail():
+        for _ in range(10000):
+            breaker.record_failure()
+
+    threads = [threading.Thread(target=fail) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert breaker.failures == 40000
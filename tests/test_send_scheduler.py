@@ -0,0 +1,26 @@
+import asyncio
+
+from send_scheduler import SendScheduler, background_sending
+
+
+def test_interactive_sends_overtake_background_edits():
+    async def scenario():
+        scheduler = SendScheduler(global_rate=20, chat_rate=0, chat_burst=0, max_retries=0)
+        order = []
+
+        async def send(name: str, chat_id: int):
+            await scheduler._acquire(chat_id)
+            order.append(name)
+
+        async def background(name: str, chat_id: int):
+            with background_sending():
+                await send(name, chat_id)
+
+        scheduler._global.tokens = 0  # Общий лимит исчерпан: оба запроса ждут в очереди
+        tasks = [asyncio.create_task(background("stream", 1))]
+        await asyncio.sleep(0)
+        tasks.append(asyncio.create_task(send("screen", 2)))
+        await asyncio.gather(*tasks)
+        return order
+
+    assert asyncio.run(asyncio.wait_for(scenario(), 1)) == ["screen", "stream"]
@@ -0,0 +1,41 @@
+import asyncio
+import threading
+
+import pytest
+
+from storage import QuizSession, ResultsStorage, SQLiteDatabase, SQLiteResultsStorage
+
+
+def test_incomplete_results_storage_fails_on_construction():
+    class GetOnly(ResultsStorage):
+        async def get(self, user_id):
+            return None
+
+    with pytest.raises(TypeError):
+        GetOnly()
+
+
+def test_sqlite_queries_run_outside_the_event_loop(tmp_path):
+    db = SQLiteDatabase(str(tmp_path / "storage.sqlite3"))
+    results = SQLiteResultsStorage(db, ttl=60)
+    conn = db.conn
+    threads = set()
+
+    class Connection:
+        def execute(self, *args):
+            threads.add(threading.current_thread().name)
+            return conn.execute(*args)
+
+    async def scenario():
+        db.conn = Connection()
+        session = QuizSession("quiz", step=2)
+        session.record(1, True)
+        await results.set(7, session)
+        loaded = await results.get(7)
+        db.conn = conn
+        await results.close()
+        return loaded
+
+    loaded = asyncio.run(asyncio.wait_for(scenario(), 5))
+    assert (loaded.quiz, loaded.step, loaded.correct_answers) == ("quiz", 2, 1)
+    assert threads and threading.main_thread().name not in threads
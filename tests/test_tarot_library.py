@@ -0,0 +1,39 @@
+import pytest
+
+import gpt_requests
+import tarot_library
+
+
+@pytest.fixture
+def library(tmp_path, monkeypatch):
+    path = tmp_path / "tarot.sqlite3"
+    tarot_library.TarotLibrary(str(path)).close()
+    monkeypatch.setattr(tarot_library, "TAROT_LIBRARY_PATH", str(path))
+    monkeypatch.setattr(gpt_requests, "make_zap", lambda messages, max_tokens=None: "ответ YandexGPT")
+    yield tarot_library.get_library()
+    tarot_library.close_library()
+
+
+def test_daycard_uses_library(library):
+    assert gpt_requests.daycard("Башня") == "ответ YandexGPT"
+    library.add("daycard", "Башня", False, "готовая карта дня")
+    assert gpt_requests.daycard("Башня") == "готовая карта дня"
+    assert gpt_requests.daycard("Башня (перевернутая)") == "ответ YandexGPT"
+
+
+def test_card_meaning_uses_library(library):
+    library.add("meaning", "Луна", True, "тревога")
+    assert gpt_requests.card_meaning("Луна (перевернутая)") == "тревога"
+
+
+def test_spreads_are_always_written_by_model(library):
+    library.add("meaning", "Башня", False, "перемены")
+    assert gpt_requests.star7("Вам выпали карты: Башня") == "ответ YandexGPT"
+
+
+def test_missing_library_is_not_created(tmp_path, monkeypatch):
+    path = tmp_path / "data" / "tarot.sqlite3"
+    monkeypatch.setattr(tarot_library, "TAROT_LIBRARY_PATH", str(path))
+    monkeypatch.setattr(gpt_requests, "make_zap", lambda messages, max_tokens=None: "ответ YandexGPT")
+    assert gpt_requests.daycard("Башня") == "ответ YandexGPT"
+    assert not path.parent.exists()
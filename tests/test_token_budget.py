@@ -0,0 +1,38 @@
+from token_budget import TokenBudget
+
+
+def event(status: str, total: int, user_id=1) -> dict:
+    return {
+        "status": status, "usage": {"totalTokens": str(total)}, "messages": [], "text": None, "user_id": user_id,
+    }
+
+
+def test_only_successful_requests_are_counted():
+    budget = TokenBudget(total_limit=0, user_limit=100)
+    budget.record(event("error", 500))
+    budget.record(event("fallback", 500))
+    assert budget.spent(1) == 0 and not budget.exhausted(1)
+    budget.record(event("ok", 100))
+    assert budget.spent(1) == 100 and budget.exhausted(1)
+    assert not budget.exhausted(2)
+
+
+def test_total_limit_applies_to_everyone():
+    budget = TokenBudget(total_limit=100)
+    budget.record(event("ok", 60, user_id=1))
+    budget.record(event("ok", 60, user_id=2))
+    assert budget.exhausted(3)
+
+
+def test_background_requests_are_not_counted():
+    budget = TokenBudget(total_limit=100)
+    budget.record(event("ok", 500, user_id=None))
+    assert budget.stats()["total"] == 0 and not budget.exhausted(1)
+
+
+def test_partially_streamed_answer_is_counted():
+    budget = TokenBudget(user_limit=1000)
+    partial = event("error", 0)
+    partial.update(usage=None, messages=[{"role": "user", "text": "вопрос" * 7}], text="ответ" * 7)
+    budget.record(partial)
+    assert budget.spent(1) == 22
@@ -0,0 +1,62 @@
+import asyncio
+
+import pytest
+from aiogram.types import Update
+
+import webhook
+from webhook import UpdateQueue
+
+
+def message_update(update_id: int, user_id: int) -> Update:
+    return Update.model_validate({
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id, "date": 0, "text": "/start",
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": "Тест"},
+        },
+    })
+
+
+class FakeDispatcher:
+    def __init__(self):
+        self.release = asyncio.Event()
+        self.handled = []
+
+    async def feed_update(self, bot, update: Update):
+        if update.message.from_user.id == 1:
+            await self.release.wait()
+        self.handled.append(update.update_id)
+
+
+def test_busy_user_does_not_block_workers():
+    async def scenario():
+        dp = FakeDispatcher()
+        updates = UpdateQueue(dp, None, workers=2, maxsize=100, put_timeout=1, user_backlog=3)
+        await updates.start()
+        for update_id in range(1, 7):
+            await updates.put(message_update(update_id, 1))
+        await updates.put(message_update(100, 2))
+        await asyncio.wait_for(_until(lambda: 100 in dp.handled), 1)
+        assert updates.deferred == 3
+        assert updates.dropped == 2
+
+        dp.release.set()
+        await asyncio.wait_for(updates.queue.join(), 1)
+        await updates.stop()
+        return dp.handled
+
+    handled = asyncio.run(scenario())
+    assert handled == [100, 1, 2, 3, 4]
+
+
+async def _until(condition):
+    while not condition():
+        await asyncio.sleep(0.001)
+
+
+def test_public_webhook_requires_secret(monkeypatch):
+    monkeypatch.setattr(webhook, "WEBHOOK_URL", "https://example.com")
+    monkeypatch.setattr(webhook, "WEBHOOK_SECRET", "")
+    with pytest.raises(ValueError):
+        webhook.create_app(None, None)
@@ -0,0 +1,39 @@
+import asyncio
+from contextlib import aclosing
+
+import pytest
+
+import yandex_gpt
+from gpt_cache import AnswerCache
+from llm_client import ERROR_TEXT
+
+
+@pytest.fixture(autouse=True)
+def memory_cache(monkeypatch):
+    monkeypatch.setattr(yandex_gpt, "answer_cache", AnswerCache(100, 60))
+
+
+def test_aborted_stream_is_not_shared_as_answer(monkeypatch):
+    async def stream_zap(messages, max_tokens=None, **kwargs):
+        yield "Недописан"
+        await asyncio.sleep(1)
+        yield "Недописанный ответ"
+
+    monkeypatch.setattr(yandex_gpt, "stream_zap", stream_zap)
+
+    async def follower():
+        async for text in yandex_gpt.ask_yandex_gpt_stream("Что такое НЭВЗ?"):
+            return text
+
+    async def scenario():
+        async with aclosing(yandex_gpt.ask_yandex_gpt_stream("Что такое НЭВЗ?")) as stream:
+            first = await anext(stream)
+            waiting = asyncio.create_task(follower())
+            await asyncio.sleep(0)
+        return first, await waiting
+
+    first, shared = asyncio.run(asyncio.wait_for(scenario(), 1))
+    assert first == "Недописан"
+    assert shared == ERROR_TEXT
+    key = yandex_gpt.make_key("Что такое НЭВЗ?", yandex_gpt.build_system_prompt(None), None)
+    assert yandex_gpt.answer_cache.get(key) is None
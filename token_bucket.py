@@ -0,0 +1,29 @@
+import time
+
+
+class TokenBucket:
+    """Ведро токенов: rate единиц в секунду, не больше capacity про запас. rate=0 - без ограничения"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, amount: float, now: float) -> float:
+        """Сколько секунд ждать, пока в ведре наберется amount"""
+        if not self.rate:
+            return 0.0
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def take(self, amount: float):
+        if self.rate:
+            self.tokens -= min(amount, self.capacity)
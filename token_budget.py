@@ -0,0 +1,135 @@
+import logging
+import math
+import re
+import time
+
+from config import (
+    model_data as md, LLM_QUESTION_MAX_TOKENS, LLM_MAX_TOKENS_FACT, LLM_MAX_TOKENS_EXPLAIN,
+    LLM_BUDGET_TOTAL, LLM_BUDGET_USER, LLM_BUDGET_WINDOW
+)
+
+logger = logging.getLogger(__name__)
+
+# Токенизатор YandexGPT недоступен локально; для русского текста в среднем около 3.5 символа на токен
+CHARS_PER_TOKEN = 3.5
+
+# Вопросы, на которые нужен развернутый ответ
+_EXPLAIN = re.compile(
+    r"\b(почему|зачем|как\s+работа|как\s+устроен|объясн|расскаж|опиш|подробн|"
+    r"в\s+ч[её]м\s+(разница|отлич|смысл)|чем\s+отлича|сравн|историю)",
+    re.IGNORECASE
+)
+# Вопрос длиннее стольких слов обычно тоже требует развернутого ответа
+_EXPLAIN_WORDS = 25
+
+
+def estimate_tokens(text: str) -> int:
+    """Грубая оценка числа токенов текста"""
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def truncate(text: str, max_tokens: int) -> str:
+    """Обрезает текст до max_tokens по границе слова"""
+    limit = int(max_tokens * CHARS_PER_TOKEN)
+    if len(text) <= limit:
+        return text
+    cut = text[:limit]
+    space = cut.rfind(" ")
+    if space > limit // 2:
+        cut = cut[:space]
+    return cut.rstrip() + "…"
+
+
+def classify(question: str) -> str:
+    """Класс вопроса: fact - короткий фактический, explain - нужен развернутый ответ"""
+    if _EXPLAIN.search(question) or len(question.split()) > _EXPLAIN_WORDS:
+        return "explain"
+    return "fact"
+
+
+MAX_TOKENS = {
+    "fact": LLM_MAX_TOKENS_FACT,
+    "explain": LLM_MAX_TOKENS_EXPLAIN or md['max_tokens'],
+}
+
+
+def prepare_question(question: str, max_input: int = LLM_QUESTION_MAX_TOKENS):
+    """Вопрос пользователя для YandexGPT: (обрезанный текст, maxTokens ответа)"""
+    question = question.strip()
+    if max_input and estimate_tokens(question) > max_input:
+        question = truncate(question, max_input)
+    return question, MAX_TOKENS[classify(question)]
+
+
+class TokenBudget:
+    """Учет потраченных токенов за окно window секунд: всего и по пользователям.
+
+    Окна фиксированные (например, сутки с полуночи UTC при window=86400).
+    Лимит 0 - без ограничения. Учитываются только вопросы пользователей (запросы
+    с user_id): фоновые расклады таро и пакеты бюджет вопросов не расходуют.
+    Расход берется из usage в ответе YandexGPT, а если его нет - из оценки длины
+    промпта и ответа.
+    """
+
+    def __init__(self, total_limit: int = 0, user_limit: int = 0, window: float = 86400):
+        self.total_limit = total_limit
+        self.user_limit = user_limit
+        self.window = window
+        self._window_start = self._current_window()
+        self.total = 0
+        self._users = {}  # пользователь -> токены в текущем окне
+        self.rejected = 0
+
+    def _current_window(self) -> float:
+        now = time.time()
+        return now - now % self.window
+
+    def _roll(self):
+        window_start = self._current_window()
+        if window_start != self._window_start:
+            self._window_start = window_start
+            self.total = 0
+            self._users.clear()
+
+    def spent(self, user_id) -> int:
+        self._roll()
+        return self._users.get(user_id, 0)
+
+    def exhausted(self, user_id) -> bool:
+        """Исчерпан ли бюджет пользователя или общий в текущем окне"""
+        self._roll()
+        return bool(
+            (self.total_limit and self.total >= self.total_limit)
+            or (self.user_limit and self._users.get(user_id, 0) >= self.user_limit)
+        )
+
+    def reject(self):
+        """Учитывает вопрос, оставленный без ответа из-за исчерпанного бюджета"""
+        self.rejected += 1
+
+    def record(self, event: dict):
+        """Хук llm_client: учитывает токены завершенного запроса пользователя.
+        Запросы, не дошедшие до модели или завершившиеся ошибкой без ответа, не учитываются;
+        у оборванного потока учитывается выданная часть ответа
+        """
+        user_id = event["user_id"]
+        status = event["status"]
+        if user_id is None or status == "fallback" or (status == "error" and not event["text"]):
+            return
+        usage = event["usage"]
+        if usage:
+            tokens = int(usage.get("totalTokens") or 0)
+        else:
+            prompt = sum(estimate_tokens(message["text"]) for message in event["messages"])
+            tokens = prompt + estimate_tokens(event["text"] or "")
+        self._roll()
+        self.total += tokens
+        self._users[user_id] = self._users.get(user_id, 0) + tokens
+
+    def stats(self) -> dict:
+        self._roll()
+        return {"total": self.total, "users": len(self._users), "rejected": self.rejected}
+
+
+# Общий на процесс бюджет токенов
+token_budget = TokenBudget(LLM_BUDGET_TOTAL, LLM_BUDGET_USER, LLM_BUDGET_WINDOW)
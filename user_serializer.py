@@ -0,0 +1,64 @@
+import asyncio
+import logging
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+
+from aiogram import BaseMiddleware
+from aiogram.types import Update
+
+logger = logging.getLogger(__name__)
+
+
+class _UserLock:
+    __slots__ = ("lock", "users")
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.users = 0  # Сколько обработчиков держат или ждут замок
+
+
+class UserSerializer(BaseMiddleware):
+    """Обрабатывает апдейты одного пользователя по очереди, в порядке поступления.
+
+    Апдейты разных пользователей по-прежнему идут параллельно. Повторная доставка
+    нажатия с тем же callback id отбрасывается до обработчика. Замок пользователя
+    удаляется, когда его никто не ждет, поэтому словарь не растет.
+    """
+
+    def __init__(self, seen_limit: int = 10000):
+        self.seen_limit = seen_limit
+        self._locks = {}  # user_id -> _UserLock
+        self._seen = OrderedDict()  # id последних нажатий
+        self.duplicates = 0
+
+    async def __call__(self, handler, event: Update, data: dict):
+        callback = event.callback_query
+        if callback is not None:
+            if callback.id in self._seen:
+                self.duplicates += 1
+                logger.info(f"Повтор нажатия {callback.id} отброшен")
+                return None
+            self._seen[callback.id] = True
+            if len(self._seen) > self.seen_limit:
+                self._seen.popitem(last=False)
+
+        user = data.get("event_from_user")
+        if user is None:
+            return await handler(event, data)
+        async with self.lock(user.id):
+            return await handler(event, data)
+
+    @asynccontextmanager
+    async def lock(self, user_id: int):
+        """Замок пользователя: код внутри блока не пересекается с обработкой его апдейтов"""
+        entry = self._locks.get(user_id)
+        if entry is None:
+            entry = self._locks[user_id] = _UserLock()
+        entry.users += 1
+        try:
+            async with entry.lock:
+                yield
+        finally:
+            entry.users -= 1
+            if not entry.users:
+                del self._locks[user_id]
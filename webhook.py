@@ -0,0 +1,177 @@
+import asyncio
+import hmac
+import logging
+from collections import deque
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+from aiogram.webhook.aiohttp_server import setup_application
+
+from metrics import registry
+
+from config import (
+    WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_SECRET, WEBHOOK_HOST, WEBHOOK_PORT,
+    WEBHOOK_WORKERS, WEBHOOK_QUEUE_SIZE, WEBHOOK_QUEUE_TIMEOUT, WEBHOOK_USER_BACKLOG
+)
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+class UpdateQueue:
+    """Ограниченная очередь апдейтов с фиксированным числом обработчиков.
+
+    Вебхук только кладет апдейт в очередь и сразу отвечает Telegram. Если очередь
+    заполнена дольше put_timeout, апдейт не принимается: Telegram получит 503
+    и повторит доставку позже (обратное давление).
+
+    Апдейты одного пользователя обрабатывает один обработчик по очереди: пока
+    пользователь занят (например, ждет ответа YandexGPT), его новые апдейты
+    откладываются в его собственную очередь, а остальные обработчики свободны
+    для других пользователей. Сверх user_backlog отложенных апдейты отбрасываются.
+    """
+
+    def __init__(self, dp: Dispatcher, bot: Bot, workers: int, maxsize: int, put_timeout: float,
+                 user_backlog: int = WEBHOOK_USER_BACKLOG):
+        self.dp = dp
+        self.bot = bot
+        self.workers = workers
+        self.put_timeout = put_timeout
+        self.user_backlog = user_backlog
+        self.queue = asyncio.Queue(maxsize=maxsize)
+        self._backlogs = {}  # user_id занятого пользователя -> deque отложенных апдейтов
+        self._tasks = []
+        self.dropped = 0
+
+    async def start(self):
+        """Запускает обработчики очереди"""
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self, drain_timeout: float = 10.0):
+        """Дообрабатывает очередь и останавливает обработчики"""
+        try:
+            await asyncio.wait_for(self.queue.join(), drain_timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Не успели обработать {self.queue.qsize()} апдейтов до остановки")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def put(self, update: Update) -> bool:
+        """Ставит апдейт в очередь; False, если очередь переполнена"""
+        try:
+            await asyncio.wait_for(self.queue.put(update), self.put_timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    @property
+    def deferred(self) -> int:
+        return sum(len(backlog) for backlog in self._backlogs.values())
+
+    @staticmethod
+    def _user_id(update: Update):
+        user = getattr(update.event, "from_user", None)
+        return user.id if user is not None else None
+
+    async def _worker(self):
+        while True:
+            update = await self.queue.get()
+            user_id = self._user_id(update)
+            if user_id is None:
+                await self._feed(update)
+                continue
+            backlog = self._backlogs.get(user_id)
+            if backlog is not None:
+                # Пользователь уже обрабатывается: апдейт дождется своей очереди, не занимая обработчик
+                if len(backlog) < self.user_backlog:
+                    backlog.append(update)
+                else:
+                    self.dropped += 1
+                    logger.warning(
+                        f"Апдейт {update.update_id} отброшен: у пользователя {user_id} слишком много ожидающих"
+                    )
+                    self.queue.task_done()
+                continue
+            backlog = self._backlogs[user_id] = deque()
+            try:
+                await self._feed(update)
+                while backlog:
+                    await self._feed(backlog.popleft())
+            finally:
+                del self._backlogs[user_id]
+
+    async def _feed(self, update: Update):
+        try:
+            await self.dp.feed_update(self.bot, update)
+        except Exception as e:
+            logger.error(f"Ошибка при обработке апдейта {update.update_id}: {e}")
+        finally:
+            self.queue.task_done()
+
+
+def create_app(dp: Dispatcher, bot: Bot) -> web.Application:
+    """Создает aiohttp-приложение, принимающее апдейты Telegram"""
+    # Без секрета любой, кто знает адрес, может присылать боту поддельные апдейты
+    if WEBHOOK_URL and not WEBHOOK_SECRET:
+        raise ValueError("Для вебхука с WEBHOOK_URL необходимо указать WEBHOOK_SECRET")
+    app = web.Application()
+    updates = UpdateQueue(dp, bot, WEBHOOK_WORKERS, WEBHOOK_QUEUE_SIZE, WEBHOOK_QUEUE_TIMEOUT)
+    registry.gauge("webhook_queue_size", "Апдейты в очереди вебхука", updates.queue.qsize)
+    registry.gauge(
+        "webhook_deferred_size", "Апдейты, ждущие окончания обработки своего пользователя", lambda: updates.deferred
+    )
+    registry.counter_func(
+        "webhook_dropped_total", "Апдейты, отброшенные из-за длинной очереди пользователя", lambda: updates.dropped
+    )
+
+    async def handle_update(request: web.Request) -> web.Response:
+        if WEBHOOK_SECRET:
+            token = request.headers.get(SECRET_HEADER, "")
+            if not hmac.compare_digest(token, WEBHOOK_SECRET):
+                return web.Response(status=401)
+
+        try:
+            update = Update.model_validate(await request.json(), context={"bot": bot})
+        except ValueError:
+            return web.Response(status=400)
+
+        if not await updates.put(update):
+            return web.Response(status=503, headers={"Retry-After": "1"})
+        return web.Response()
+
+    async def on_startup(app: web.Application):
+        await updates.start()
+        if WEBHOOK_URL:
+            await bot.set_webhook(
+                WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH,
+                secret_token=WEBHOOK_SECRET or None,
+                max_connections=WEBHOOK_WORKERS
+            )
+
+    async def on_shutdown(app: web.Application):
+        await updates.stop()
+
+    app.router.add_post(WEBHOOK_PATH, handle_update)
+    # Очередь останавливается раньше диспетчера, чтобы дообработать апдейты до закрытия хранилищ
+    app.on_startup.append(on_startup)
+    app.on_shutdown.append(on_shutdown)
+    setup_application(app, dp, bot=bot)
+    return app
+
+
+async def run_webhook(dp: Dispatcher, bot: Bot):
+    """Запускает HTTP-сервер вебхука и работает до отмены"""
+    runner = web.AppRunner(create_app(dp, bot))
+    await runner.setup()
+    site = web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT)
+    await site.start()
+    logger.info(f"Вебхук слушает {WEBHOOK_HOST}:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+        await bot.session.close()
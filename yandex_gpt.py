@@ -1,48 +1,106 @@
-import requests
-from config import model_data as md
-
-def make_zap(messages: list, max_tokens=None) -> str:
-    if max_tokens is None:
-        max_tokens = md['max_tokens']
-    
-    prompt = {
-        "modelUri": md['model_uri'],
-        "completionOptions": {
-            "stream": False,
-            "temperature": md['temperature'],
-            "maxTokens": max_tokens
-        },
-        "messages": messages
-    }
-
-    url = md['url']
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": md['authorization']
-    }
-    
-    try:
-        response = requests.post(url, headers=headers, json=prompt)
-        res = response.json()
-        r = res['result']['alternatives'][0]['message']['text']
-        r = r.replace('*', '')
-    except (IndexError, TypeError, KeyError) as e:
-        r = 'Произошла ошибка при обращении к YandexGPT. Попробуйте позже.'
-    return r
-
-def ask_yandex_gpt(question: str) -> str:
+from gpt_cache import answer_cache, make_key
+from singleflight import inflight
+from llm_client import ERROR_TEXT, PromptTemplate, make_zap, async_make_zap, stream_zap
+from quiz_data import QUIZ_QUESTIONS
+
+SYSTEM_PROMPT = "Ты эксперт по заводам, локомотивам и железнодорожной технике. Отвечай кратко и по делу."
+
+
+def build_fallback_answer() -> str:
+    """Ответ на время недоступности YandexGPT: факты из правильных ответов викторины"""
+    facts = [question['responses'][question['correct']] for question in QUIZ_QUESTIONS]
+    return (
+        "YandexGPT сейчас недоступен, попробуйте спросить чуть позже. "
+        "А пока — немного фактов из нашей викторины:\n\n"
+        + "\n\n".join(f"🚂 {fact}" for fact in facts)
+    )
+
+
+# Готовый ответ на время, пока предохранитель разомкнут
+FALLBACK_ANSWER = build_fallback_answer()
+
+
+def build_system_prompt(context: str = None) -> str:
+    """Системный промпт, при наличии - со справкой из локального индекса"""
+    if not context:
+        return SYSTEM_PROMPT
+    return f"{SYSTEM_PROMPT}\n\nСправка, которая может пригодиться для ответа:\n{context}"
+
+
+QUESTION_TEMPLATE = PromptTemplate("question", [
+    ("system", "{system}"),
+    ("user", "{question}"),
+])
+
+
+def build_question_messages(question: str, context: str = None) -> list:
+    """Список сообщений для вопроса пользователя"""
+    return QUESTION_TEMPLATE.messages(system=build_system_prompt(context), question=question)
+
+
+async def cached_answer(question: str, context: str = None, max_tokens=None):
+    """Готовый ответ из кэша или None"""
+    return await answer_cache.get_async(make_key(question, build_system_prompt(context), max_tokens))
+
+
+def ask_yandex_gpt(question: str, context: str = None, max_tokens=None) -> str:
     """Функция для задавания вопроса YandexGPT"""
-    messages = [
-        {
-            "role": "system",
-            "text": "Ты эксперт по заводам, локомотивам и железнодорожной технике. Отвечай кратко и по делу."
-        },
-        {
-            "role": "user",
-            "text": question
-        }
-    ]
-    
-    res = make_zap(messages)
+    key = make_key(question, build_system_prompt(context), max_tokens)
+    res = answer_cache.get(key)
+    if res is None:
+        messages = build_question_messages(question, context)
+        res = inflight.do_sync(key, lambda: make_zap(messages, max_tokens, fallback=FALLBACK_ANSWER))
+        if res not in (ERROR_TEXT, FALLBACK_ANSWER):
+            answer_cache.set(key, res)
     return res
 
+
+async def ask_yandex_gpt_async(question: str, context: str = None, user_id=None, on_queue=None,
+                               max_tokens=None) -> str:
+    """Асинхронная версия ask_yandex_gpt для обработчиков бота"""
+    key = make_key(question, build_system_prompt(context), max_tokens)
+    res = await answer_cache.get_async(key)
+    if res is None:
+        messages = build_question_messages(question, context)
+        res = await inflight.do(key, lambda: async_make_zap(
+            messages, max_tokens, user_id=user_id, on_queue=on_queue, fallback=FALLBACK_ANSWER
+        ))
+        if res not in (ERROR_TEXT, FALLBACK_ANSWER):
+            await answer_cache.set_async(key, res)
+    return res
+
+
+async def ask_yandex_gpt_stream(question: str, context: str = None, user_id=None, on_queue=None, max_tokens=None):
+    """Потоковая версия ask_yandex_gpt: отдает накопленный текст ответа"""
+    key = make_key(question, build_system_prompt(context), max_tokens)
+    cached = await answer_cache.get_async(key)
+    if cached is not None:
+        yield cached
+        return
+
+    # Такой же вопрос уже генерируется: ждем готовый ответ вместо второго запроса
+    pending = inflight.pending(key)
+    if pending is not None:
+        yield await inflight.wait(pending)
+        return
+
+    future = inflight.lead(key)
+    text = ""
+    try:
+        messages = build_question_messages(question, context)
+        async for text in stream_zap(messages, max_tokens, user_id=user_id, on_queue=on_queue,
+                                     fallback=FALLBACK_ANSWER):
+            yield text
+    except Exception as e:
+        future.set_exception(e)
+        raise
+    except BaseException:
+        # Поток прерван (генератор закрыт раньше времени или задача отменена):
+        # недописанный ответ ожидающим не отдаем
+        future.set_result(ERROR_TEXT)
+        raise
+    finally:
+        if not future.done():
+            future.set_result(text or ERROR_TEXT)
+    if text and text != FALLBACK_ANSWER:
+        await answer_cache.set_async(key, text)